@@ -6,19 +6,110 @@ Sistema moderno sin dependencia de Streamlit usando Flask + Leaflet
 # Importar utilidades comunes (manejo de codificación)
 import utils
 
-from flask import Flask, render_template, jsonify, request, make_response, send_from_directory
+from flask import Flask, render_template, jsonify, request, make_response, send_from_directory, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 import pandas as pd
 import numpy as np
 import io
-from datetime import datetime
+import gzip
+import hashlib
+import json
+import pickle
+import re
+from collections import OrderedDict
+from datetime import date, datetime
 from pathlib import Path
+import gc
 import os
+import shutil
+import struct
+import threading
+import time
+import uuid
+
+# Verificar si pyarrow está disponible (exportación Parquet / Arrow)
+try:
+    import pyarrow as pa
+    import pyarrow.ipc  # noqa: F401
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# Verificar si scipy está disponible (índice espacial KD-tree)
+try:
+    from scipy.spatial import cKDTree
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+# Verificar si orjson está disponible (codificación JSON rápida)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+def _json_default(obj):
+    """Convierte a JSON los tipos de numpy/pandas que el codificador no conoce."""
+    if obj is pd.NaT or obj is pd.NA:
+        return None
+    if isinstance(obj, (pd.Timestamp, datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, np.bool_):
+        return bool(obj)
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return None if np.isnan(obj) else float(obj)
+    if isinstance(obj, (np.ndarray, pd.Series, pd.Index)):
+        return obj.tolist()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Objeto de tipo {type(obj).__name__} no serializable en JSON")
+
+def _sin_nan(obj):
+    """Reemplaza recursivamente los float NaN por None (solo sin orjson)."""
+    if isinstance(obj, float):
+        return None if obj != obj else obj
+    if isinstance(obj, dict):
+        return {k: _sin_nan(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_sin_nan(v) for v in obj]
+    return obj
+
+class PandasJSONProvider(DefaultJSONProvider):
+    """Proveedor JSON de la app que entiende los tipos de numpy y pandas.
+    
+    Con orjson codifica en una sola pasada: NaN/NaT -> null, Timestamp -> ISO 8601,
+    escalares y arrays numpy de forma nativa. Sin orjson usa el módulo json estándar
+    con las mismas conversiones.
+    """
+    default = staticmethod(_json_default)
+    
+    def dumps(self, obj, **kwargs):
+        if ORJSON_AVAILABLE:
+            return self._dumps_bytes(obj).decode('utf-8')
+        return super().dumps(_sin_nan(obj), **kwargs)
+    
+    def _dumps_bytes(self, obj):
+        opciones = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            opciones |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=_json_default, option=opciones)
+    
+    def response(self, *args, **kwargs):
+        if not ORJSON_AVAILABLE:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps_bytes(obj) + b"\n", mimetype=self.mimetype)
 
 # Configurar Flask con rutas explícitas para archivos estáticos
 app = Flask(__name__, 
             static_folder='static',
             static_url_path='/static',
             template_folder='templates')
+app.json_provider_class = PandasJSONProvider
+app.json = PandasJSONProvider(app)
 
 # Configurar MIME types correctos para archivos estáticos
 @app.after_request
@@ -33,6 +124,12 @@ def set_mime_types(response):
             response.headers['Content-Type'] = 'application/json; charset=utf-8'
     return response
 
+@app.before_request
+def sincronizar_snapshot_workers():
+    """Antes de cada petición, adopta el snapshot regenerado en otro worker (ver sincronizar_snapshot)."""
+    if not request.path.startswith('/static/'):
+        sincronizar_snapshot()
+
 # ------------------------------
 # Configuración y constantes
 # ------------------------------
@@ -110,6 +207,69 @@ def parse_coordinates(coord_str):
     
     return None
 
+# Extrae las dos primeras partes de 'lat, lon' igual que parse_coordinates: si hay coma, los
+# dos primeros campos separados por coma; si no, los dos primeros tokens separados por espacios
+# (solo cuando el texto contiene un espacio ' ')
+_PATRON_COORDENADAS = r'^(?:([^,]*),([^,]*)|(?=[^,]* )\s*(\S+)\s+(\S+))'
+_PATRON_DECIMAL = r'[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?'
+
+def _float_o_nan(texto):
+    try:
+        return float(texto)
+    except (ValueError, TypeError):
+        return np.nan
+
+def _textos_a_float(textos):
+    """float(x) para una serie de textos (NaN si es nulo o no se puede convertir).
+    
+    Los decimales comunes se convierten en bloque con astype(float); solo el resto pasa por float() uno a uno.
+    """
+    resultado = np.full(len(textos), np.nan)
+    validos = textos.notna().to_numpy()
+    es_decimal = validos & textos.str.fullmatch(_PATRON_DECIMAL).to_numpy(dtype=bool, na_value=False)
+    if es_decimal.any():
+        resultado[es_decimal] = textos[es_decimal].astype(float).to_numpy()
+    resto = validos & ~es_decimal
+    if resto.any():
+        resultado[resto] = textos[resto].map(_float_o_nan).to_numpy(dtype=float)
+    return resultado
+
+def parse_coordinates_serie(serie):
+    """Versión vectorizada de parse_coordinates para una columna completa.
+    
+    Aplica la misma limpieza, una sola extracción con regex y los mismos rangos de
+    validación (Colombia) como máscaras sobre arrays.
+    
+    Returns:
+        tuple: (lat, lon) como np.ndarray float64 alineados con serie; NaN donde
+        parse_coordinates devolvería None
+    """
+    texto = pd.Series(serie.to_numpy(dtype=object)).where(serie.notna().to_numpy())
+    texto = (texto.dropna().astype(str).str.strip()
+             .str.replace(r'[()\[\]]', '', regex=True))
+    
+    partes = texto.str.extract(_PATRON_COORDENADAS)
+    lat_str = partes[0].fillna(partes[2]).str.strip()
+    lon_str = partes[1].fillna(partes[3]).str.strip()
+    
+    lat = np.full(len(serie), np.nan)
+    lon = np.full(len(serie), np.nan)
+    lat[texto.index] = _textos_a_float(lat_str)
+    lon[texto.index] = _textos_a_float(lon_str)
+    
+    # Rango de Colombia (incluye Cali y región): Lat 3.0 a 13.0, Lon -80.0 a -65.0
+    validas = (lat >= 3.0) & (lat <= 13.0) & (lon >= -80.0) & (lon <= -65.0)
+    lat[~validas] = np.nan
+    lon[~validas] = np.nan
+    return lat, lon
+
+def coordenadas_como_tuplas(lat, lon):
+    """Arrays lat/lon (NaN = sin coordenadas) -> array object de tuplas (lat, lon) o None."""
+    tuplas = np.full(len(lat), None, dtype=object)
+    for i in np.flatnonzero(np.isfinite(lat) & np.isfinite(lon)):
+        tuplas[i] = (float(lat[i]), float(lon[i]))
+    return tuplas
+
 def format_currency(value):
     """Formatea un valor numérico como moneda colombiana."""
     if pd.isna(value):
@@ -133,11 +293,123 @@ def get_color_by_clasificacion(clasificacion):
     # Si no es válida, usar 'Moderado' como defecto (naranja) en lugar de gris
     return COLORES_CLASIFICACION.get('Moderado', '#F39C12')
 
+# Columnas categóricas indexadas para apply_filters (clave del índice -> columna)
+COLUMNAS_INDICE_FILTROS = {
+    'clasificacion': ['Clasificacion'],
+    'zona': ['Zona'],
+    'barrio': ['Barrio'],
+    'tipo_vis': ['Tipo VIS', 'Tipo_VIS', 'Tipo_VIS_Principal', 'TipoVIS'],
+    'vende': ['Vende']
+}
+
+def construir_indice_filtros(df):
+    """Construye el índice invertido de filtros para un DataFrame.
+    
+    Para cada columna de filtro categórico guarda una máscara booleana precalculada por
+    valor distinto, para el estado las máscaras de activos/inactivos, y para
+    Precio_Promedio los valores no nulos ordenados junto con sus posiciones. Así
+    apply_filters combina máscaras con AND y resuelve el rango de precio con búsqueda
+    binaria en lugar de comparar todas las filas en cada petición.
+    
+    Returns:
+        dict: Índice de filtros (ver _mascara_desde_indice)
+    """
+    n = len(df)
+    indice = {'n': n, 'columnas': {}, 'activos': None, 'inactivos': None, 'precio': None}
+    
+    for clave, candidatas in COLUMNAS_INDICE_FILTROS.items():
+        col = next((c for c in candidatas if c in df.columns), None)
+        if col is None:
+            continue
+        codigos, valores = pd.factorize(df[col])
+        indice['columnas'][clave] = {valor: codigos == i for i, valor in enumerate(valores)}
+    
+    if 'Unidades_Disponibles' in df.columns:
+        disponibles = df['Unidades_Disponibles']
+        indice['activos'] = (disponibles > 0).to_numpy()
+        indice['inactivos'] = (disponibles == 0).to_numpy()
+    
+    if 'Precio_Promedio' in df.columns:
+        precios = df['Precio_Promedio'].to_numpy(dtype=float, na_value=np.nan)
+        posiciones = np.flatnonzero(~np.isnan(precios))
+        orden = np.argsort(precios[posiciones], kind='stable')
+        indice['precio'] = (precios[posiciones][orden], posiciones[orden])
+    
+    return indice
+
+def _precio_filtro(valor):
+    """Convierte un filtro de precio a float con las mismas reglas de apply_filters."""
+    if valor is None or valor in ('', 'null'):
+        return None
+    try:
+        return float(valor)
+    except (ValueError, TypeError):
+        return None
+
+def _mascara_desde_indice(indice, clasificacion, zona, barrio, tipo_vis, precio_min, precio_max, estado, vende):
+    """Calcula la máscara de filas de apply_filters usando el índice precalculado."""
+    mask = np.ones(indice['n'], dtype=bool)
+    
+    # Filtro de estado (activo/inactivo)
+    if estado == 'Activos' and indice['activos'] is not None:
+        mask &= indice['activos']
+    elif estado == 'Inactivos' and indice['inactivos'] is not None:
+        mask &= indice['inactivos']
+    
+    # Filtros categóricos: AND de las máscaras precalculadas de cada valor
+    for clave, valor, todos in (('clasificacion', clasificacion, 'Todos'), ('zona', zona, 'Todas'),
+                                ('barrio', barrio, 'Todos'), ('tipo_vis', tipo_vis, 'Todos'),
+                                ('vende', vende, 'Todos')):
+        if valor and valor != todos and clave in indice['columnas']:
+            posting = indice['columnas'][clave].get(valor)
+            if posting is None:
+                return np.zeros(indice['n'], dtype=bool)
+            mask &= posting
+    
+    # Filtro de precio: búsqueda binaria sobre los precios ordenados
+    if indice['precio'] is not None:
+        valores, posiciones = indice['precio']
+        minimo, maximo = _precio_filtro(precio_min), _precio_filtro(precio_max)
+        if (minimo is not None and np.isnan(minimo)) or (maximo is not None and np.isnan(maximo)):
+            return np.zeros(indice['n'], dtype=bool)
+        inicio = np.searchsorted(valores, minimo, side='left') if minimo is not None else 0
+        fin = np.searchsorted(valores, maximo, side='right') if maximo is not None else len(valores)
+        precio_mask = np.zeros(indice['n'], dtype=bool)
+        precio_mask[posiciones[inicio:fin]] = True
+        mask &= precio_mask
+    
+    return mask
+
+def obtener_indice_filtros(snap):
+    """Retorna el índice de filtros del snapshot, construyéndolo la primera vez."""
+    if snap.get('indice_filtros') is None:
+        snap['indice_filtros'] = construir_indice_filtros(snap['df_data'])
+    return snap['indice_filtros']
+
+def posiciones_filtradas(snap, clasificacion, zona, barrio, tipo_vis, precio_min, precio_max, estado='Activos', vende=None):
+    """Posiciones (iloc) de las filas de snap['df_data'] que cumplen los filtros de apply_filters.
+    
+    Permite paginar y proyectar columnas antes de copiar filas del DataFrame.
+    """
+    indice = obtener_indice_filtros(snap)
+    return np.flatnonzero(_mascara_desde_indice(indice, clasificacion, zona, barrio, tipo_vis,
+                                                precio_min, precio_max, estado, vende))
+
 def apply_filters(df, clasificacion, zona, barrio, tipo_vis, precio_min, precio_max, estado='Activos', vende=None):
-    """Aplica filtros al DataFrame de manera eficiente usando máscaras booleanas."""
+    """Aplica filtros al DataFrame de manera eficiente usando máscaras booleanas.
+    
+    Si df es el dataset publicado en el snapshot actual, usa su índice de filtros
+    precalculado; para cualquier otro DataFrame compara las columnas directamente.
+    """
     if df.empty:
         return df
     
+    snap = _snapshot
+    if snap is not None and df is snap['df_data']:
+        indice = obtener_indice_filtros(snap)
+        return df[_mascara_desde_indice(indice, clasificacion, zona, barrio, tipo_vis,
+                                        precio_min, precio_max, estado, vende)]
+    
     # Crear máscara inicial (todos True)
     mask = pd.Series([True] * len(df), index=df.index)
     
@@ -178,14 +450,14 @@ def apply_filters(df, clasificacion, zona, barrio, tipo_vis, precio_min, precio_
     if 'Precio_Promedio' in df.columns:
         precio_mask = df['Precio_Promedio'].notna()
         
-        if precio_min and precio_min not in ('', 'null'):
+        if precio_min is not None and precio_min not in ('', 'null'):
             try:
                 precio_min_val = float(precio_min)
                 precio_mask &= (df['Precio_Promedio'] >= precio_min_val)
             except (ValueError, TypeError):
                 pass
     
-        if precio_max and precio_max not in ('', 'null'):
+        if precio_max is not None and precio_max not in ('', 'null'):
             try:
                 precio_max_val = float(precio_max)
                 precio_mask &= (df['Precio_Promedio'] <= precio_max_val)
@@ -196,15 +468,668 @@ def apply_filters(df, clasificacion, zona, barrio, tipo_vis, precio_min, precio_
     
     return df[mask]
 
-def generar_clasificacion_en_memoria(xlsx_path=None):
+# ------------------------------
+# Cubo de estadísticas (respuestas de /api/estadisticas sin recorrer el DataFrame)
+# ------------------------------
+# Dimensiones del cubo en el orden de la tupla de normalizar_filtros (clave del índice de filtros).
+# Sin 'vende': /api/estadisticas no filtra por vendedor y cada dimensión duplica el número de agrupaciones.
+DIMENSIONES_CUBO = ('clasificacion', 'zona', 'barrio', 'tipo_vis', 'estado')
+# Medidas acumuladas: total, exitosos, moderados, mejorables, suma de score, scores no nulos
+MEDIDAS_CUBO = ('total', 'exitosos', 'moderados', 'mejorables', 'suma_score', 'n_score')
+
+def construir_cubo_estadisticas(df, indice):
+    """Precalcula las medidas de /api/estadisticas para cualquier combinación de filtros.
+
+    Para cada subconjunto de dimensiones filtradas (las demás en 'Todos') agrupa las filas
+    por los valores de esas dimensiones. Dentro de cada grupo las filas quedan ordenadas por
+    Precio_Promedio con las sumas acumuladas de las medidas, de modo que el rango de precio
+    se resuelve con búsqueda binaria y una resta. Las dimensiones y el precio salen del
+    índice de filtros, así que el cubo respeta exactamente la semántica de apply_filters.
+
+    Returns:
+        dict con las celdas (clave -> (grupo, inicio, fin)) y los arrays de cada agrupación
+    """
+    n = indice['n']
+
+    # Códigos por dimensión (-1 = valor nulo, nunca coincide con un filtro)
+    dimensiones = []
+    for clave in DIMENSIONES_CUBO:
+        if clave == 'estado':
+            if indice['activos'] is None:
+                continue
+            valores = ['Activos', 'Inactivos']
+            postings = (indice['activos'], indice['inactivos'])
+        elif clave in indice['columnas']:
+            valores = list(indice['columnas'][clave])
+            postings = indice['columnas'][clave].values()
+        else:
+            continue
+        codigos = np.full(n, -1, dtype=np.intp)
+        for i, posting in enumerate(postings):
+            codigos[posting] = i
+        dimensiones.append((DIMENSIONES_CUBO.index(clave), valores, codigos))
+
+    # Filas en orden de precio (solo las que tienen precio si existe la columna, como apply_filters)
+    if indice['precio'] is not None:
+        precios, filas = indice['precio']
+    else:
+        precios, filas = None, np.arange(n)
+
+    medidas = np.zeros((n, len(MEDIDAS_CUBO)))
+    medidas[:, 0] = 1
+    if 'Clasificacion' in df.columns:
+        clasificacion = df['Clasificacion'].to_numpy(dtype=object)
+        for k, valor in enumerate(('Exitoso', 'Moderado', 'Mejorable'), start=1):
+            medidas[:, k] = clasificacion == valor
+    if 'Score_Exito' in df.columns:
+        score = pd.to_numeric(df['Score_Exito'], errors='coerce').to_numpy(dtype=float)
+        medidas[:, 4] = np.where(np.isnan(score), 0.0, score)
+        medidas[:, 5] = ~np.isnan(score)
+    medidas = medidas[filas]
+
+    cubo = {'celdas': {}, 'grupos': [], 'precio': precios is not None}
+    for seleccion in range(2 ** len(dimensiones)):
+        usadas = [d for bit, d in enumerate(dimensiones) if seleccion >> bit & 1]
+        if usadas:
+            codigos = np.column_stack([d[2][filas] for d in usadas])
+            validas = (codigos >= 0).all(axis=1)
+            grupos, inverso = np.unique(codigos[validas], axis=0, return_inverse=True)
+            inverso = inverso.ravel()
+            posiciones = np.flatnonzero(validas)[np.argsort(inverso, kind='stable')]
+            limites = np.concatenate(([0], np.cumsum(np.bincount(inverso, minlength=len(grupos)))))
+        else:
+            grupos = np.empty((1, 0), dtype=np.intp)
+            posiciones = np.arange(len(filas))
+            limites = np.array([0, len(filas)])
+
+        # El orden estable conserva el orden por precio dentro de cada grupo
+        id_grupo = len(cubo['grupos'])
+        cubo['grupos'].append({
+            'precios': precios[posiciones] if precios is not None else None,
+            # Precisión extendida: la resta de dos sumas acumuladas no pierde decimales del score
+            'acumulado': np.vstack((np.zeros(len(MEDIDAS_CUBO), dtype=np.longdouble),
+                                    np.cumsum(medidas[posiciones], axis=0, dtype=np.longdouble)))
+        })
+        for g, fila_codigos in enumerate(grupos):
+            clave = [None] * len(DIMENSIONES_CUBO)
+            for (posicion, valores, _), codigo in zip(usadas, fila_codigos):
+                clave[posicion] = valores[codigo]
+            cubo['celdas'][tuple(clave)] = (id_grupo, int(limites[g]), int(limites[g + 1]))
+
+    cubo['dimensiones'] = {DIMENSIONES_CUBO[d[0]] for d in dimensiones}
+    return cubo
+
+def obtener_cubo_estadisticas(snap):
+    """Retorna el cubo de estadísticas del snapshot, construyéndolo la primera vez."""
+    if snap.get('cubo_estadisticas') is None:
+        snap['cubo_estadisticas'] = construir_cubo_estadisticas(snap['df_data'], obtener_indice_filtros(snap))
+    return snap['cubo_estadisticas']
+
+def consultar_cubo_estadisticas(cubo, clasificacion, zona, barrio, tipo_vis, precio_min, precio_max, estado, vende):
+    """Suma las medidas de las filas que pasarían apply_filters con estos filtros.
+
+    El cubo no tiene la dimensión de vendedor: vende debe ser None o 'Todos'.
+
+    Returns:
+        dict: medida -> valor (ver MEDIDAS_CUBO)
+    """
+    if vende and vende != 'Todos':
+        raise ValueError("El cubo de estadísticas no admite el filtro de vendedor")
+    vacio = dict.fromkeys(MEDIDAS_CUBO, 0.0)
+    filtros = {'clasificacion': (clasificacion, 'Todos'), 'zona': (zona, 'Todas'), 'barrio': (barrio, 'Todos'),
+               'tipo_vis': (tipo_vis, 'Todos'), 'estado': (estado, 'Todos')}
+    clave = []
+    for dimension in DIMENSIONES_CUBO:
+        valor, todos = filtros[dimension]
+        if dimension == 'estado' and valor not in ('Activos', 'Inactivos'):
+            valor = None
+        clave.append(valor if valor and valor != todos and dimension in cubo['dimensiones'] else None)
+
+    celda = cubo['celdas'].get(tuple(clave))
+    if celda is None:
+        return vacio
+    id_grupo, inicio, fin = celda
+    grupo = cubo['grupos'][id_grupo]
+
+    if cubo['precio']:
+        minimo, maximo = _precio_filtro(precio_min), _precio_filtro(precio_max)
+        if (minimo is not None and np.isnan(minimo)) or (maximo is not None and np.isnan(maximo)):
+            return vacio
+        precios = grupo['precios'][inicio:fin]
+        if minimo is not None:
+            inicio += int(np.searchsorted(precios, minimo, side='left'))
+        if maximo is not None:
+            fin = inicio + int(np.searchsorted(grupo['precios'][inicio:fin], maximo, side='right'))
+        if fin <= inicio:
+            return vacio
+
+    sumas = (grupo['acumulado'][fin] - grupo['acumulado'][inicio]).astype(float)
+    return dict(zip(MEDIDAS_CUBO, sumas.tolist()))
+
+# ------------------------------
+# Índice espacial (consultas por rectángulo y por radio)
+# ------------------------------
+RADIO_TIERRA_M = 6371008.8
+
+def _a_cartesianas(lat, lon):
+    """Convierte lat/lon en grados a puntos 3D sobre la esfera unitaria."""
+    lat_r = np.radians(np.asarray(lat, dtype=float))
+    lon_r = np.radians(np.asarray(lon, dtype=float))
+    cos_lat = np.cos(lat_r)
+    return np.column_stack((cos_lat * np.cos(lon_r), cos_lat * np.sin(lon_r), np.sin(lat_r)))
+
+def distancia_haversine_m(lat1, lon1, lat2, lon2):
+    """Distancia en metros sobre la superficie terrestre (vectorizada)."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def construir_indice_espacial(df):
+    """Construye el índice espacial sobre Lat/Lon de df (solo filas con coordenadas válidas).
+    
+    - KD-tree (scipy) sobre puntos 3D de la esfera unitaria para las consultas por radio:
+      la distancia de cuerda crece con la distancia sobre la superficie, así que el radio
+      se convierte a cuerda y la consulta no depende de la proyección.
+    - Latitudes ordenadas para las consultas por rectángulo (bbox) con searchsorted.
+    
+    Returns:
+        dict con las posiciones (en df) de los puntos indexados y sus coordenadas
+    """
+    if 'Lat' in df.columns and 'Lon' in df.columns:
+        lat = pd.to_numeric(df['Lat'], errors='coerce').to_numpy(dtype=float)
+        lon = pd.to_numeric(df['Lon'], errors='coerce').to_numpy(dtype=float)
+        posiciones = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+    else:
+        lat = lon = np.empty(0)
+        posiciones = np.empty(0, dtype=np.intp)
+    
+    lat, lon = lat[posiciones], lon[posiciones]
+    orden_lat = np.argsort(lat, kind='stable')
+    
+    arbol = None
+    if SCIPY_AVAILABLE and len(posiciones) > 0:
+        try:
+            arbol = cKDTree(_a_cartesianas(lat, lon))
+        except Exception as e:
+            print(f"⚠ No se pudo construir el KD-tree, se usará búsqueda directa: {str(e)}")
+    
+    return {
+        'posiciones': posiciones,
+        'lat': lat,
+        'lon': lon,
+        'orden_lat': orden_lat,
+        'lat_ordenada': lat[orden_lat],
+        'arbol': arbol
+    }
+
+def obtener_indice_espacial(snap):
+    """Retorna el índice espacial del snapshot, construyéndolo si aún no existe."""
+    if snap.get('indice_espacial') is None:
+        snap['indice_espacial'] = construir_indice_espacial(snap['df_data'])
+    return snap['indice_espacial']
+
+def _ordenar_por_distancia(indice, candidatos, distancias):
+    """Ordena candidatos de más cercano a más lejano (empates por posición en df)."""
+    orden = np.lexsort((candidatos, distancias))
+    return indice['posiciones'][candidatos[orden]], distancias[orden]
+
+def consultar_radio(indice, lat, lon, radio_m):
+    """Puntos a menos de radio_m metros de (lat, lon).
+    
+    Returns:
+        tuple: (posiciones en df, distancias en metros), de la más cercana a la más lejana
+    """
+    if len(indice['posiciones']) == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0)
+    
+    if indice['arbol'] is not None:
+        # Radio sobre la superficie -> cuerda en la esfera unitaria (con margen para el redondeo)
+        cuerda = 2 * np.sin(min(radio_m / RADIO_TIERRA_M, np.pi) / 2) * (1 + 1e-9)
+        candidatos = np.asarray(indice['arbol'].query_ball_point(_a_cartesianas(lat, lon)[0], cuerda), dtype=np.intp)
+    else:
+        candidatos = np.arange(len(indice['posiciones']))
+    
+    distancias = distancia_haversine_m(lat, lon, indice['lat'][candidatos], indice['lon'][candidatos])
+    dentro = distancias <= radio_m
+    return _ordenar_por_distancia(indice, candidatos[dentro], distancias[dentro])
+
+def consultar_bbox(indice, sur, oeste, norte, este):
+    """Puntos dentro del rectángulo (admite rectángulos que cruzan el antimeridiano).
+    
+    Returns:
+        tuple: (posiciones en df, distancias en metros al centro del rectángulo),
+        de la más cercana a la más lejana del centro
+    """
+    inicio = np.searchsorted(indice['lat_ordenada'], sur, side='left')
+    fin = np.searchsorted(indice['lat_ordenada'], norte, side='right')
+    candidatos = indice['orden_lat'][inicio:fin]
+    
+    lon = indice['lon'][candidatos]
+    if oeste <= este:
+        candidatos = candidatos[(lon >= oeste) & (lon <= este)]
+        lon_centro = (oeste + este) / 2
+    else:
+        candidatos = candidatos[(lon >= oeste) | (lon <= este)]
+        lon_centro = ((oeste + este + 360) / 2 + 180) % 360 - 180
+    
+    distancias = distancia_haversine_m((sur + norte) / 2, lon_centro,
+                                       indice['lat'][candidatos], indice['lon'][candidatos])
+    return _ordenar_por_distancia(indice, candidatos, distancias)
+
+# ------------------------------
+# Agrupación de marcadores por nivel de zoom (estilo supercluster)
+# ------------------------------
+ZOOM_MAX_CLUSTERS = 16      # Por encima de este zoom se devuelven los proyectos individuales
+RADIO_CLUSTER_PX = 40       # Radio de agrupación en píxeles de pantalla
+MAX_JERARQUIAS_CACHE = int(os.getenv('GALERIA_MAX_JERARQUIAS_CACHE', '32'))  # Jerarquías por snapshot
+EXTENSION_TESELA_PX = 512   # Tamaño de tesela usado para convertir el radio a coordenadas del mapa
+CLASIFICACIONES_CLUSTER = ('Exitoso', 'Moderado', 'Mejorable')
+
+def _mercator_x(lon):
+    """Longitud -> x en Web Mercator normalizado [0, 1]."""
+    return np.asarray(lon, dtype=float) / 360 + 0.5
+
+def _mercator_y(lat):
+    """Latitud -> y en Web Mercator normalizado [0, 1] (0 arriba)."""
+    seno = np.sin(np.radians(np.asarray(lat, dtype=float)))
+    return np.clip(0.5 - 0.25 * np.log((1 + seno) / (1 - seno)) / np.pi, 0.0, 1.0)
+
+def _mercator_a_lat(y):
+    """y en Web Mercator normalizado -> latitud."""
+    return np.degrees(2 * np.arctan(np.exp((0.5 - np.asarray(y, dtype=float)) * 2 * np.pi))) - 90
+
+def _pares_vecinos(puntos, radio):
+    """Pares (i, j), i != j, de puntos a distancia <= radio, en ambos sentidos."""
+    if SCIPY_AVAILABLE:
+        pares = cKDTree(puntos).query_pairs(radio, output_type='ndarray')
+    else:
+        distancias = np.hypot(puntos[:, None, 0] - puntos[None, :, 0], puntos[:, None, 1] - puntos[None, :, 1])
+        pares = np.argwhere(np.triu(distancias <= radio, k=1))
+    return np.concatenate((pares[:, 0], pares[:, 1])), np.concatenate((pares[:, 1], pares[:, 0]))
+
+def _agrupar_nivel(previo, radio, zoom):
+    """Agrupa los nodos del nivel zoom+1 que están a menos de 'radio' (coordenadas Mercator).
+    
+    Asignación voraz por prioridad (más proyectos primero, a igualdad el orden del nivel):
+    cada nodo no asignado forma un cluster con sus vecinos aún libres. En lugar de recorrer
+    los nodos uno a uno se procesa por rondas sobre los pares de vecinos: en cada ronda son
+    centro los nodos libres sin un vecino libre de mayor prioridad, y sus vecinos dejan de
+    estar libres. Cada nodo queda en el cluster del centro vecino de mayor prioridad, lo
+    mismo que daría el recorrido secuencial. El centro es la media de los centros
+    ponderada por cantidad de proyectos.
+    """
+    m = len(previo['x'])
+    if m == 0:
+        return previo
+    
+    origen, destino = _pares_vecinos(np.column_stack((previo['x'], previo['y'])), radio)
+    rango = np.empty(m, dtype=np.intp)
+    rango[np.argsort(-previo['cantidad'], kind='stable')] = np.arange(m)
+    
+    centro = np.zeros(m, dtype=bool)
+    libre = np.ones(m, dtype=bool)
+    while libre.any():
+        activos = libre[origen] & libre[destino]
+        superado = np.zeros(m, dtype=bool)
+        superado[origen[activos & (rango[destino] < rango[origen])]] = True
+        nuevos = libre & ~superado
+        centro |= nuevos
+        libre &= ~nuevos
+        libre[destino[nuevos[origen]]] = False
+    
+    # Número de cluster de cada centro según su prioridad; cada nodo va al centro vecino de menor rango
+    centros = np.flatnonzero(centro)
+    centros = centros[np.argsort(rango[centros])]
+    numero = np.full(m, -1, dtype=np.intp)
+    numero[centros] = np.arange(len(centros))
+    total = len(centros)
+    
+    asignado = numero.copy()
+    hacia_centro = centro[destino] & ~centro[origen]
+    candidatos = np.full(m, total, dtype=np.intp)
+    np.minimum.at(candidatos, origen[hacia_centro], numero[destino[hacia_centro]])
+    asignado[~centro] = candidatos[~centro]
+    
+    def _sumar(pesos):
+        return np.bincount(asignado, weights=pesos, minlength=total)
+    
+    cantidad = _sumar(previo['cantidad'])
+    hijos = np.bincount(asignado, minlength=total)
+    # Para los clusters de un solo hijo se conserva lo que ya tenía ese hijo
+    unico_hijo = np.full(total, -1, dtype=np.intp)
+    unico_hijo[asignado] = np.arange(m)
+    solo = hijos == 1
+    
+    return {
+        'x': _sumar(previo['x'] * previo['cantidad']) / cantidad,
+        'y': _sumar(previo['y'] * previo['cantidad']) / cantidad,
+        'cantidad': cantidad,
+        'conteos': np.column_stack([_sumar(previo['conteos'][:, k]) for k in range(previo['conteos'].shape[1])]),
+        'suma_score': _sumar(previo['suma_score']),
+        'n_score': _sumar(previo['n_score']),
+        'zoom_expansion': np.where(solo, previo['zoom_expansion'][unico_hijo], zoom + 1),
+        'punto': np.where(solo, previo['punto'][unico_hijo], -1)
+    }
+
+def construir_clusters(df):
+    """Precalcula los clusters de df para cada nivel de zoom de 0 a ZOOM_MAX_CLUSTERS + 1.
+    
+    El nivel ZOOM_MAX_CLUSTERS + 1 contiene los proyectos individuales; cada nivel
+    inferior agrupa el anterior con un radio de RADIO_CLUSTER_PX píxeles a ese zoom.
+    
+    Returns:
+        dict con 'niveles' (zoom -> arrays del nivel) y 'lat', 'lon', 'ids' y 'codigos' de los proyectos
+    """
+    lat = pd.to_numeric(df['Lat'], errors='coerce').to_numpy(dtype=float) if 'Lat' in df.columns else np.empty(0)
+    lon = pd.to_numeric(df['Lon'], errors='coerce').to_numpy(dtype=float) if 'Lon' in df.columns else np.empty(0)
+    posiciones = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon)) if len(lat) else np.empty(0, dtype=np.intp)
+    n = len(posiciones)
+    
+    if 'Clasificacion' in df.columns:
+        clasificacion = df['Clasificacion'].astype(str).str.strip().to_numpy()[posiciones]
+    else:
+        clasificacion = np.full(n, 'Moderado', dtype=object)
+    conteos = np.column_stack([(clasificacion == c) for c in CLASIFICACIONES_CLUSTER]).astype(float) if n else np.zeros((0, 3))
+    # Igual que en /api/proyectos, una clasificación no reconocida cuenta como 'Moderado'
+    conteos[conteos.sum(axis=1) == 0, CLASIFICACIONES_CLUSTER.index('Moderado')] = 1
+    
+    if 'Score_Exito' in df.columns:
+        score = pd.to_numeric(df['Score_Exito'], errors='coerce').to_numpy(dtype=float)[posiciones]
+    else:
+        score = np.full(n, np.nan)
+    tiene_score = np.isfinite(score)
+    
+    nivel = {
+        'x': _mercator_x(lon[posiciones]),
+        'y': _mercator_y(lat[posiciones]),
+        'cantidad': np.ones(n),
+        'conteos': conteos,
+        'suma_score': np.where(tiene_score, score, 0.0),
+        'n_score': tiene_score.astype(float),
+        'zoom_expansion': np.full(n, -1, dtype=np.intp),
+        'punto': posiciones
+    }
+    niveles = {ZOOM_MAX_CLUSTERS + 1: nivel}
+    for zoom in range(ZOOM_MAX_CLUSTERS, -1, -1):
+        radio = RADIO_CLUSTER_PX / (EXTENSION_TESELA_PX * 2 ** zoom)
+        nivel = _agrupar_nivel(nivel, radio, zoom)
+        niveles[zoom] = nivel
+    
+    return {
+        'niveles': niveles,
+        'lat': lat,
+        'lon': lon,
+        'ids': df.index.astype(str).to_numpy(),
+        'codigos': df['Codigo_Proyecto'].astype(str).to_numpy() if 'Codigo_Proyecto' in df.columns else None
+    }
+
+def clusters_a_registros(jerarquia, zoom, bbox=None):
+    """Convierte los clusters de un nivel de zoom (opcionalmente dentro de un bbox) a dicts JSON.
+    
+    Args:
+        bbox: Tupla (oeste, sur, este, norte) o None
+    """
+    nivel = jerarquia['niveles'][min(max(zoom, 0), ZOOM_MAX_CLUSTERS + 1)]
+    lat = _mercator_a_lat(nivel['y'])
+    lon = (nivel['x'] - 0.5) * 360
+    
+    seleccion = np.ones(len(lat), dtype=bool)
+    if bbox is not None:
+        oeste, sur, este, norte = bbox
+        dentro_lon = (lon >= oeste) & (lon <= este) if oeste <= este else (lon >= oeste) | (lon <= este)
+        seleccion = dentro_lon & (lat >= sur) & (lat <= norte)
+    
+    registros = []
+    for i in np.flatnonzero(seleccion):
+        n_score = nivel['n_score'][i]
+        punto = int(nivel['punto'][i])
+        registro = {
+            'lat': float(lat[i]),
+            'lon': float(lon[i]),
+            'cantidad': int(nivel['cantidad'][i]),
+            'clasificaciones': {c: int(nivel['conteos'][i, k]) for k, c in enumerate(CLASIFICACIONES_CLUSTER)},
+            'score_promedio': float(nivel['suma_score'][i] / n_score) if n_score > 0 else None,
+            'zoom_expansion': int(nivel['zoom_expansion'][i]) if nivel['zoom_expansion'][i] >= 0 else None
+        }
+        if punto >= 0:
+            # Proyecto individual: coordenadas originales y mismo 'id' y 'codigo' que en /api/proyectos
+            registro['lat'] = float(jerarquia['lat'][punto])
+            registro['lon'] = float(jerarquia['lon'][punto])
+            registro['id'] = jerarquia['ids'][punto]
+            registro['codigo'] = jerarquia['codigos'][punto] if jerarquia['codigos'] is not None else None
+        registros.append(registro)
+    return registros
+
+# ------------------------------
+# Teselas vectoriales (Mapbox Vector Tiles) de los proyectos
+# ------------------------------
+EXTENSION_MVT = 4096        # Resolución de la tesela (unidades por lado)
+BUFFER_MVT = 64             # Margen alrededor de la tesela para no cortar los símbolos del borde
+CAPA_MVT = 'proyectos'
+ZOOM_MAX_TESELAS = 22
+ATRIBUTOS_MVT = ('id', 'codigo', 'nombre', 'clasificacion', 'color', 'score_exito')
+MAX_TESELAS_CACHE = int(os.getenv('GALERIA_MAX_TESELAS_CACHE', '1024'))
+MAX_VERSIONES_TESELAS = 3   # Versiones del dataset que se conservan en la caché de disco
+# Límites de la caché de disco: solo teselas no vacías hasta este zoom y un máximo de archivos por versión
+ZOOM_MAX_TESELAS_DISCO = int(os.getenv('GALERIA_ZOOM_MAX_TESELAS_DISCO', '16'))
+MAX_TESELAS_DISCO = int(os.getenv('GALERIA_MAX_TESELAS_DISCO', '20000'))
+# Tiempo (s) que el navegador reutiliza una tesela sin revalidar (la versión de los datos va en el ETag)
+MAX_AGE_TESELAS = int(os.getenv('GALERIA_MAX_AGE_TESELAS', '300'))
+_teselas_en_disco = {}      # Directorio de versión -> número de teselas guardadas (conteo de este proceso)
+_teselas_en_disco_lock = threading.Lock()
+
+def _varint(n):
+    """Entero no negativo -> varint de protobuf."""
+    salida = bytearray()
+    while n > 0x7F:
+        salida.append((n & 0x7F) | 0x80)
+        n >>= 7
+    salida.append(n)
+    return bytes(salida)
+
+def _zigzag(n):
+    """Entero con signo -> entero sin signo (codificación zigzag de protobuf)."""
+    return n << 1 if n >= 0 else ((-n) << 1) - 1
+
+def _campo_bytes(numero, contenido):
+    """Campo protobuf de longitud delimitada (strings, mensajes y arrays empaquetados)."""
+    return _varint((numero << 3) | 2) + _varint(len(contenido)) + contenido
+
+def _campo_varint(numero, valor):
+    """Campo protobuf de tipo varint."""
+    return _varint(numero << 3) + _varint(valor)
+
+def _valor_mvt(valor):
+    """Codifica un valor de atributo como mensaje Value de MVT."""
+    if isinstance(valor, (bool, np.bool_)):
+        return _campo_varint(7, int(valor))
+    if isinstance(valor, (int, np.integer)):
+        valor = int(valor)
+        return _campo_varint(5, valor) if valor >= 0 else _campo_varint(6, _zigzag(valor))
+    if isinstance(valor, (float, np.floating)):
+        return _varint((3 << 3) | 1) + struct.pack('<d', float(valor))
+    return _campo_bytes(1, str(valor).encode('utf-8'))
+
+def codificar_tesela_mvt(nombre_capa, puntos):
+    """Codifica una capa de puntos como tesela MVT v2 (protobuf).
+
+    Args:
+        nombre_capa: Nombre de la capa
+        puntos: Lista de (id o None, x, y, atributos) con x/y enteros en coordenadas de tesela
+
+    Returns:
+        bytes: Tesela codificada (vacía si no hay puntos)
+    """
+    if not puntos:
+        return b''
+
+    claves, valores = {}, {}
+    features = []
+    for id_feature, x, y, atributos in puntos:
+        etiquetas = []
+        for clave, valor in atributos.items():
+            if valor is None or (isinstance(valor, float) and not np.isfinite(valor)):
+                continue  # MVT no tiene valores nulos: el atributo se omite
+            etiquetas.append(claves.setdefault(clave, len(claves)))
+            etiquetas.append(valores.setdefault((type(valor).__name__, valor), len(valores)))
+
+        feature = b''
+        if id_feature is not None:
+            feature += _campo_varint(1, id_feature)
+        feature += _campo_bytes(2, b''.join(_varint(e) for e in etiquetas))
+        feature += _campo_varint(3, 1)  # GeomType.POINT
+        # MoveTo con un punto: comando (id 1, cantidad 1) y desplazamiento desde (0, 0)
+        feature += _campo_bytes(4, _varint((1 << 3) | 1) + _varint(_zigzag(x)) + _varint(_zigzag(y)))
+        features.append(_campo_bytes(2, feature))
+
+    capa = _campo_varint(15, 2) + _campo_bytes(1, nombre_capa.encode('utf-8'))
+    capa += b''.join(features)
+    capa += b''.join(_campo_bytes(3, clave.encode('utf-8')) for clave in claves)
+    capa += b''.join(_campo_bytes(4, _valor_mvt(valor)) for _, valor in valores)
+    capa += _campo_varint(5, EXTENSION_MVT)
+    return _campo_bytes(3, capa)
+
+def preparar_puntos_teselas(df):
+    """Coordenadas Web Mercator y atributos de los proyectos de df con coordenadas válidas.
+
+    Los atributos salen de proyectos_to_records, igual que en /api/proyectos.
+    """
+    lat = pd.to_numeric(df['Lat'], errors='coerce').to_numpy(dtype=float) if 'Lat' in df.columns else np.empty(0)
+    lon = pd.to_numeric(df['Lon'], errors='coerce').to_numpy(dtype=float) if 'Lon' in df.columns else np.empty(0)
+    posiciones = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon)) if len(lat) else np.empty(0, dtype=np.intp)
+
+    registros = proyectos_to_records(df.iloc[posiciones]) if len(posiciones) else []
+    ids = [int(i) if isinstance(i, (int, np.integer)) and i >= 0 else None for i in df.index[posiciones]]
+    return {
+        'x': _mercator_x(lon[posiciones]),
+        'y': _mercator_y(lat[posiciones]),
+        'ids': ids,
+        'atributos': [{clave: registro[clave] for clave in ATRIBUTOS_MVT} for registro in registros]
+    }
+
+def construir_tesela(puntos, z, x, y):
+    """Codifica la tesela z/x/y (esquema XYZ de Leaflet) con los puntos que caen en ella."""
+    escala = 2 ** z * EXTENSION_MVT
+    px = puntos['x'] * escala - x * EXTENSION_MVT
+    py = puntos['y'] * escala - y * EXTENSION_MVT
+    dentro = np.flatnonzero((px >= -BUFFER_MVT) & (px < EXTENSION_MVT + BUFFER_MVT) &
+                            (py >= -BUFFER_MVT) & (py < EXTENSION_MVT + BUFFER_MVT))
+    px = np.floor(px[dentro]).astype(np.int64)
+    py = np.floor(py[dentro]).astype(np.int64)
+    return codificar_tesela_mvt(CAPA_MVT, [
+        (puntos['ids'][i], int(tx), int(ty), puntos['atributos'][i]) for i, tx, ty in zip(dentro, px, py)
+    ])
+
+def huella_dataset(snap):
+    """Huella del contenido de df_data: identifica la versión del dataset entre reinicios y workers.
+
+    Se calcula una sola vez por snapshot; si falla se usa el identificador del snapshot.
+    """
+    if snap.get('huella') is None:
+        try:
+            hashes = pd.util.hash_pandas_object(snap['df_data'], index=True).to_numpy()
+            columnas = '|'.join(map(str, snap['df_data'].columns)).encode('utf-8')
+            snap['huella'] = hashlib.sha1(columnas + hashes.tobytes()).hexdigest()[:16]
+        except Exception as e:
+            print(f"⚠ No se pudo calcular la huella del dataset, se usará el id del snapshot: {str(e)}")
+            snap['huella'] = snap['id']
+    return snap['huella']
+
+def _directorio_teselas():
+    """Directorio raíz de la caché de teselas en disco (dentro de la caché del pipeline)."""
+    import generar_clasificacion as gen_clas
+    return gen_clas.CACHE_DIR / 'teselas'
+
+def leer_tesela_disco(version, clave_filtros, z, x, y):
+    """Lee una tesela de la caché de disco; retorna None si no existe."""
+    if z > ZOOM_MAX_TESELAS_DISCO:
+        return None
+    try:
+        return (_directorio_teselas() / version / clave_filtros / str(z) / str(x) / f"{y}.mvt").read_bytes()
+    except OSError:
+        return None
+
+def _reservar_tesela_disco(directorio_version):
+    """Cuenta una tesela nueva en el directorio de la versión; False si ya alcanzó MAX_TESELAS_DISCO.
+
+    El conteo se inicializa (y se resincroniza cada 256 escrituras, por si otros workers
+    también escriben) contando los archivos del directorio.
+    """
+    with _teselas_en_disco_lock:
+        guardadas = _teselas_en_disco.get(directorio_version)
+        if guardadas is None or guardadas % 256 == 0:
+            guardadas = sum(1 for _ in directorio_version.rglob('*.mvt')) if directorio_version.exists() else 0
+        if guardadas >= MAX_TESELAS_DISCO:
+            _teselas_en_disco[directorio_version] = guardadas
+            return False
+        _teselas_en_disco[directorio_version] = guardadas + 1
+        return True
+
+def guardar_tesela_disco(version, clave_filtros, z, x, y, contenido):
+    """Guarda una tesela en la caché de disco y elimina las versiones más antiguas del dataset.
+
+    No se guardan las teselas vacías ni las de zoom mayor a ZOOM_MAX_TESELAS_DISCO (se
+    construyen al vuelo en milisegundos), y cada versión admite como máximo MAX_TESELAS_DISCO
+    archivos, para que recorrer coordenadas no llene el disco.
+    """
+    if not contenido or z > ZOOM_MAX_TESELAS_DISCO:
+        return
+    try:
+        import generar_clasificacion as gen_clas
+        raiz = _directorio_teselas()
+        directorio_version = raiz / version
+        nueva_version = not directorio_version.exists()
+        if not _reservar_tesela_disco(directorio_version):
+            return
+        gen_clas._escribir_atomico(directorio_version / clave_filtros / str(z) / str(x) / f"{y}.mvt", contenido)
+
+        if nueva_version:
+            versiones = sorted((d for d in raiz.iterdir() if d.is_dir()), key=lambda d: d.stat().st_mtime, reverse=True)
+            for anterior in versiones[MAX_VERSIONES_TESELAS:]:
+                if anterior != directorio_version:
+                    shutil.rmtree(anterior, ignore_errors=True)
+                    with _teselas_en_disco_lock:
+                        _teselas_en_disco.pop(anterior, None)
+    except Exception as e:
+        print(f"⚠ No se pudo guardar la tesela {z}/{x}/{y} en disco: {str(e)}")
+
+def _reportar_progreso(progreso, paso, descripcion):
+    """Notifica el paso actual del pipeline al callback de progreso (si existe)."""
+    if progreso is None:
+        return
+    try:
+        progreso(paso, descripcion)
+    except Exception as e:
+        print(f"⚠ Error al reportar progreso: {str(e)}")
+
+def generar_clasificacion_en_memoria(xlsx_path=None, usar_cache=True, progreso=None, salida=None):
     """Genera la clasificación de proyectos en memoria desde Base Proyectos.xlsx.
     
+    Si el archivo no ha cambiado (misma huella) y la versión del pipeline es la misma,
+    el resultado se carga desde disco sin volver a ejecutar los pasos del pipeline.
+    
     Args:
         xlsx_path: Ruta al archivo Excel. Si es None, busca automáticamente.
+        usar_cache: Si True, reutiliza el resultado memorizado en disco y el estado
+                    incremental (solo se recalculan los proyectos y segmentos que cambiaron).
+                    Con False se ejecuta todo desde cero y ambos se vuelven a guardar.
+        progreso: Callback opcional progreso(paso, descripcion) llamado al iniciar cada paso.
+        salida: Dict opcional donde se devuelven 'df_completo' y 'caracteristicas_exitosos'.
+                Si es None, se asignan a las variables globales df_completo_global y
+                caracteristicas_exitosos_global.
     
     Returns:
         pd.DataFrame: DataFrame con los proyectos clasificados, o DataFrame vacío si hay error
     """
+    def _entregar(df_completo, caracteristicas):
+        global caracteristicas_exitosos_global, df_completo_global
+        if salida is not None:
+            salida['df_completo'] = df_completo
+            salida['caracteristicas_exitosos'] = caracteristicas
+        else:
+            df_completo_global = df_completo
+            caracteristicas_exitosos_global = caracteristicas
+    
     try:
         # Importar las funciones del script de generación
         import generar_clasificacion as gen_clas
@@ -214,16 +1139,40 @@ def generar_clasificacion_en_memoria(xlsx_path=None):
         print("=" * 70)
         print()
         
+        # Paso 0: Buscar un resultado memorizado para el mismo archivo y versión del pipeline
+        # (sin caché se calcula igual la huella para volver a memorizar el resultado)
+        huella = None
+        if xlsx_path is not None:
+            try:
+                huella = gen_clas.huella_archivo(xlsx_path)
+                # La clave (que incluye la fecha) se calcula una sola vez: si la ejecución
+                # cruza la medianoche, el resultado se guarda con la misma clave consultada
+                clave_memo = gen_clas.clave_resultado_pipeline(huella)
+                memorizado = gen_clas.leer_resultado_pipeline(huella, clave_memo) if usar_cache else None
+                if memorizado is not None:
+                    resultado, df_completo, caracteristicas = memorizado
+                    _entregar(df_completo, caracteristicas)
+                    _reportar_progreso(progreso, '0', 'Resultado memorizado cargado')
+                    print(f"✓ Resultado memorizado cargado (versión del pipeline {gen_clas.PIPELINE_VERSION}): {len(resultado)} proyectos")
+                    print()
+                    return resultado
+            except Exception as e:
+                print(f"⚠ No se pudo consultar el resultado memorizado: {str(e)}")
+                huella = None
+        
         # Paso 1: Cargar datos
         print("1. Cargando datos desde Base Proyectos.xlsx...")
+        _reportar_progreso(progreso, '1', "Cargando datos desde Base Proyectos.xlsx")
         inm, pry = gen_clas.cargar_datos(xlsx_path)
         
         # Paso 2: Detectar llaves
         print("2. Detectando llaves de unión...")
+        _reportar_progreso(progreso, '2', "Detectando llaves de unión")
         key_inm, key_pry = gen_clas.detectar_llaves(inm, pry)
         
         # Paso 3: Unir datos
         print("3. Uniendo datos de Inmuebles y Proyectos...")
+        _reportar_progreso(progreso, '3', "Uniendo datos de Inmuebles y Proyectos")
         print("   IMPORTANTE: Todas las columnas de Proyectos se unen a Inmuebles")
         inm_join = gen_clas.unir_datos(inm, pry, key_inm, key_pry)
         
@@ -238,10 +1187,12 @@ def generar_clasificacion_en_memoria(xlsx_path=None):
         
         # Paso 4: Detectar columnas de proyectos (AHORA desde inm_join, no desde pry)
         print("4. Detectando columnas de proyectos (desde inm_join)...")
+        _reportar_progreso(progreso, '4', "Detectando columnas de proyectos (desde inm_join)")
         cols_proy = gen_clas.detectar_columnas_proyectos(inm_join)
         
         # Paso 5: Agregar datos por proyecto (manteniendo TODAS las columnas de Proyectos)
         print("5. Agregando datos por proyecto...")
+        _reportar_progreso(progreso, '5', "Agregando datos por proyecto")
         print("   El dataset inm_join ya tiene todas las columnas de Proyectos")
         print("   Agregamos para tener un dataset a nivel de proyecto")
         
@@ -249,8 +1200,13 @@ def generar_clasificacion_en_memoria(xlsx_path=None):
         # También agregar features de inmuebles
         cols_inm = gen_clas.detectar_columnas_inmuebles(inm_join)
         
-        # Agregar por proyecto manteniendo todas las columnas de Proyectos
-        proj_ds = gen_clas.agregar_datos_por_proyecto(inm_join, cols_inm, cols_proy, key_inm, key_pry)
+        # Agregar por proyecto manteniendo todas las columnas de Proyectos.
+        # Con caché, solo se vuelven a agregar los proyectos cuyas filas cambiaron desde la última ejecución.
+        # Sin caché (forzar=1) se agrega todo desde cero, pero el estado se vuelve a guardar.
+        estado_incremental = gen_clas.leer_estado_incremental() if usar_cache else {}
+        proj_ds, estado_agregado = gen_clas.agregar_datos_por_proyecto_incremental(
+            inm_join, cols_inm, cols_proy, key_inm, key_pry, previo=estado_incremental.get('agregado')
+        )
         
         # VALIDACIÓN CRÍTICA: Verificar que proj_ds no esté vacío después de agregar
         if proj_ds is None or proj_ds.empty:
@@ -266,6 +1222,7 @@ def generar_clasificacion_en_memoria(xlsx_path=None):
         # Paso 6: Feature Engineering Avanzado (FASE 2)
         # Las funciones ahora SIEMPRE devuelven valores válidos, no necesitan try-except
         print("6. Creando features avanzados...")
+        _reportar_progreso(progreso, '6', "Creando features avanzados")
         proj_ds_antes = len(proj_ds)
         proj_ds = gen_clas.crear_features_avanzados(proj_ds, cols_proy)
         if proj_ds is None or proj_ds.empty:
@@ -277,6 +1234,7 @@ def generar_clasificacion_en_memoria(xlsx_path=None):
         # Paso 7: Entrenar Modelo RandomForest (FASE 2)
         # Esta función puede devolver None si no hay datos suficientes, pero no falla
         print("7. Entrenando modelo de Machine Learning...")
+        _reportar_progreso(progreso, '7', "Entrenando modelo de Machine Learning")
         modelo_rf, importancia_features = gen_clas.entrenar_modelo_random_forest(proj_ds, cols_proy, usar_modelo=True)
         if modelo_rf is not None:
             print("  ✓ Modelo entrenado exitosamente")
@@ -286,6 +1244,7 @@ def generar_clasificacion_en_memoria(xlsx_path=None):
         # Paso 8: Calcular Score Compuesto (FASE 2)
         # Esta función SIEMPRE devuelve valores válidos
         print("8. Calculando score compuesto...")
+        _reportar_progreso(progreso, '8', "Calculando score compuesto")
         proj_ds_antes = len(proj_ds)
         proj_ds = gen_clas.calcular_score_compuesto(proj_ds, cols_proy)
         if proj_ds is None or proj_ds.empty:
@@ -297,9 +1256,14 @@ def generar_clasificacion_en_memoria(xlsx_path=None):
         # Paso 9: Clasificar proyectos (con validación y clasificación por segmentos)
         # Esta función GARANTIZA que todos los proyectos tengan clasificación válida
         print("9. Clasificando proyectos...")
+        _reportar_progreso(progreso, '9', "Clasificando proyectos")
         proj_ds_antes = len(proj_ds)
         print(f"  DataFrame antes de clasificar: {proj_ds_antes} filas")
-        proj_ds = gen_clas.clasificar_proyectos(proj_ds, cols_proy)
+        cache_segmentos = dict(estado_incremental.get('segmentos') or {})
+        # Tabla de amenidades (columna 'Otros') compartida por la clasificación y el análisis de exitosos
+        tabla_amenidades = gen_clas.construir_tabla_amenidades(proj_ds, cols_proy.get('otros'))
+        proj_ds = gen_clas.clasificar_proyectos(proj_ds, cols_proy, cache_segmentos=cache_segmentos,
+                                                tabla_amenidades=tabla_amenidades)
         
         if proj_ds is None or proj_ds.empty:
             print(f"❌ ERROR: proj_ds está vacío después de clasificar_proyectos")
@@ -328,11 +1292,13 @@ def generar_clasificacion_en_memoria(xlsx_path=None):
         # Paso 10: Determinar patrón de ventas (mejorado)
         # Esta función SIEMPRE devuelve valores válidos
         print("10. Determinando patrones de ventas...")
+        _reportar_progreso(progreso, '10', "Determinando patrones de ventas")
         proj_ds = gen_clas.determinar_patron_ventas(proj_ds, cols_proy)
         print(f"  ✓ Patrones de ventas determinados. DataFrame tiene {len(proj_ds)} filas")
         
         # Paso 10.5: Analizar características de proyectos exitosos
         print("10.5. Analizando características de proyectos exitosos...")
+        _reportar_progreso(progreso, '10.5', "Analizando características de proyectos exitosos")
         # Verificar que la columna "Otros" esté disponible para análisis de amenidades
         col_otros = cols_proy.get('otros')
         if col_otros:
@@ -347,13 +1313,12 @@ def generar_clasificacion_en_memoria(xlsx_path=None):
         else:
             print("  ⚠ No se detectó columna 'Otros' en cols_proy")
         
-        global caracteristicas_exitosos_global
-        caracteristicas_exitosos_global = gen_clas.analizar_caracteristicas_exitosos(proj_ds, cols_proy)
-        if caracteristicas_exitosos_global:
-            print(f"  ✓ Características analizadas: {len(caracteristicas_exitosos_global)} métricas")
+        caracteristicas = gen_clas.analizar_caracteristicas_exitosos(proj_ds, cols_proy, tabla_amenidades)
+        if caracteristicas:
+            print(f"  ✓ Características analizadas: {len(caracteristicas)} métricas")
             # Verificar si hay amenidades en las características
-            if 'amenidades' in caracteristicas_exitosos_global:
-                amenidades = caracteristicas_exitosos_global['amenidades']
+            if 'amenidades' in caracteristicas:
+                amenidades = caracteristicas['amenidades']
                 if amenidades and 'amenidades_exitosos' in amenidades:
                     num_amenidades = len(amenidades['amenidades_exitosos'])
                     print(f"  ✓ Amenidades analizadas: {num_amenidades} amenidades distintas")
@@ -381,6 +1346,7 @@ def generar_clasificacion_en_memoria(xlsx_path=None):
         
         # Paso 12: Generar DataFrame final con formato esperado
         print("11. Generando formato final...")
+        _reportar_progreso(progreso, '11', "Generando formato final")
         print(f"  DataFrame antes de generar archivo final: {len(proj_ds)} filas, {len(proj_ds.columns)} columnas")
         
         # VALIDACIÓN CRÍTICA: Verificar que proj_ds no esté vacío antes de generar archivo final
@@ -402,9 +1368,8 @@ def generar_clasificacion_en_memoria(xlsx_path=None):
         
         try:
             # Guardar el dataframe completo antes de generar el archivo final
-            global df_completo_global
-            df_completo_global = proj_ds.copy()
-            print(f"  ✓ DataFrame completo guardado globalmente: {len(df_completo_global)} proyectos, {len(df_completo_global.columns)} columnas")
+            df_completo = proj_ds.copy()
+            print(f"  ✓ DataFrame completo guardado: {len(df_completo)} proyectos, {len(df_completo.columns)} columnas")
             
             resultado = gen_clas.generar_archivo_final(proj_ds, cols_proy, key_pry)
             
@@ -425,6 +1390,12 @@ def generar_clasificacion_en_memoria(xlsx_path=None):
             print("  ✓ Retornando dataset de salida del modelo sin modificaciones adicionales")
             print()
             
+            if huella is not None:
+                gen_clas.guardar_resultado_pipeline(huella, resultado, df_completo, caracteristicas, clave_memo)
+            if estado_agregado is not None:
+                gen_clas.guardar_estado_incremental({'agregado': estado_agregado, 'segmentos': cache_segmentos})
+            
+            _entregar(df_completo, caracteristicas)
             return resultado
         except Exception as e:
             print(f"❌ Error al generar archivo final: {str(e)}")
@@ -457,11 +1428,18 @@ def guardar_clasificacion_excel(df, filename='proyectos_clasificados.xlsx'):
         print(f"⚠ Error al guardar archivo: {str(e)}")
         return False
 
-def load_data():
+def load_data(usar_cache=True, progreso=None, salida=None):
     """Carga los datos de proyectos clasificados generándolos directamente desde Base Proyectos.xlsx.
     
     La aplicación siempre genera los datos en memoria desde Base Proyectos.xlsx,
     sin depender de archivos Excel intermedios.
+    
+    Args:
+        usar_cache: Si False, fuerza la ejecución completa del pipeline ignorando
+                    el resultado memorizado en disco.
+        progreso: Callback opcional de progreso (ver generar_clasificacion_en_memoria).
+        salida: Dict opcional para recibir df_completo y caracteristicas_exitosos
+                (ver generar_clasificacion_en_memoria).
     """
     try:
         import os
@@ -524,7 +1502,8 @@ def load_data():
         print()
         
         # Pasar la ruta del archivo a la función de generación
-        df_clasificados = generar_clasificacion_en_memoria(base_proyectos_path)
+        df_clasificados = generar_clasificacion_en_memoria(base_proyectos_path, usar_cache=usar_cache,
+                                                           progreso=progreso, salida=salida)
         
         if df_clasificados.empty:
             print("[ERROR] No se pudieron generar los datos de clasificación")
@@ -544,20 +1523,18 @@ def load_data():
         # Procesar coordenadas para todos los proyectos
         if 'Coordenadas Reales' in df_clasificados.columns:
             print(f"  Procesando coordenadas de {len(df_clasificados)} proyectos...")
-            df_clasificados['Coordenadas_Parsed'] = df_clasificados['Coordenadas Reales'].apply(parse_coordinates)
+            lat, lon = parse_coordinates_serie(df_clasificados['Coordenadas Reales'])
             
-            # Separar proyectos con y sin coordenadas válidas
-            mask_con_coords = df_clasificados['Coordenadas_Parsed'].notna()
+            # Columna de compatibilidad (lat, lon) o None, que siguen devolviendo
+            # /api/dataset-completo, /api/buscar-proyectos y /api/descargar
+            df_clasificados['Coordenadas_Parsed'] = coordenadas_como_tuplas(lat, lon)
+            # Asignar Lat y Lon a todos los proyectos (NaN si no tienen coordenadas válidas)
+            df_clasificados['Lat'] = lat
+            df_clasificados['Lon'] = lon
+            mask_con_coords = df_clasificados['Lat'].notna()
             proyectos_con_coords = mask_con_coords.sum()
             
-            # Asignar Lat y Lon a todos los proyectos
-            df_clasificados['Lat'] = None
-            df_clasificados['Lon'] = None
-            
-            # Solo asignar coordenadas a los que tienen coordenadas válidas
             if proyectos_con_coords > 0:
-                df_clasificados.loc[mask_con_coords, 'Lat'] = df_clasificados.loc[mask_con_coords, 'Coordenadas_Parsed'].apply(lambda x: x[0] if x is not None else None)
-                df_clasificados.loc[mask_con_coords, 'Lon'] = df_clasificados.loc[mask_con_coords, 'Coordenadas_Parsed'].apply(lambda x: x[1] if x is not None else None)
                 print(f"  ✓ Proyectos con coordenadas válidas: {proyectos_con_coords}")
                 print(f"  ⚠ Proyectos sin coordenadas válidas: {len(df_clasificados) - proyectos_con_coords}")
                 
@@ -589,12 +1566,12 @@ def load_data():
                 print("  Todos los proyectos se mostrarán sin coordenadas en el mapa")
         else:
             print("  ⚠ Advertencia: No se encontró columna de coordenadas")
-            df_clasificados['Lat'] = None
-            df_clasificados['Lon'] = None
             df_clasificados['Coordenadas_Parsed'] = None
+            df_clasificados['Lat'] = np.nan
+            df_clasificados['Lon'] = np.nan
 
         # NO filtrar - devolver TODOS los proyectos
-        df_with_coords = df_clasificados.copy()
+        df_with_coords = optimizar_tipos_dataset(df_clasificados.copy())
         
         # Verificar columnas esenciales
         columnas_esperadas = ['Codigo_Proyecto', 'Proyecto', 'Clasificacion', 'Score_Exito', 'Zona', 'Barrio']
@@ -620,6 +1597,57 @@ def load_data():
         print("=" * 70)
         return pd.DataFrame()
 
+# Columnas de baja cardinalidad que se sirven como dtype 'category'
+COLUMNAS_CATEGORICAS = ['Zona', 'Barrio', 'Clasificacion', 'Clasificacion_Compuesta', 'Patron_Ventas',
+                        'Vende', 'Tipo VIS', 'Tipo_VIS', 'Tipo_VIS_Principal', 'TipoVIS']
+
+def optimizar_tipos_dataset(df):
+    """Reduce la memoria del dataset servido antes de publicarlo.
+    
+    - Las columnas de texto de baja cardinalidad (COLUMNAS_CATEGORICAS) pasan a 'category'.
+    - Las columnas enteras se reducen al ancho mínimo que contiene sus valores.
+    - Las columnas float64 pasan a float32 solo si la conversión es exacta para todos
+      los valores, de modo que los valores servidos no cambian.
+    
+    Args:
+        df: DataFrame de proyectos (se modifica y se retorna)
+    
+    Returns:
+        pd.DataFrame: El mismo DataFrame con tipos optimizados
+    """
+    try:
+        memoria_antes = df.memory_usage(deep=True).sum()
+        
+        for col in COLUMNAS_CATEGORICAS:
+            if col in df.columns and df[col].dtype == object:
+                valores = df[col].dropna()
+                if valores.map(type).eq(str).all() and valores.nunique() <= len(df) // 2:
+                    df[col] = df[col].astype('category')
+        
+        for col in df.select_dtypes(include=['int64', 'int32']).columns:
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+        
+        for col in df.select_dtypes(include=['float64']).columns:
+            serie = df[col]
+            serie_32 = serie.astype(np.float32)
+            if (serie_32.astype(np.float64).eq(serie) | serie.isna()).all():
+                df[col] = serie_32
+        
+        memoria_despues = df.memory_usage(deep=True).sum()
+        print(f"  ✓ Tipos optimizados: {memoria_antes / 1e6:.1f} MB -> {memoria_despues / 1e6:.1f} MB")
+    except Exception as e:
+        print(f"⚠ No se pudieron optimizar los tipos del dataset: {str(e)}")
+    return df
+
+def contar_valores(serie):
+    """value_counts() que ignora las categorías sin filas de una columna 'category'.
+    
+    Conserva el mismo orden que con dtype object (empates en orden de aparición).
+    """
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        serie = serie.astype(object)
+    return serie.value_counts()
+
 def proyecto_to_dict(row):
     """Convierte una fila del DataFrame a diccionario de manera eficiente.
     GARANTIZA que la clasificación siempre sea válida (Exitoso, Moderado, o Mejorable)."""
@@ -673,6 +1701,96 @@ def proyecto_to_dict(row):
         'color': get_color_by_clasificacion(clasificacion)
     }
 
+def proyectos_to_records(df):
+    """Versión vectorizada de proyecto_to_dict para un DataFrame completo.
+
+    Calcula cada campo de salida como operación sobre la columna completa y arma
+    los registros al final, en lugar de procesar fila por fila. Produce exactamente
+    los mismos registros que aplicar proyecto_to_dict a cada fila.
+    """
+    if df.empty:
+        return []
+
+    n = len(df)
+
+    def _texto(col, defecto):
+        if col in df.columns:
+            return df[col].astype(str)
+        return pd.Series(defecto, index=df.index)
+
+    def _numero(col, defecto_sin_columna, defecto_nulo):
+        if col not in df.columns:
+            return [defecto_sin_columna] * n
+        s = pd.to_numeric(df[col])
+        return s.astype(float).astype(object).where(s.notna(), defecto_nulo).tolist()
+
+    def _entero(col):
+        if col not in df.columns:
+            return [0] * n
+        s = pd.to_numeric(df[col])
+        return s.fillna(0).astype('int64').tolist()
+
+    # Clasificación: siempre una de las válidas (por defecto 'Moderado')
+    clasificacion = _texto('Clasificacion', 'Moderado').str.strip()
+    clasificacion = clasificacion.where(clasificacion.isin(list(COLORES_CLASIFICACION)), 'Moderado')
+    color = clasificacion.map(COLORES_CLASIFICACION)
+
+    # Vendedor (columna Vende) limpio
+    vende = _texto('Vende', 'N/A').str.strip()
+    vende = vende.mask(vende.isin(['nan', '', 'none', 'None']), 'N/A')
+
+    # Tipo VIS: primera variante de nombre de columna con valor válido
+    tipo_vis = pd.Series('N/A', index=df.index, dtype=object)
+    pendiente = pd.Series(True, index=df.index)
+    for col_name in ['Tipo VIS', 'Tipo_VIS', 'Tipo_VIS_Principal', 'TipoVIS']:
+        if col_name in df.columns:
+            val = df[col_name].astype(str).str.strip()
+            valido = pendiente & df[col_name].notna() & ~val.isin(['', 'nan', 'None'])
+            tipo_vis = tipo_vis.mask(valido, val)
+            pendiente &= ~valido
+
+    # Estrato: 'N/A' si es nulo o cero
+    if 'Estrato' in df.columns:
+        estrato_num = pd.to_numeric(df['Estrato'], errors='coerce')
+        estrato = df['Estrato'].astype(str).where(df['Estrato'].notna() & (estrato_num != 0), 'N/A')
+    else:
+        estrato = pd.Series('N/A', index=df.index)
+
+    # Precio promedio y su formato de moneda
+    if 'Precio_Promedio' in df.columns:
+        precio = pd.to_numeric(df['Precio_Promedio'])
+        precio_promedio = precio.astype(float).astype(object).where(precio.notna(), 0).tolist()
+        precio_formateado = precio.astype(float).map('${:,.0f} COP'.format).where(precio.notna(), 'N/A').tolist()
+    else:
+        precio_promedio = [0.0] * n
+        precio_formateado = ['$0 COP'] * n
+
+    campos = {
+        'id': df.index.astype(str).tolist(),
+        'codigo': _texto('Codigo_Proyecto', 'N/A').tolist(),
+        'nombre': _texto('Proyecto', 'Proyecto Sin Nombre').tolist(),
+        'clasificacion': clasificacion.tolist(),
+        'lat': _numero('Lat', 0.0, 0),
+        'lon': _numero('Lon', 0.0, 0),
+        'barrio': _texto('Barrio', 'N/A').tolist(),
+        'zona': _texto('Zona', 'N/A').tolist(),
+        'estrato': estrato.tolist(),
+        'tipo_vis': tipo_vis.tolist(),
+        'vende': vende.tolist(),
+        'precio_promedio': precio_promedio,
+        'precio_formateado': precio_formateado,
+        'area_promedio': _numero('Area_Promedio', 0, 0),
+        'velocidad_ventas': _numero('Velocidad_Ventas', 0, 0),
+        'unidades_vendidas': _entero('Unidades_Vendidas'),
+        'unidades_disponibles': _entero('Unidades_Disponibles'),
+        'patron_ventas': _texto('Patron_Ventas', 'Sin datos').tolist(),
+        'score_exito': _numero('Score_Exito', 0.5, 0.5),
+        'color': color.tolist()
+    }
+
+    claves = list(campos)
+    return [dict(zip(claves, valores)) for valores in zip(*campos.values())]
+
 # Cargar datos al inicio (una sola vez)
 df_data = load_data()
 
@@ -698,20 +1816,182 @@ else:
     print(f"  Columnas: {list(df_data.columns)}")
     print()
 
-# Cachear opciones de filtros (variable global para evitar recálculo)
-_filtros_cache = None
+# ------------------------------
+# Snapshot del dataset publicado
+# ------------------------------
+# Todo lo que depende de una misma generación de la clasificación (df_data,
+# df_completo_global, caracteristicas_exitosos_global y las cachés derivadas) se
+# agrupa en un único dict. Publicar una nueva generación consiste en reasignar
+# _snapshot, una operación atómica: cada petición toma el snapshot al comenzar y
+# trabaja con él hasta el final, sin ver nunca un estado a medio actualizar.
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+def publicar_snapshot(df, df_completo, caracteristicas_exitosos):
+    """Publica una nueva generación del dataset reemplazando el snapshot actual.
+    
+    Args:
+        df: DataFrame de proyectos clasificados (df_data)
+        df_completo: DataFrame completo con todas las columnas (df_completo_global)
+        caracteristicas_exitosos: Dict de características de proyectos exitosos
+    
+    Returns:
+        dict: El snapshot publicado
+    """
+    global _snapshot, df_data, df_completo_global, caracteristicas_exitosos_global
+    # El índice espacial se construye antes de tomar el lock: publicar solo reemplaza referencias
+    indice_espacial = construir_indice_espacial(df)
+    with _snapshot_lock:
+        version = (_snapshot['version'] + 1) if _snapshot is not None else 1
+        nuevo = {
+            'version': version,
+            'id': uuid.uuid4().hex[:8],
+            'publicado': datetime.now().isoformat(timespec='seconds'),
+            'df_data': df,
+            'df_completo': df_completo,
+            'caracteristicas_exitosos': caracteristicas_exitosos if caracteristicas_exitosos is not None else {},
+            'filtros': None,
+            'indice_filtros': None,
+            'cubo_estadisticas': None,
+            'indice_espacial': indice_espacial,
+            'huella': None,
+            'respuestas': OrderedDict(),
+            'teselas': OrderedDict(),
+            'clusters': OrderedDict(),
+            'descargas': OrderedDict(),
+            'descargas_bytes': 0,
+            'respuestas_lock': threading.Lock()
+        }
+        _snapshot = nuevo
+        # Alias de compatibilidad para código que importa estas variables del módulo
+        df_data = df
+        df_completo_global = df_completo
+        caracteristicas_exitosos_global = nuevo['caracteristicas_exitosos']
+    return nuevo
+
+def obtener_snapshot():
+    """Retorna el snapshot actual del dataset.
+    
+    Cada endpoint debe tomarlo una sola vez al inicio de la petición y trabajar solo
+    con ese objeto: una regeneración en segundo plano puede publicar otro snapshot
+    mientras tanto, y mezclar lecturas de ambos daría respuestas inconsistentes.
+    """
+    return _snapshot
+
+# Sincronización del snapshot entre workers. Con --preload cada worker de gunicorn es
+# un proceso aparte, así que una regeneración solo publica el nuevo snapshot en el
+# worker que la ejecutó. Ese worker lo deja en disco (snapshot_publicado.pkl y una marca
+# .json con su id) y los demás comparan la marca con la última que cargaron antes de
+# atender una petición, como mucho una vez cada INTERVALO_SINCRONIZACION segundos.
+# Limitación: el dataset cargado así es una copia privada de cada worker. El ahorro de
+# memoria de --preload (páginas compartidas por copy-on-write con el maestro) solo
+# existe hasta la primera regeneración; a partir de ahí cada worker tiene su propia copia
+# de df_data y df_completo. Para volver a compartirlos hay que reiniciar el servicio
+# (un HUP no basta: con --preload el maestro no vuelve a importar la aplicación); al
+# arrancar, el maestro carga el resultado memorizado de la regeneración.
+INTERVALO_SINCRONIZACION = float(os.getenv('GALERIA_INTERVALO_SINCRONIZACION', '2'))
+_sincronizacion = {'marca': None, 'revisado': 0.0, 'cargando': False}
+_sincronizacion_lock = threading.Lock()
+
+def _rutas_snapshot_publicado():
+    """Rutas del snapshot difundido y de su marca dentro del directorio de caché."""
+    import generar_clasificacion as gen_clas
+    return gen_clas.CACHE_DIR / 'snapshot_publicado.pkl', gen_clas.CACHE_DIR / 'snapshot_publicado.json'
 
-def get_filtros_options():
-    """Obtiene opciones de filtros de manera cacheada."""
-    global _filtros_cache
+def _leer_marca_publicada():
+    """Retorna el id del último snapshot difundido en disco, o None si no hay."""
+    _, ruta_marca = _rutas_snapshot_publicado()
+    try:
+        return json.loads(ruta_marca.read_text(encoding='utf-8')).get('id')
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"⚠ No se pudo leer la marca del snapshot publicado: {str(e)}")
+        return None
+
+def difundir_snapshot(snap):
+    """Guarda en disco el snapshot recién publicado para que lo carguen los demás workers."""
+    import generar_clasificacion as gen_clas
+    ruta_datos, ruta_marca = _rutas_snapshot_publicado()
+    try:
+        contenido = pickle.dumps({
+            'id': snap['id'],
+            'df_data': snap['df_data'],
+            'df_completo': snap['df_completo'],
+            'caracteristicas_exitosos': snap['caracteristicas_exitosos']
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+        # Primero los datos y después la marca: quien vea la marca nueva encuentra los datos
+        gen_clas._escribir_atomico(ruta_datos, contenido)
+        with _sincronizacion_lock:
+            _sincronizacion['marca'] = snap['id']
+        gen_clas._escribir_atomico(ruta_marca, json.dumps({
+            'id': snap['id'],
+            'publicado': snap['publicado'],
+            'pid': os.getpid()
+        }).encode('utf-8'))
+    except Exception as e:
+        print(f"⚠ No se pudo difundir el snapshot a los demás workers: {str(e)}")
+
+def sincronizar_snapshot():
+    """Carga el snapshot difundido por otro worker si es más reciente que el propio.
+    
+    El pickle se lee y se valida fuera de _sincronizacion_lock (las demás peticiones
+    siguen atendiéndose con el snapshot actual); bajo el lock solo se compara la marca
+    y se publica. Un solo hilo por worker carga a la vez ('cargando').
+    """
+    ahora = time.monotonic()
+    with _sincronizacion_lock:
+        if _sincronizacion['cargando'] or ahora - _sincronizacion['revisado'] < INTERVALO_SINCRONIZACION:
+            return
+        _sincronizacion['revisado'] = ahora
+        vista = _sincronizacion['marca']
+    
+    marca = _leer_marca_publicada()
+    if marca is None or marca == vista:
+        return
     
-    # Si el cache existe y los datos no han cambiado, retornar cache
-    if _filtros_cache is not None:
-        return _filtros_cache
+    with _sincronizacion_lock:
+        if _sincronizacion['cargando'] or _sincronizacion['marca'] != vista:
+            return
+        _sincronizacion['cargando'] = True
     
+    import generar_clasificacion as gen_clas
+    snap = None
+    try:
+        ruta_datos, _ = _rutas_snapshot_publicado()
+        datos = pd.read_pickle(ruta_datos) if gen_clas._pickle_confiable(ruta_datos) else {}
+        # Si el id no coincide, otro worker está escribiendo uno más nuevo: se reintenta después
+        if datos.get('id') == marca:
+            with _sincronizacion_lock:
+                # Una regeneración local pudo publicar mientras se leía el archivo
+                if _sincronizacion['marca'] == vista:
+                    snap = publicar_snapshot(datos['df_data'], datos['df_completo'], datos['caracteristicas_exitosos'])
+                    _sincronizacion['marca'] = marca
+    except Exception as e:
+        print(f"⚠ No se pudo cargar el snapshot publicado por otro worker: {str(e)}")
+    finally:
+        with _sincronizacion_lock:
+            _sincronizacion['cargando'] = False
+    if snap is not None:
+        print(f"✓ Snapshot {marca} publicado por otro worker cargado como v{snap['version']} ({len(snap['df_data'])} proyectos)")
+
+publicar_snapshot(df_data, df_completo_global, caracteristicas_exitosos_global)
+# Lo difundido por una ejecución anterior ya está reflejado en el dataset recién cargado
+_sincronizacion['marca'] = _leer_marca_publicada()
+
+# Modo preload de gunicorn (--preload en Procfile/render.yaml): este módulo se importa
+# una sola vez en el proceso maestro y los workers heredan df_data, df_completo_global
+# y caracteristicas_exitosos_global por fork (copy-on-write) en lugar de ejecutar
+# cada uno el pipeline. gc.freeze() mueve los objetos ya creados a la generación
+# permanente para que el recolector de basura de cada worker no escriba en sus
+# cabeceras y así las páginas de memoria sigan compartidas.
+gc.freeze()
+
+def _calcular_filtros_options(df_data):
+    """Calcula las opciones de filtros disponibles en df_data."""
     # Validar que df_data no esté vacío
     if df_data.empty:
-        _filtros_cache = {
+        return {
             'clasificaciones': [],
             'zonas': [],
             'barrios': [],
@@ -719,7 +1999,6 @@ def get_filtros_options():
             'precio_min': 0,
             'precio_max': 0
         }
-        return _filtros_cache
     
     # Verificar que las columnas necesarias existan
     try:
@@ -759,7 +2038,7 @@ def get_filtros_options():
         else:
             precio_min = precio_max = 0
         
-        _filtros_cache = {
+        return {
             'clasificaciones': clasificaciones,
             'zonas': zonas,
             'barrios': barrios,
@@ -767,10 +2046,9 @@ def get_filtros_options():
             'precio_min': precio_min,
             'precio_max': precio_max
         }
-        return _filtros_cache
     except Exception as e:
         print(f"⚠ Error al obtener opciones de filtros: {str(e)}")
-        _filtros_cache = {
+        return {
             'clasificaciones': [],
             'zonas': [],
             'barrios': [],
@@ -778,8 +2056,214 @@ def get_filtros_options():
             'precio_min': 0,
             'precio_max': 0
         }
-        return _filtros_cache
 
+def get_filtros_options(snap=None):
+    """Obtiene opciones de filtros de manera cacheada (una vez por snapshot)."""
+    if snap is None:
+        snap = obtener_snapshot()
+    if snap['filtros'] is None:
+        snap['filtros'] = _calcular_filtros_options(snap['df_data'])
+    return snap['filtros']
+
+# ------------------------------
+# Caché de respuestas JSON por combinación de filtros
+# ------------------------------
+# Cuerpos JSON ya codificados (y su versión gzip) por (endpoint, filtros normalizados).
+# La caché vive dentro del snapshot, así que queda ligada a la versión del dataset y
+# se descarta sola al publicar una nueva generación.
+MAX_RESPUESTAS_CACHE = int(os.getenv('GALERIA_MAX_RESPUESTAS_CACHE', '128'))
+# Las descargas columnares (todas las columnas) pesan mucho más que una respuesta JSON:
+# van en su propia caché, acotada por el total de bytes y no por número de entradas
+MAX_DESCARGAS_CACHE_BYTES = int(os.getenv('GALERIA_MAX_DESCARGAS_CACHE_MB', '64')) * 1024 * 1024
+GZIP_MIN_BYTES = 1024
+
+def normalizar_filtros(args, estado_defecto='Activos', con_vende=True):
+    """Lee los filtros de la query string y los normaliza para usarlos como clave de caché.
+    
+    Valores equivalentes para apply_filters (vacío y 'Todos', precios '' y 'null', etc.)
+    producen la misma tupla.
+    
+    Returns:
+        tuple: (clasificacion, zona, barrio, tipo_vis, precio_min, precio_max, estado, vende)
+    """
+    estado = args.get('estado', estado_defecto)
+    if estado not in ('Activos', 'Inactivos'):
+        estado = 'Todos'
+    vende = args.get('vende', None) if con_vende else None
+    return (
+        args.get('clasificacion', 'Todos') or 'Todos',
+        args.get('zona', 'Todas') or 'Todas',
+        args.get('barrio', 'Todos') or 'Todos',
+        args.get('tipo_vis', 'Todos') or 'Todos',
+        _precio_filtro(args.get('precio_min', None)),
+        _precio_filtro(args.get('precio_max', None)),
+        estado,
+        vende or 'Todos'
+    )
+
+def _numeros_parametro(valor, cantidad, nombre):
+    """Convierte 'a,b,...' en una tupla de floats finitos (ValueError si no es válido)."""
+    try:
+        numeros = tuple(float(v) for v in valor.split(','))
+    except ValueError:
+        numeros = ()
+    if len(numeros) != cantidad or not all(np.isfinite(numeros)):
+        esperado = "un número" if cantidad == 1 else f"{cantidad} números separados por coma"
+        raise ValueError(f"Parámetro '{nombre}' inválido: se esperaba {esperado}")
+    return numeros
+
+def normalizar_consulta_espacial(args):
+    """Lee los parámetros espaciales de la query string.
+    
+    - bbox=oeste,sur,este,norte (mismo orden que LatLngBounds.toBBoxString() de Leaflet)
+    - near=lat,lon&radius_m=metros
+    
+    Returns:
+        None si no hay consulta espacial, ('bbox', sur, oeste, norte, este) o
+        ('near', lat, lon, radio_m)
+    
+    Raises:
+        ValueError: Si los parámetros no son válidos
+    """
+    bbox = args.get('bbox')
+    near = args.get('near')
+    if bbox and near:
+        raise ValueError("Use solo uno de los parámetros 'bbox' o 'near'")
+    
+    if bbox:
+        oeste, sur, este, norte = _numeros_parametro(bbox, 4, 'bbox')
+        if not (-90 <= sur <= norte <= 90) or not (-180 <= oeste <= 180 and -180 <= este <= 180):
+            raise ValueError("Parámetro 'bbox' fuera de rango: se espera oeste,sur,este,norte en grados")
+        return ('bbox', sur, oeste, norte, este)
+    
+    if near:
+        lat, lon = _numeros_parametro(near, 2, 'near')
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError("Parámetro 'near' fuera de rango: se espera lat,lon en grados")
+        (radio_m,) = _numeros_parametro(args.get('radius_m', ''), 1, 'radius_m')
+        if radio_m <= 0:
+            raise ValueError("Parámetro 'radius_m' debe ser mayor que 0")
+        return ('near', lat, lon, radio_m)
+    
+    return None
+
+def filtrar_espacial(snap, filtros, espacial):
+    """Proyectos del snapshot que cumplen los filtros y la consulta espacial.
+    
+    Returns:
+        tuple: (DataFrame en orden de cercanía, distancias en metros)
+    """
+    indice = obtener_indice_espacial(snap)
+    if espacial[0] == 'bbox':
+        posiciones, distancias = consultar_bbox(indice, *espacial[1:])
+    else:
+        posiciones, distancias = consultar_radio(indice, *espacial[1:])
+    
+    mask = _mascara_desde_indice(obtener_indice_filtros(snap), *filtros)
+    cumplen = mask[posiciones]
+    return snap['df_data'].iloc[posiciones[cumplen]], distancias[cumplen]
+
+def obtener_cacheado(snap, clave, construir, cache='respuestas', maximo=MAX_RESPUESTAS_CACHE):
+    """Obtiene una entrada de la caché LRU del snapshot, construyéndola si no existe.
+    
+    Args:
+        snap: Snapshot tomado al inicio de la petición
+        clave: Clave hashable de la entrada
+        construir: Función sin argumentos que retorna el valor a cachear
+        cache: Nombre de la caché del snapshot ('respuestas', 'teselas' o 'clusters')
+        maximo: Número máximo de entradas de esa caché
+    """
+    cache = snap[cache]
+    with snap['respuestas_lock']:
+        entrada = cache.get(clave)
+        if entrada is not None:
+            cache.move_to_end(clave)
+            return entrada
+    
+    entrada = construir()
+    with snap['respuestas_lock']:
+        cache[clave] = entrada
+        cache.move_to_end(clave)
+        while len(cache) > maximo:
+            cache.popitem(last=False)
+    return entrada
+
+def obtener_descarga_cacheada(snap, clave):
+    """Retorna la descarga cacheada para la clave, o None si no está en la caché."""
+    with snap['respuestas_lock']:
+        entrada = snap['descargas'].get(clave)
+        if entrada is not None:
+            snap['descargas'].move_to_end(clave)
+        return entrada
+
+def guardar_descarga_cacheada(snap, clave, entrada):
+    """Guarda una descarga en la caché del snapshot sin superar MAX_DESCARGAS_CACHE_BYTES.
+    
+    Args:
+        entrada: dict con 'contenido' (bytes) y los datos necesarios para responder
+    """
+    tamano = len(entrada['contenido'])
+    if tamano > MAX_DESCARGAS_CACHE_BYTES:
+        return
+    with snap['respuestas_lock']:
+        cache = snap['descargas']
+        anterior = cache.pop(clave, None)
+        if anterior is not None:
+            snap['descargas_bytes'] -= len(anterior['contenido'])
+        cache[clave] = entrada
+        snap['descargas_bytes'] += tamano
+        while snap['descargas_bytes'] > MAX_DESCARGAS_CACHE_BYTES:
+            _, descartada = cache.popitem(last=False)
+            snap['descargas_bytes'] -= len(descartada['contenido'])
+
+def etag_vigente(*etags):
+    """Indica si el If-None-Match de la petición coincide con alguno de los ETags dados."""
+    if_none_match = request.headers.get('If-None-Match', '')
+    if not if_none_match:
+        return False
+    etiquetas = {e.strip().removeprefix('W/').strip('"') for e in if_none_match.split(',')}
+    return '*' in etiquetas or any(etag in etiquetas for etag in etags)
+
+def responder_json_cacheado(snap, endpoint, filtros, construir):
+    """Responde con el JSON de (endpoint, filtros) usando la caché LRU del snapshot.
+    
+    El ETag depende solo del identificador del snapshot (único por publicación, y
+    compartido por los workers que lo heredan con --preload) y de la clave, de modo
+    que una petición con If-None-Match vigente recibe 304 sin tocar pandas.
+    
+    Args:
+        snap: Snapshot tomado al inicio de la petición
+        endpoint: Nombre del endpoint (parte de la clave)
+        filtros: Tupla de filtros normalizados (ver normalizar_filtros)
+        construir: Función sin argumentos que retorna el dict a serializar
+    """
+    clave = (endpoint, filtros)
+    etag = f"{snap['id']}-{hashlib.sha1(repr(clave).encode('utf-8')).hexdigest()[:16]}"
+    etag_gzip = f"{etag}-gzip"
+    
+    if etag_vigente(etag, etag_gzip):
+        response = make_response('', 304)
+        response.headers['ETag'] = f'"{etag}"'
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+    
+    entrada = obtener_cacheado(snap, clave, lambda: {'cuerpo': jsonify(construir()).get_data(), 'gzip': None})
+    
+    usar_gzip = 'gzip' in request.headers.get('Accept-Encoding', '').lower() and len(entrada['cuerpo']) >= GZIP_MIN_BYTES
+    if usar_gzip:
+        if entrada['gzip'] is None:
+            entrada['gzip'] = gzip.compress(entrada['cuerpo'], compresslevel=6)
+        response = make_response(entrada['gzip'])
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['ETag'] = f'"{etag_gzip}"'
+    else:
+        response = make_response(entrada['cuerpo'])
+        response.headers['ETag'] = f'"{etag}"'
+    response.headers['Content-Type'] = 'application/json'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
 # ------------------------------
 # Rutas
@@ -805,8 +2289,12 @@ def diagnostico():
     
     script_dir = Path(__file__).parent.absolute()
     base_proyectos_path = script_dir / 'Base Proyectos.xlsx'
+    snap = obtener_snapshot()
+    df_data = snap['df_data']
     
     diagnostico_info = {
+        'dataset_version': snap['version'],
+        'dataset_publicado': snap['publicado'],
         'df_data_vacio': df_data.empty,
         'df_data_tamano': len(df_data) if not df_data.empty else 0,
         'archivo_existe': base_proyectos_path.exists(),
@@ -830,6 +2318,8 @@ def diagnostico():
 def get_proyectos():
     """API para obtener proyectos con filtros."""
     try:
+        snap = obtener_snapshot()
+        df_data = snap['df_data']
         # Validar que df_data no esté vacío
         if df_data.empty:
             print("⚠ ADVERTENCIA: Intentando obtener proyectos pero df_data está vacío")
@@ -845,32 +2335,37 @@ def get_proyectos():
                 'total': 0
             }), 200  # Retornar 200 para que el frontend pueda mostrar el error
         
-        # Obtener filtros de la query string
-        clasificacion = request.args.get('clasificacion', 'Todos')
-        zona = request.args.get('zona', 'Todas')
-        barrio = request.args.get('barrio', 'Todos')
-        tipo_vis = request.args.get('tipo_vis', 'Todos')
-        precio_min = request.args.get('precio_min', None)
-        precio_max = request.args.get('precio_max', None)
-        estado = request.args.get('estado', 'Activos')  # Por defecto: Activos
-        vende = request.args.get('vende', None)
-        
-        # Aplicar filtros
-        df_filtered = apply_filters(df_data, clasificacion, zona, barrio, tipo_vis, precio_min, precio_max, estado, vende)
+        # Obtener filtros de la query string (estado por defecto: Activos)
+        filtros = normalizar_filtros(request.args, estado_defecto='Activos')
         
-        # Convertir a JSON de manera eficiente
-        # Usar to_dict('records') es más rápido que iterrows para DataFrames pequeños/medianos
-        if len(df_filtered) < 1000:
-            proyectos = [proyecto_to_dict(row) for _, row in df_filtered.iterrows()]
-        else:
-            # Para datasets grandes, usar vectorización parcial
-            proyectos = df_filtered.apply(proyecto_to_dict, axis=1).tolist()
+        # Consulta espacial opcional: bbox (área visible del mapa) o near + radius_m
+        try:
+            espacial = normalizar_consulta_espacial(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e), 'proyectos': [], 'total': 0}), 400
+        
+        def construir():
+            if espacial is None:
+                # Aplicar filtros
+                df_filtered = apply_filters(df_data, *filtros)
+                
+                # Convertir a JSON de manera eficiente (serialización por columnas)
+                proyectos = proyectos_to_records(df_filtered)
+            else:
+                # Solo los proyectos de la zona consultada, del más cercano al más lejano
+                df_filtered, distancias = filtrar_espacial(snap, filtros, espacial)
+                proyectos = proyectos_to_records(df_filtered)
+                for proyecto, distancia in zip(proyectos, distancias):
+                    proyecto['distancia_m'] = round(float(distancia), 1)
+            
+            return {
+                'success': True,
+                'proyectos': proyectos,
+                'total': len(proyectos)
+            }
         
-        return jsonify({
-            'success': True,
-            'proyectos': proyectos,
-            'total': len(proyectos)
-        })
+        clave = filtros if espacial is None else filtros + (espacial,)
+        return responder_json_cacheado(snap, 'proyectos', clave, construir)
     except Exception as e:
         print(f"❌ Error en /api/proyectos: {str(e)}")
         import traceback
@@ -882,10 +2377,114 @@ def get_proyectos():
             'total': 0
         }), 500
 
+@app.route('/api/clusters')
+def get_clusters():
+    """API de marcadores agrupados en el servidor para un nivel de zoom.
+    
+    Parámetros: zoom (obligatorio), bbox=oeste,sur,este,norte (opcional) y los mismos
+    filtros de /api/proyectos. La jerarquía de clusters de cada combinación de filtros se
+    calcula una vez por versión del dataset y queda en la caché del snapshot.
+    """
+    try:
+        snap = obtener_snapshot()
+        df_data = snap['df_data']
+        filtros = normalizar_filtros(request.args, estado_defecto='Activos')
+        
+        try:
+            zoom = int(request.args.get('zoom', ''))
+        except ValueError:
+            return jsonify({'success': False, 'error': "Parámetro 'zoom' obligatorio: nivel de zoom entero"}), 400
+        zoom = min(max(zoom, 0), ZOOM_MAX_CLUSTERS + 1)
+        
+        bbox = None
+        if request.args.get('bbox'):
+            try:
+                espacial = normalizar_consulta_espacial({'bbox': request.args['bbox']})
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            _, sur, oeste, norte, este = espacial
+            bbox = (oeste, sur, este, norte)
+        
+        def construir():
+            jerarquia = obtener_cacheado(snap, filtros, lambda: construir_clusters(apply_filters(df_data, *filtros)),
+                                         cache='clusters', maximo=MAX_JERARQUIAS_CACHE)
+            clusters = clusters_a_registros(jerarquia, zoom, bbox)
+            return {
+                'success': True,
+                'zoom': zoom,
+                'clusters': clusters,
+                'total_clusters': len(clusters),
+                'total_proyectos': sum(c['cantidad'] for c in clusters)
+            }
+        
+        return responder_json_cacheado(snap, 'clusters', filtros + (zoom, bbox), construir)
+    except Exception as e:
+        print(f"❌ Error en /api/clusters: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>.mvt')
+def get_tesela(z, x, y):
+    """Tesela vectorial (Mapbox Vector Tile) con los proyectos de la tesela z/x/y.
+    
+    Cada punto lleva id, codigo, nombre, clasificacion, color y score_exito (los mismos
+    valores de /api/proyectos) y admite los mismos filtros. Las teselas se guardan en la
+    caché del snapshot y en disco por versión del dataset (huella del contenido), y el
+    ETag depende solo de esa versión y de los filtros, así que sobrevive a reinicios.
+    """
+    try:
+        if not (0 <= z <= ZOOM_MAX_TESELAS and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return jsonify({'success': False, 'error': f'Tesela fuera de rango: {z}/{x}/{y}'}), 400
+        
+        snap = obtener_snapshot()
+        filtros = normalizar_filtros(request.args, estado_defecto='Activos')
+        version = huella_dataset(snap)
+        clave_filtros = hashlib.sha1(repr(filtros).encode('utf-8')).hexdigest()[:12]
+        etag = f"{version}-{clave_filtros}-{z}-{x}-{y}"
+        etag_gzip = f"{etag}-gzip"
+        
+        if etag_vigente(etag, etag_gzip):
+            response = make_response('', 304)
+            response.headers['ETag'] = f'"{etag}"'
+        else:
+            def construir():
+                contenido = leer_tesela_disco(version, clave_filtros, z, x, y)
+                if contenido is None:
+                    puntos = obtener_cacheado(snap, ('teselas', filtros),
+                                              lambda: preparar_puntos_teselas(apply_filters(snap['df_data'], *filtros)))
+                    contenido = construir_tesela(puntos, z, x, y)
+                    guardar_tesela_disco(version, clave_filtros, z, x, y, contenido)
+                return {'cuerpo': contenido, 'gzip': None}
+            
+            entrada = obtener_cacheado(snap, (filtros, z, x, y), construir, cache='teselas', maximo=MAX_TESELAS_CACHE)
+            
+            usar_gzip = 'gzip' in request.headers.get('Accept-Encoding', '').lower() and len(entrada['cuerpo']) >= GZIP_MIN_BYTES
+            if usar_gzip:
+                if entrada['gzip'] is None:
+                    entrada['gzip'] = gzip.compress(entrada['cuerpo'], compresslevel=6)
+                response = make_response(entrada['gzip'])
+                response.headers['Content-Encoding'] = 'gzip'
+                response.headers['ETag'] = f'"{etag_gzip}"'
+            else:
+                response = make_response(entrada['cuerpo'])
+                response.headers['ETag'] = f'"{etag}"'
+            response.headers['Content-Type'] = 'application/vnd.mapbox-vector-tile'
+        response.headers['Cache-Control'] = f'public, max-age={MAX_AGE_TESELAS}'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+    except Exception as e:
+        print(f"❌ Error en /tiles/{z}/{x}/{y}.mvt: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/filtros')
 def get_filtros():
     """API para obtener opciones de filtros."""
     try:
+        snap = obtener_snapshot()
+        df_data = snap['df_data']
         # Validar que df_data no esté vacío
         if df_data.empty:
             print("⚠ ADVERTENCIA: Intentando obtener filtros pero df_data está vacío")
@@ -900,7 +2499,7 @@ def get_filtros():
                 'precio_max': 0
             }), 200  # Retornar 200 para que el frontend pueda mostrar el error
         
-        options = get_filtros_options()
+        options = get_filtros_options(snap)
         return jsonify({
             'success': True,
             **options
@@ -924,59 +2523,77 @@ def get_filtros():
 def get_estadisticas():
     """API para obtener estadísticas de los proyectos filtrados."""
     try:
-        # Obtener filtros
-        clasificacion = request.args.get('clasificacion', 'Todos')
-        zona = request.args.get('zona', 'Todas')
-        barrio = request.args.get('barrio', 'Todos')
-        tipo_vis = request.args.get('tipo_vis', 'Todos')
-        precio_min = request.args.get('precio_min', None)
-        precio_max = request.args.get('precio_max', None)
-        estado = request.args.get('estado', 'Activos')  # Por defecto: Activos
-        
-        # Aplicar filtros usando función helper
-        df_filtered = apply_filters(df_data, clasificacion, zona, barrio, tipo_vis, precio_min, precio_max, estado)
-        
-        # Validar que df_data no esté vacío
-        if df_data.empty:
-            return jsonify({
+        snap = obtener_snapshot()
+        df_data = snap['df_data']
+        # Obtener filtros (estado por defecto: Activos; este endpoint no filtra por vendedor)
+        filtros = normalizar_filtros(request.args, estado_defecto='Activos', con_vende=False)
+        
+        def construir():
+            # Validar que df_data no esté vacío
+            if df_data.empty:
+                return {
+                    'success': True,
+                    'total': 0,
+                    'exitosos': 0,
+                    'moderados': 0,
+                    'mejorables': 0,
+                    'score_promedio': 0.0
+                }
+            
+            # Consultar el cubo precalculado (se construye una vez por versión del dataset)
+            sumas = consultar_cubo_estadisticas(obtener_cubo_estadisticas(snap), *filtros)
+            
+            # Calcular estadísticas
+            total = int(sumas['total'])
+            exitosos = int(sumas['exitosos'])
+            moderados = int(sumas['moderados'])
+            mejorables = int(sumas['mejorables'])
+            
+            if total > 0 and 'Score_Exito' in df_data.columns:
+                avg_score = sumas['suma_score'] / sumas['n_score'] if sumas['n_score'] > 0 else float('nan')
+            else:
+                avg_score = 0
+            
+            return {
                 'success': True,
-                'total': 0,
-                'exitosos': 0,
-                'moderados': 0,
-                'mejorables': 0,
-                'score_promedio': 0.0
-            })
-        
-        # Calcular estadísticas
-        total = len(df_filtered)
-        if 'Clasificacion' in df_filtered.columns:
-            exitosos = len(df_filtered[df_filtered['Clasificacion'] == 'Exitoso']) if total > 0 else 0
-            moderados = len(df_filtered[df_filtered['Clasificacion'] == 'Moderado']) if total > 0 else 0
-            mejorables = len(df_filtered[df_filtered['Clasificacion'] == 'Mejorable']) if total > 0 else 0
-        else:
-            exitosos = moderados = mejorables = 0
-        
-        avg_score = float(df_filtered['Score_Exito'].mean()) if total > 0 and 'Score_Exito' in df_filtered.columns else 0
+                'total': total,
+                'exitosos': exitosos,
+                'moderados': moderados,
+                'mejorables': mejorables,
+                'score_promedio': round(avg_score, 2)
+            }
         
-        return jsonify({
-            'success': True,
-            'total': total,
-            'exitosos': exitosos,
-            'moderados': moderados,
-            'mejorables': mejorables,
-            'score_promedio': round(avg_score, 2)
-        })
+        return responder_json_cacheado(snap, 'estadisticas', filtros, construir)
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+def _entero_no_negativo(valor, defecto=None):
+    """Convierte un parámetro de query a entero >= 0 (o retorna el defecto)."""
+    if valor is None or valor == '':
+        return defecto
+    try:
+        return max(0, int(valor))
+    except (ValueError, TypeError):
+        return defecto
+
 @app.route('/api/dataset-completo')
 def get_dataset_completo():
     """API para obtener el dataset completo con TODAS las columnas (originales + calculadas).
-    Útil para segmentación y visualizaciones avanzadas."""
+    Útil para segmentación y visualizaciones avanzadas.
+    
+    Parámetros adicionales a los filtros:
+        columns: Lista de columnas separadas por coma (por defecto, todas)
+        offset: Posición de la primera fila a retornar (por defecto 0)
+        limit: Número máximo de filas a retornar, mayor que 0 (por defecto, todas)
+    La respuesta incluye 'siguiente_offset' (None en la última página) y
+    'dataset_version' para detectar si el dataset cambió entre páginas.
+    """
     try:
+        snap = obtener_snapshot()
+        df_data = snap['df_data']
         # Validar que df_data no esté vacío
         if df_data.empty:
             return jsonify({
@@ -997,34 +2614,57 @@ def get_dataset_completo():
         estado = request.args.get('estado', 'Activos')  # Por defecto: Activos
         vende = request.args.get('vende', None)
         
-        # Aplicar filtros
-        df_filtered = apply_filters(df_data, clasificacion, zona, barrio, tipo_vis, precio_min, precio_max, estado, vende)
-        
-        # Convertir TODAS las columnas a JSON
-        # Usar to_dict('records') para preservar todas las columnas
-        proyectos = df_filtered.to_dict('records')
-        
-        # Convertir NaN, None, y otros valores problemáticos a None para JSON
-        for proyecto in proyectos:
-            for key, value in proyecto.items():
-                if pd.isna(value):
-                    proyecto[key] = None
-                elif isinstance(value, pd.Timestamp):
-                    proyecto[key] = str(value)
-                elif isinstance(value, (np.integer, np.floating)):
-                    if isinstance(value, np.integer):
-                        proyecto[key] = int(value)
-                    elif isinstance(value, np.floating):
-                        proyecto[key] = None if np.isnan(value) else float(value)
-                    else:
-                        proyecto[key] = value.item() if hasattr(value, 'item') else value
+        # Proyección de columnas
+        columnas = list(df_data.columns)
+        columnas_param = request.args.get('columns', '').strip()
+        if columnas_param:
+            columnas = [c.strip() for c in columnas_param.split(',') if c.strip()]
+            desconocidas = [c for c in columnas if c not in df_data.columns]
+            if desconocidas:
+                return jsonify({
+                    'success': False,
+                    'error': f'Columnas no encontradas: {desconocidas}',
+                    'proyectos': [],
+                    'total': 0,
+                    'columnas': []
+                }), 400
+        
+        # Paginación (limit=0 no avanzaría nunca: siguiente_offset sería igual a offset)
+        offset = _entero_no_negativo(request.args.get('offset'), 0)
+        limit = _entero_no_negativo(request.args.get('limit'), None)
+        if limit == 0:
+            return jsonify({
+                'success': False,
+                'error': "El parámetro 'limit' debe ser mayor que 0",
+                'proyectos': [],
+                'total': 0,
+                'columnas': []
+            }), 400
+        
+        # Aplicar filtros sobre el índice y copiar solo las filas de la página y las columnas pedidas
+        posiciones = posiciones_filtradas(snap, clasificacion, zona, barrio, tipo_vis, precio_min, precio_max, estado, vende)
+        total_filtrados = len(posiciones)
+        fin = total_filtrados if limit is None else min(offset + limit, total_filtrados)
+        df_pagina = df_data.iloc[posiciones[offset:fin], df_data.columns.get_indexer(columnas)]
+        
+        # Fechas como 'AAAA-MM-DD HH:MM:SS' (formato histórico del endpoint); el proveedor
+        # JSON se encarga del resto (NaN -> null, escalares numpy)
+        fechas = [col for col in df_pagina.columns if pd.api.types.is_datetime64_any_dtype(df_pagina[col])]
+        if fechas:
+            df_pagina = df_pagina.assign(**{col: df_pagina[col].dt.strftime('%Y-%m-%d %H:%M:%S') for col in fechas})
+        proyectos = df_pagina.to_dict('records')
         
         return jsonify({
             'success': True,
             'proyectos': proyectos,
             'total': len(proyectos),
-            'columnas': list(df_filtered.columns),
-            'total_columnas': len(df_filtered.columns)
+            'total_filtrados': total_filtrados,
+            'offset': offset,
+            'limit': limit,
+            'siguiente_offset': fin if fin < total_filtrados else None,
+            'dataset_version': snap['version'],
+            'columnas': columnas,
+            'total_columnas': len(columnas)
         })
     except Exception as e:
         print(f"❌ Error en /api/dataset-completo: {str(e)}")
@@ -1038,10 +2678,71 @@ def get_dataset_completo():
             'columnas': []
         }), 500
 
+# Filas por bloque en la exportación CSV por streaming
+FILAS_POR_BLOQUE_CSV = 200
+
+# Formatos binarios columnares de /api/descargar: (extensión, Content-Type)
+FORMATOS_COLUMNARES = {
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'feather': ('feather', 'application/vnd.apache.arrow.file'),
+    'arrow': ('arrows', 'application/vnd.apache.arrow.stream')
+}
+
+def _preparar_para_arrow(df):
+    """Prepara un DataFrame para convertirlo a Arrow.
+    
+    Las columnas object con tipos mezclados (p. ej. 'Número de garajes' con '1 a 2' y
+    enteros) no tienen un tipo Arrow único; se exportan como texto conservando los nulos.
+    """
+    df = df.reset_index(drop=True)
+    for col in df.columns[df.dtypes == object]:
+        try:
+            pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+def exportar_columnar(df, formato):
+    """Serializa un DataFrame en formato columnar comprimido (zstd).
+    
+    Args:
+        df: DataFrame a exportar
+        formato: 'parquet', 'feather' (Arrow IPC archivo) o 'arrow' (Arrow IPC stream)
+    
+    Returns:
+        bytes: Contenido del archivo
+    """
+    df = _preparar_para_arrow(df)
+    buffer = io.BytesIO()
+    if formato == 'parquet':
+        df.to_parquet(buffer, index=False, compression='zstd')
+    elif formato == 'feather':
+        df.to_feather(buffer, compression='zstd')
+    else:
+        tabla = pa.Table.from_pandas(df, preserve_index=False)
+        opciones = pa.ipc.IpcWriteOptions(compression='zstd')
+        with pa.ipc.new_stream(buffer, tabla.schema, options=opciones) as escritor:
+            escritor.write_table(tabla)
+    return buffer.getvalue()
+
 @app.route('/api/descargar')
 def descargar_csv():
-    """API para descargar datos en CSV con TODAS las columnas."""
+    """API para descargar datos con TODAS las columnas.
+    
+    Por defecto en CSV (streaming). Con format=parquet|feather|arrow se sirve el mismo
+    DataFrame filtrado en formato columnar tipado y comprimido; esos bytes se cachean
+    por versión del dataset y combinación de filtros (ver guardar_descarga_cacheada).
+    """
+    def responder_columnar(entrada, formato):
+        extension, content_type = FORMATOS_COLUMNARES[formato]
+        response = make_response(entrada['contenido'])
+        response.headers['Content-Type'] = content_type
+        response.headers['Content-Disposition'] = f'attachment; filename=proyectos_filtrados_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
+        return response
+    
     try:
+        snap = obtener_snapshot()
+        df_data = snap['df_data']
         # Validar que df_data no esté vacío
         if df_data.empty:
             print("⚠ ADVERTENCIA: Intentando descargar CSV pero df_data está vacío")
@@ -1050,6 +2751,15 @@ def descargar_csv():
                 'error': 'No hay datos disponibles para descargar. Verifica que el archivo Base Proyectos.xlsx exista y contenga datos.'
             }), 400
         
+        # Formatos columnares: buscar en la caché antes de filtrar el DataFrame
+        formato = request.args.get('format', 'csv').lower()
+        clave = None
+        if formato in FORMATOS_COLUMNARES and PYARROW_AVAILABLE:
+            clave = ('descargar', formato, normalizar_filtros(request.args, estado_defecto='Todos', con_vende=False))
+            entrada = obtener_descarga_cacheada(snap, clave)
+            if entrada is not None:
+                return responder_columnar(entrada, formato)
+        
         # Obtener filtros
         clasificacion = request.args.get('clasificacion', 'Todos')
         zona = request.args.get('zona', 'Todas')
@@ -1069,23 +2779,36 @@ def descargar_csv():
                 'error': 'No hay datos que coincidan con los filtros seleccionados.'
             }), 400
         
-        # Crear CSV en memoria con TODAS las columnas
-        # Usar StringIO para texto
-        output = io.StringIO()
-        
-        # Convertir DataFrame a CSV (sin encoding, pandas devuelve string)
-        df_filtered.to_csv(output, index=False)
-        output.seek(0)
-        csv_content = output.getvalue()
-        
-        # Convertir a bytes con UTF-8 BOM para Excel (utf-8-sig agrega BOM automáticamente)
-        csv_bytes = csv_content.encode('utf-8-sig')
+        if formato in FORMATOS_COLUMNARES:
+            if not PYARROW_AVAILABLE:
+                return jsonify({
+                    'success': False,
+                    'error': f'El formato {formato} requiere pyarrow, que no está instalado en el servidor.'
+                }), 501
+            
+            entrada = {'contenido': exportar_columnar(df_filtered, formato)}
+            guardar_descarga_cacheada(snap, clave, entrada)
+            print(f"✓ {formato.capitalize()} generado: {len(df_filtered)} proyectos, {len(df_filtered.columns)} columnas, {len(entrada['contenido'])} bytes")
+            return responder_columnar(entrada, formato)
+        elif formato != 'csv':
+            return jsonify({
+                'success': False,
+                'error': f'Formato no soportado: {formato}. Usa csv, parquet, feather o arrow.'
+            }), 400
         
-        response = make_response(csv_bytes)
+        # Generar el CSV con TODAS las columnas por bloques de filas: primero el BOM
+        # UTF-8 (para que Excel detecte la codificación) y luego cada bloque codificado,
+        # sin construir nunca el archivo completo en memoria
+        def generar_csv():
+            yield '\ufeff'.encode('utf-8')
+            for inicio in range(0, len(df_filtered), FILAS_POR_BLOQUE_CSV):
+                bloque = df_filtered.iloc[inicio:inicio + FILAS_POR_BLOQUE_CSV]
+                yield bloque.to_csv(index=False, header=(inicio == 0)).encode('utf-8')
+            print(f"✓ CSV generado: {len(df_filtered)} proyectos, {len(df_filtered.columns)} columnas")
+        
+        response = Response(stream_with_context(generar_csv()), mimetype='text/csv')
         response.headers['Content-Type'] = 'text/csv; charset=utf-8-sig'
         response.headers['Content-Disposition'] = f'attachment; filename=proyectos_filtrados_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-        
-        print(f"✓ CSV generado: {len(df_filtered)} proyectos, {len(df_filtered.columns)} columnas")
         return response
     except Exception as e:
         print(f"❌ Error en /api/descargar: {str(e)}")
@@ -1096,9 +2819,183 @@ def descargar_csv():
             'error': f'Error al generar CSV: {str(e)}'
         }), 500
 
+# ------------------------------
+# Regeneración en segundo plano
+# ------------------------------
+# Con varios workers (--preload --workers N) cada petición puede llegar a un proceso
+# distinto, así que el estado de los trabajos no vive en memoria: cada trabajo es un
+# archivo JSON en CACHE_DIR/trabajos (escritura atómica, como snapshot_publicado.json)
+# y la regla de "un trabajo a la vez" es un archivo de cerrojo creado con
+# O_CREAT | O_EXCL, que solo un proceso puede crear. Se conservan los trabajos
+# terminados más recientes para consultar su estado.
+_trabajos_lock = threading.Lock()
+MAX_TRABAJOS_REGENERACION = 20
+# Un trabajo sin actualizar su estado durante este tiempo se da por abandonado (el pid
+# de su cerrojo podría haberlo reutilizado otro proceso tras un reinicio)
+MAX_SEGUNDOS_SIN_PROGRESO = int(os.getenv('GALERIA_MAX_SEGUNDOS_SIN_PROGRESO', '3600'))
+ESTADOS_TERMINALES = ('completado', 'error')
+_PATRON_ID_TRABAJO = re.compile(r'[0-9a-f]{12}')
+
+def _directorio_trabajos():
+    """Directorio de los archivos de estado de los trabajos de regeneración."""
+    import generar_clasificacion as gen_clas
+    directorio = gen_clas.CACHE_DIR / 'trabajos'
+    gen_clas._crear_directorio_cache(directorio)
+    return directorio
+
+def _guardar_trabajo(trabajo):
+    """Escribe el estado del trabajo en su archivo JSON (reemplazo atómico)."""
+    import generar_clasificacion as gen_clas
+    with _trabajos_lock:
+        contenido = json.dumps(trabajo, ensure_ascii=False).encode('utf-8')
+    gen_clas._escribir_atomico(_directorio_trabajos() / f"{trabajo['id']}.json", contenido)
+
+def _segundos_sin_progreso(trabajo_id):
+    """Segundos desde la última escritura del estado del trabajo (None si no existe)."""
+    try:
+        return time.time() - (_directorio_trabajos() / f"{trabajo_id}.json").stat().st_mtime
+    except (OSError, TypeError):
+        return None
+
+def _leer_trabajo(trabajo_id):
+    """Lee el estado de un trabajo desde disco (None si no existe o el ID no es válido)."""
+    if not trabajo_id or not _PATRON_ID_TRABAJO.fullmatch(trabajo_id):
+        return None
+    try:
+        return json.loads((_directorio_trabajos() / f"{trabajo_id}.json").read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"⚠ No se pudo leer el estado del trabajo {trabajo_id}: {str(e)}")
+        return None
+
+def _proceso_vivo(pid):
+    """Indica si existe un proceso con ese pid en esta máquina."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _tomar_cerrojo_regeneracion(trabajo_id):
+    """Intenta reservar la regeneración para trabajo_id entre todos los procesos.
+    
+    Returns:
+        None si se obtuvo el cerrojo, o el ID del trabajo que lo tiene
+    """
+    ruta = _directorio_trabajos() / 'regeneracion.lock'
+    for _ in range(2):
+        try:
+            fd = os.open(ruta, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+        except FileExistsError:
+            try:
+                dueno = json.loads(ruta.read_text(encoding='utf-8'))
+            except Exception:
+                # Recién creado y aún sin contenido: lo tiene otro proceso
+                return ''
+            trabajo = _leer_trabajo(dueno.get('trabajo_id'))
+            terminado = trabajo is not None and trabajo['estado'] in ESTADOS_TERMINALES
+            inactivo = _segundos_sin_progreso(dueno.get('trabajo_id'))
+            if (not terminado and _proceso_vivo(dueno.get('pid', -1))
+                    and (inactivo is None or inactivo < MAX_SEGUNDOS_SIN_PROGRESO)):
+                return dueno.get('trabajo_id', '')
+            # Cerrojo abandonado (el proceso murió, el trabajo terminó o no avanza): liberarlo y reintentar
+            print(f"⚠ Se libera el cerrojo abandonado del trabajo {dueno.get('trabajo_id')}")
+            if trabajo is not None and not terminado:
+                trabajo.update(estado='error', error='El proceso que ejecutaba la regeneración terminó sin completarla',
+                               finalizado=datetime.now().isoformat(timespec='seconds'))
+                _guardar_trabajo(trabajo)
+            ruta.unlink(missing_ok=True)
+            continue
+        with os.fdopen(fd, 'w', encoding='utf-8') as archivo:
+            json.dump({'trabajo_id': trabajo_id, 'pid': os.getpid()}, archivo)
+        return None
+    return ''
+
+def _liberar_cerrojo_regeneracion(trabajo_id):
+    """Elimina el cerrojo si sigue perteneciendo a trabajo_id."""
+    ruta = _directorio_trabajos() / 'regeneracion.lock'
+    try:
+        if json.loads(ruta.read_text(encoding='utf-8')).get('trabajo_id') == trabajo_id:
+            ruta.unlink(missing_ok=True)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"⚠ No se pudo liberar el cerrojo de regeneración: {str(e)}")
+
+def _descartar_trabajos_antiguos():
+    """Borra los archivos de los trabajos terminados más antiguos (nunca uno en curso)."""
+    archivos = sorted(_directorio_trabajos().glob('*.json'), key=lambda p: p.stat().st_mtime)
+    sobrantes = len(archivos) - MAX_TRABAJOS_REGENERACION
+    for ruta in archivos:
+        if sobrantes <= 0:
+            break
+        trabajo = _leer_trabajo(ruta.stem)
+        if trabajo is not None and trabajo['estado'] in ESTADOS_TERMINALES:
+            ruta.unlink(missing_ok=True)
+            sobrantes -= 1
+
+def _ejecutar_regeneracion(trabajo, usar_cache):
+    """Ejecuta el pipeline en un hilo y publica el nuevo snapshot al terminar."""
+    trabajo_id = trabajo['id']
+    
+    def cerrar_paso_actual(ahora):
+        if trabajo['pasos']:
+            trabajo['pasos'][-1]['fin'] = ahora
+    
+    def progreso(paso, descripcion):
+        ahora = datetime.now().isoformat(timespec='seconds')
+        with _trabajos_lock:
+            cerrar_paso_actual(ahora)
+            trabajo['pasos'].append({'paso': paso, 'descripcion': descripcion, 'inicio': ahora, 'fin': None})
+            trabajo['paso_actual'] = paso
+            trabajo['descripcion'] = descripcion
+        _guardar_trabajo(trabajo)
+    
+    trabajo.update(estado='en_ejecucion', iniciado=datetime.now().isoformat(timespec='seconds'))
+    # El estado terminal se publica en el finally, junto con 'finalizado', para que un
+    # trabajo nunca quede como terminado (y por tanto descartable) sin fecha de fin
+    resultado = {'estado': 'error', 'error': 'La regeneración terminó inesperadamente'}
+    try:
+        _guardar_trabajo(trabajo)
+        salida = {}
+        df_nuevo = load_data(usar_cache=usar_cache, progreso=progreso, salida=salida)
+        with _trabajos_lock:
+            cerrar_paso_actual(datetime.now().isoformat(timespec='seconds'))
+        
+        if df_nuevo.empty:
+            resultado = {'estado': 'error', 'error': 'No se pudo generar la clasificación'}
+            return
+        
+        snap = publicar_snapshot(df_nuevo, salida.get('df_completo'), salida.get('caracteristicas_exitosos'))
+        difundir_snapshot(snap)
+        resultado = {'estado': 'completado', 'error': None, 'total_proyectos': len(df_nuevo),
+                     'dataset_version': snap['version']}
+        print(f"✓ Regeneración {trabajo_id} completada: snapshot v{snap['version']} con {len(df_nuevo)} proyectos")
+    except Exception as e:
+        print(f"❌ Error en la regeneración {trabajo_id}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        resultado = {'estado': 'error', 'error': str(e)}
+    finally:
+        with _trabajos_lock:
+            trabajo.update(finalizado=datetime.now().isoformat(timespec='seconds'), **resultado)
+        try:
+            _guardar_trabajo(trabajo)
+        finally:
+            _liberar_cerrojo_regeneracion(trabajo_id)
+
 @app.route('/api/regenerar-clasificacion', methods=['POST'])
 def regenerar_clasificacion():
-    """API para regenerar la clasificación de proyectos desde Base Proyectos.xlsx."""
+    """API para regenerar la clasificación de proyectos desde Base Proyectos.xlsx.
+    
+    La regeneración se ejecuta en segundo plano: la respuesta (202) incluye el ID del
+    trabajo, cuyo progreso se consulta en /api/regenerar-clasificacion/<trabajo_id>.
+    Mientras tanto se sigue sirviendo el snapshot actual; el nuevo se publica al terminar.
+    Con forzar=1 se ignora el resultado memorizado en disco.
+    """
     try:
         base_proyectos_path = Path('Base Proyectos.xlsx')
         if not base_proyectos_path.exists():
@@ -1107,28 +3004,73 @@ def regenerar_clasificacion():
                 'error': 'No se encontró el archivo Base Proyectos.xlsx'
             }), 400
         
-        # Regenerar la clasificación en memoria
-        global df_data, _filtros_cache
-        df_data = load_data()
-        _filtros_cache = None  # Invalidar cache de filtros
+        forzar = request.args.get('forzar', '').lower() in ('1', 'true', 'si', 'sí')
         
-        if df_data.empty:
+        # Solo un trabajo a la vez en todos los workers: si ya hay uno en curso, devolver ese
+        trabajo_id = uuid.uuid4().hex[:12]
+        en_curso_id = _tomar_cerrojo_regeneracion(trabajo_id)
+        if en_curso_id is not None:
+            en_curso = _leer_trabajo(en_curso_id)
             return jsonify({
-                'success': False,
-                'error': 'No se pudo generar la clasificación'
-            }), 500
+                'success': True,
+                'message': 'Ya hay una regeneración en curso',
+                'trabajo_id': en_curso_id or None,
+                'estado': en_curso['estado'] if en_curso is not None else 'pendiente'
+            }), 202
+        
+        trabajo = {
+            'id': trabajo_id,
+            'estado': 'pendiente',
+            'forzar': forzar,
+            'creado': datetime.now().isoformat(timespec='seconds'),
+            'iniciado': None,
+            'finalizado': None,
+            'paso_actual': None,
+            'descripcion': None,
+            'pasos': [],
+            'error': None
+        }
+        try:
+            _guardar_trabajo(trabajo)
+            _descartar_trabajos_antiguos()
+            hilo = threading.Thread(target=_ejecutar_regeneracion, args=(trabajo, not forzar),
+                                    name=f'regeneracion-{trabajo_id}', daemon=True)
+            hilo.start()
+        except Exception:
+            _liberar_cerrojo_regeneracion(trabajo_id)
+            raise
         
         return jsonify({
             'success': True,
-            'message': 'Clasificación regenerada exitosamente',
-            'total_proyectos': len(df_data)
-        })
+            'message': 'Regeneración iniciada',
+            'trabajo_id': trabajo_id,
+            'estado_url': f'/api/regenerar-clasificacion/{trabajo_id}'
+        }), 202
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+@app.route('/api/regenerar-clasificacion/<trabajo_id>')
+def estado_regeneracion(trabajo_id):
+    """API para consultar el estado y el progreso por paso de un trabajo de regeneración.
+    
+    El estado se lee del archivo del trabajo, así que responde cualquier worker.
+    """
+    trabajo = _leer_trabajo(trabajo_id)
+    if trabajo is None:
+        return jsonify({
+            'success': False,
+            'error': f'No existe el trabajo de regeneración {trabajo_id}'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'trabajo': trabajo,
+        'dataset_version': obtener_snapshot()['version']
+    })
+
 @app.route('/api/caracteristicas-exitosos')
 def get_caracteristicas_exitosos():
     """
@@ -1137,7 +3079,7 @@ def get_caracteristicas_exitosos():
     """
     """API para obtener las características comunes de proyectos exitosos."""
     try:
-        global caracteristicas_exitosos_global
+        caracteristicas_exitosos_global = obtener_snapshot()['caracteristicas_exitosos']
         
         if not caracteristicas_exitosos_global:
             return jsonify({
@@ -1167,7 +3109,7 @@ def get_correlaciones_exito():
     Retorna una matriz de correlaciones para visualización en mapa de calor.
     """
     try:
-        global df_completo_global
+        df_completo_global = obtener_snapshot()['df_completo']
         
         print(f"[DEBUG] df_completo_global es None: {df_completo_global is None}")
         if df_completo_global is not None:
@@ -1754,117 +3696,146 @@ def get_correlaciones_exito():
             'error': str(e)
         }), 500
 
-def calcular_ranking_constructores(df, estado_filtro='Activos'):
-    """Calcula el ranking de vendedores (columna "Vende") con estadísticas de proyectos.
+# Claves de orden admitidas por el ranking (el desempate es score_ranking, o exitosos si se ordena por él)
+ORDENES_RANKING = ('exitosos', 'score_ranking', 'score_promedio', 'porcentaje_exitosos', 'total_proyectos')
+TOP_RANKING_DEFECTO = 10
+
+def estadisticas_vendedores(df, estado_filtro='Activos'):
+    """Calcula las estadísticas de todos los vendedores (columna "Vende") en una sola agregación.
     
     Args:
         df: DataFrame con proyectos
         estado_filtro: 'Todos', 'Activos', 'Inactivos'
     
     Returns:
-        Lista de diccionarios con información de vendedores ordenados por score promedio
+        Lista de diccionarios por vendedor, en el orden de groupby (sin ordenar por ranking)
     """
-    try:
-        if df.empty:
-            return []
-        
-        # Buscar columna de vendedor (Vende)
-        col_vende = None
-        # Primero buscar 'Vende' exacto
-        if 'Vende' in df.columns:
-            col_vende = 'Vende'
-        else:
-            # Buscar cualquier columna que contenga 'vende'
-            for col in df.columns:
-                if col.lower() == 'vende' or 'vende' in col.lower():
-                    col_vende = col
-                    break
-        
-        if not col_vende:
-            print("⚠ No se encontró columna 'Vende' en el dataset")
-            print(f"  Columnas disponibles: {list(df.columns)[:30]}...")
-            return []
-        
-        print(f"  ✓ Usando columna '{col_vende}' para ranking de vendedores")
-        
-        # Filtrar por estado (activo/inactivo)
-        df_filtrado = df.copy()
+    # Buscar columna de vendedor (Vende)
+    col_vende = None
+    # Primero buscar 'Vende' exacto
+    if 'Vende' in df.columns:
+        col_vende = 'Vende'
+    else:
+        # Buscar cualquier columna que contenga 'vende'
+        for col in df.columns:
+            if col.lower() == 'vende' or 'vende' in col.lower():
+                col_vende = col
+                break
+    
+    if not col_vende:
+        print("⚠ No se encontró columna 'Vende' en el dataset")
+        print(f"  Columnas disponibles: {list(df.columns)[:30]}...")
+        return []
+    
+    print(f"  ✓ Usando columna '{col_vende}' para ranking de vendedores")
+    
+    # Filtrar por estado (activo/inactivo) con una máscara, sin copiar el DataFrame
+    mask = df[col_vende].notna().to_numpy()
+    if 'Unidades_Disponibles' in df.columns:
         if estado_filtro == 'Activos':
             # Proyectos activos: tienen unidades disponibles > 0
-            if 'Unidades_Disponibles' in df_filtrado.columns:
-                df_filtrado = df_filtrado[df_filtrado['Unidades_Disponibles'] > 0]
+            mask &= (df['Unidades_Disponibles'] > 0).to_numpy()
         elif estado_filtro == 'Inactivos':
             # Proyectos inactivos: unidades disponibles = 0 o no tienen disponibilidad
-            if 'Unidades_Disponibles' in df_filtrado.columns:
-                df_filtrado = df_filtrado[df_filtrado['Unidades_Disponibles'] == 0]
-        
-        # Agrupar por vendedor (Vende)
-        vendedores_stats = []
-        
-        # Filtrar valores nulos antes de agrupar
-        df_filtrado = df_filtrado[df_filtrado[col_vende].notna()]
-        df_filtrado = df_filtrado[df_filtrado[col_vende].astype(str).str.strip() != '']
-        df_filtrado = df_filtrado[~df_filtrado[col_vende].astype(str).str.lower().isin(['nan', 'none', 'n/a', ''])]
-        
-        if df_filtrado.empty:
-            print("  ⚠ No hay vendedores válidos después de filtrar")
+            mask &= (df['Unidades_Disponibles'] == 0).to_numpy()
+    
+    # Descartar vendedores vacíos o nulos escritos como texto (evaluado solo sobre los valores distintos)
+    codigos, valores = pd.factorize(df[col_vende])
+    textos = pd.Series(valores).astype(str)
+    validos = ((textos.str.strip() != '') & ~textos.str.lower().isin(['nan', 'none', 'n/a', ''])).to_numpy()
+    mask &= (codigos >= 0) & validos[codigos]
+    
+    if not mask.any():
+        print("  ⚠ No hay vendedores válidos después de filtrar")
+        return []
+    
+    print(f"  ✓ Proyectos con vendedor válido: {int(mask.sum())}")
+    
+    # Una sola agregación para todos los vendedores
+    if 'Clasificacion' in df.columns:
+        clasificacion = df['Clasificacion'].to_numpy(dtype=object)[mask]
+    else:
+        clasificacion = np.full(int(mask.sum()), None, dtype=object)
+    tabla = pd.DataFrame({
+        'vendedor': df[col_vende][mask],
+        'exitosos': clasificacion == 'Exitoso',
+        'moderados': clasificacion == 'Moderado',
+        'mejorables': clasificacion == 'Mejorable',
+        'score': df['Score_Exito'][mask].astype(float) if 'Score_Exito' in df.columns else 0.5
+    })
+    grupos = tabla.groupby('vendedor', observed=True)
+    stats = grupos.agg(
+        total_proyectos=('exitosos', 'size'),
+        exitosos=('exitosos', 'sum'),
+        moderados=('moderados', 'sum'),
+        mejorables=('mejorables', 'sum'),
+        n_score=('score', 'count')
+    )
+    
+    # Score promedio: suma de cada grupo con la misma suma por pares de numpy que Series.mean
+    # (la media de groupby usa suma compensada y puede cambiar el redondeo a 3 decimales)
+    orden = np.argsort(grupos.ngroup().to_numpy(), kind='stable')
+    scores = np.nan_to_num(tabla['score'].to_numpy(dtype=float)[orden], nan=0.0)
+    limites = np.cumsum(stats['total_proyectos'].to_numpy())[:-1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats['score_promedio'] = [segmento.sum() for segmento in np.split(scores, limites)] / stats['n_score']
+    
+    # Limpiar nombres: quitar ".0" de números leídos como float y marcar los códigos numéricos
+    nombres = stats.index.to_series().astype(str).str.strip()
+    flotante = nombres.str.endswith('.0') & nombres.str.replace('.0', '', regex=False).str.replace('-', '', regex=False).str.isdigit()
+    nombres = nombres.where(~flotante, nombres.str.rstrip('.0'))
+    codigo = nombres.str.replace('-', '', regex=False).str.isdigit()
+    nombres = nombres.where(~codigo, 'Vendedor #' + nombres)
+    
+    # Score compuesto para ranking (ponderado: 60% score promedio, 40% % exitosos)
+    porcentaje_exitosos = stats['exitosos'] / stats['total_proyectos'] * 100
+    score_ranking = (stats['score_promedio'] * 0.6) + (porcentaje_exitosos / 100 * 0.4)
+    
+    return [
+        {
+            'vendedor': nombre,
+            'total_proyectos': total,
+            'exitosos': exitosos,
+            'moderados': moderados,
+            'mejorables': mejorables,
+            'score_promedio': round(score, 3),
+            'porcentaje_exitosos': round(porcentaje, 1),
+            'score_ranking': round(ranking, 3)
+        }
+        for nombre, total, exitosos, moderados, mejorables, score, porcentaje, ranking in zip(
+            nombres.tolist(), stats['total_proyectos'].tolist(), stats['exitosos'].tolist(),
+            stats['moderados'].tolist(), stats['mejorables'].tolist(), stats['score_promedio'].tolist(),
+            porcentaje_exitosos.tolist(), score_ranking.tolist())
+    ]
+
+def ordenar_ranking(vendedores, orden='exitosos', top_n=TOP_RANKING_DEFECTO):
+    """Ordena las estadísticas de vendedores de mayor a menor y toma los primeros top_n (0 = todos)."""
+    desempate = 'exitosos' if orden == 'score_ranking' else 'score_ranking'
+    ordenados = sorted(vendedores, key=lambda x: (x[orden], x[desempate]), reverse=True)
+    return ordenados[:top_n] if top_n else ordenados
+
+def calcular_ranking_constructores(df, estado_filtro='Activos', top_n=TOP_RANKING_DEFECTO, orden='exitosos'):
+    """Calcula el ranking de vendedores (columna "Vende") con estadísticas de proyectos.
+    
+    Args:
+        df: DataFrame con proyectos
+        estado_filtro: 'Todos', 'Activos', 'Inactivos'
+        top_n: Cantidad de vendedores a retornar (0 = todos)
+        orden: Clave de orden (ver ORDENES_RANKING); por defecto proyectos exitosos
+    
+    Returns:
+        Lista de diccionarios con información de vendedores ordenados de mayor a menor
+    """
+    try:
+        if df.empty:
             return []
         
-        print(f"  ✓ Proyectos con vendedor válido: {len(df_filtrado)}")
-        
-        for vendedor, grupo in df_filtrado.groupby(col_vende):
-            if pd.isna(vendedor) or str(vendedor).strip() == '' or str(vendedor).lower() == 'nan':
-                continue
-            
-            # Limpiar nombre del vendedor
-            vendedor_nombre = str(vendedor).strip()
-            
-            # Eliminar ".0" si es un número flotante convertido a string
-            if vendedor_nombre.endswith('.0') and vendedor_nombre.replace('.0', '').replace('-', '').isdigit():
-                vendedor_nombre = vendedor_nombre.rstrip('.0')
-            
-            # Si es un número puro (sin decimales), es probable que sea un código
-            if vendedor_nombre.replace('-', '').isdigit():
-                # Si aún es un número después de buscar, formatearlo como "Vendedor #XXXX"
-                vendedor_nombre = f"Vendedor #{vendedor_nombre}"
-            
-            total_proyectos = len(grupo)
-            
-            # Contar por clasificación
-            exitosos = len(grupo[grupo['Clasificacion'] == 'Exitoso'])
-            moderados = len(grupo[grupo['Clasificacion'] == 'Moderado'])
-            mejorables = len(grupo[grupo['Clasificacion'] == 'Mejorable'])
-            
-            # Calcular score promedio
-            score_promedio = float(grupo['Score_Exito'].mean()) if 'Score_Exito' in grupo.columns else 0.5
-            
-            # Calcular porcentaje de exitosos
-            porcentaje_exitosos = (exitosos / total_proyectos * 100) if total_proyectos > 0 else 0
-            
-            # Calcular score compuesto para ranking (ponderado: 60% score promedio, 40% % exitosos)
-            score_ranking = (score_promedio * 0.6) + (porcentaje_exitosos / 100 * 0.4)
-            
-            vendedores_stats.append({
-                'vendedor': vendedor_nombre,
-                'total_proyectos': total_proyectos,
-                'exitosos': exitosos,
-                'moderados': moderados,
-                'mejorables': mejorables,
-                'score_promedio': round(score_promedio, 3),
-                'porcentaje_exitosos': round(porcentaje_exitosos, 1),
-                'score_ranking': round(score_ranking, 3)
-            })
-        
-        # Ordenar por cantidad de proyectos exitosos (descendente) y tomar top 10
-        # Si hay empate, usar score_ranking como desempate
-        vendedores_stats.sort(key=lambda x: (x['exitosos'], x['score_ranking']), reverse=True)
+        ranking = ordenar_ranking(estadisticas_vendedores(df, estado_filtro), orden, top_n)
+        print(f"  ✓ Ranking generado: {len(ranking)} vendedores")
+        if len(ranking) > 0:
+            print(f"    - Mejor vendedor: {ranking[0]['vendedor']} ({ranking[0]['exitosos']} proyectos exitosos)")
         
-        top_10 = vendedores_stats[:10]
-        print(f"  ✓ Ranking generado: {len(top_10)} vendedores en top 10")
-        if len(top_10) > 0:
-            print(f"    - Mejor vendedor: {top_10[0]['vendedor']} ({top_10[0]['exitosos']} proyectos exitosos)")
-        
-        return top_10
+        return ranking
         
     except Exception as e:
         print(f"⚠ Error al calcular ranking de vendedores: {str(e)}")
@@ -1874,8 +3845,15 @@ def calcular_ranking_constructores(df, estado_filtro='Activos'):
 
 @app.route('/api/ranking-constructores')
 def get_ranking_constructores():
-    """API para obtener el ranking de vendedores (columna Vende)."""
+    """API para obtener el ranking de vendedores (columna Vende).
+    
+    Parámetros: estado (Activos por defecto), orden (ver ORDENES_RANKING) y top
+    (cantidad de vendedores, 0 = todos). Las estadísticas de todos los vendedores se
+    calculan una vez por estado y versión del dataset; orden y top se aplican sobre ellas.
+    """
     try:
+        snap = obtener_snapshot()
+        df_data = snap['df_data']
         if df_data.empty:
             return jsonify({
                 'success': False,
@@ -1883,17 +3861,28 @@ def get_ranking_constructores():
                 'ranking': []
             }), 200
         
-        # Obtener filtro de estado
+        # Obtener filtro de estado, clave de orden y tamaño del ranking
         estado_filtro = request.args.get('estado', 'Activos')
+        orden = request.args.get('orden', 'exitosos') or 'exitosos'
+        if orden not in ORDENES_RANKING:
+            return jsonify({
+                'success': False,
+                'error': f"Parámetro 'orden' inválido: use uno de {', '.join(ORDENES_RANKING)}",
+                'ranking': []
+            }), 400
+        top_n = _entero_no_negativo(request.args.get('top'), TOP_RANKING_DEFECTO)
         
-        # Calcular ranking (ahora usa columna Vende)
-        ranking = calcular_ranking_constructores(df_data, estado_filtro)
+        def construir():
+            # Todos los vendedores ordenados por el criterio por defecto (memorizado por estado)
+            vendedores = obtener_cacheado(snap, ('ranking', estado_filtro),
+                                          lambda: calcular_ranking_constructores(df_data, estado_filtro, top_n=0))
+            return {
+                'success': True,
+                'ranking': ordenar_ranking(vendedores, orden, top_n),
+                'estado_filtro': estado_filtro
+            }
         
-        return jsonify({
-            'success': True,
-            'ranking': ranking,
-            'estado_filtro': estado_filtro
-        })
+        return responder_json_cacheado(snap, 'ranking', (estado_filtro, orden, top_n), construir)
     except Exception as e:
         print(f"❌ Error en /api/ranking-constructores: {str(e)}")
         import traceback
@@ -1907,6 +3896,7 @@ def get_ranking_constructores():
 def guardar_clasificacion():
     """API para guardar la clasificación actual en un archivo Excel (opcional)."""
     try:
+        df_data = obtener_snapshot()['df_data']
         filename = request.json.get('filename', 'proyectos_clasificados.xlsx') if request.json else 'proyectos_clasificados.xlsx'
         
         if guardar_clasificacion_excel(df_data, filename):
@@ -1983,7 +3973,7 @@ def generar_contexto_proyectos(df):
     
     # 2. Información por zona
     if 'Zona' in df.columns:
-        zonas = df['Zona'].value_counts()
+        zonas = contar_valores(df['Zona'])
         context_parts.append(f"\nPROYECTOS POR ZONA (Todas las zonas):")
         for zona, count in zonas.items():
             if pd.notna(zona) and str(zona).strip() not in ('', 'N/A'):
@@ -2038,7 +4028,7 @@ def generar_contexto_proyectos(df):
         df_vende = df_vende[~df_vende[col_vende].astype(str).str.lower().isin(['nan', 'none', 'n/a', ''])]
         
         if not df_vende.empty:
-            vendedores = df_vende[col_vende].value_counts()
+            vendedores = contar_valores(df_vende[col_vende])
             context_parts.append(f"\nPROYECTOS POR VENDEDOR/CONSTRUCTORA (columna '{col_vende}'):")
             context_parts.append(f"Total de vendedores/constructoras únicos: {len(vendedores)}")
             
@@ -2070,7 +4060,7 @@ def generar_contexto_proyectos(df):
         df_constructor = df_constructor[~df_constructor[col_constructor].astype(str).str.lower().isin(['nan', 'none', 'n/a', ''])]
         
         if not df_constructor.empty:
-            constructores = df_constructor[col_constructor].value_counts()
+            constructores = contar_valores(df_constructor[col_constructor])
             context_parts.append(f"\nPROYECTOS POR CONSTRUCTOR (columna '{col_constructor}'):")
             context_parts.append(f"Total de constructores únicos: {len(constructores)}")
             
@@ -2140,6 +4130,7 @@ def chat_gemini():
     Incluye el contexto completo de los proyectos en el dataset.
     """
     try:
+        df_data = obtener_snapshot()['df_data']
         import google.generativeai as genai
         from dotenv import load_dotenv
         
@@ -2429,6 +4420,21 @@ IMPORTANTE: Tienes acceso a TODOS los proyectos y TODAS las columnas. Usa esta i
             'response': error_message  # Para que el widget lo muestre
         }), 500
 
+def registros_como_texto(df):
+    """Convierte un DataFrame a registros con cada valor no nulo como texto (nulos -> None).
+    
+    Es el formato que /api/buscar-proyectos siempre ha devuelto (números y fechas como
+    str() de su valor), ahora columna por columna en lugar de fila por fila.
+    """
+    columnas = list(df.columns)
+    valores = []
+    for col in columnas:
+        serie = df[col]
+        nulos = serie.isna().to_numpy()
+        valores.append([None if nulo else str(valor)
+                        for valor, nulo in zip(serie.to_numpy(dtype=object), nulos)])
+    return [dict(zip(columnas, fila)) for fila in zip(*valores)]
+
 @app.route('/api/buscar-proyectos', methods=['POST'])
 def buscar_proyectos():
     """
@@ -2436,6 +4442,7 @@ def buscar_proyectos():
     Permite al asistente hacer consultas específicas sobre los datos.
     """
     try:
+        df_data = obtener_snapshot()['df_data']
         data = request.get_json()
         if not data:
             return jsonify({
@@ -2536,26 +4543,8 @@ def buscar_proyectos():
             limite = min(limite, 500)  # Máximo 500 resultados
             df_resultado = df_resultado.head(limite)
         
-        # Convertir a formato JSON
-        proyectos = []
-        for idx, row in df_resultado.iterrows():
-            proyecto_dict = {}
-            # Incluir todas las columnas
-            for col in df_resultado.columns:
-                valor = row.get(col)
-                # Convertir tipos problemáticos para JSON
-                if pd.isna(valor):
-                    proyecto_dict[col] = None
-                elif isinstance(valor, (np.integer, np.floating)):
-                    if isinstance(valor, np.integer):
-                        proyecto_dict[col] = int(valor)
-                    else:
-                        proyecto_dict[col] = None if np.isnan(valor) else float(valor)
-                elif isinstance(valor, pd.Timestamp):
-                    proyecto_dict[col] = str(valor)
-                else:
-                    proyecto_dict[col] = str(valor) if valor is not None else None
-            proyectos.append(proyecto_dict)
+        # Convertir a registros con los valores como texto (formato histórico de este endpoint)
+        proyectos = registros_como_texto(df_resultado)
         
         return jsonify({
             'success': True,
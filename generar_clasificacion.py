@@ -7,6 +7,13 @@ import utils
 import pandas as pd
 import numpy as np
 from pathlib import Path
+import hashlib
+import io
+import json
+import os
+import pickle
+import stat
+import tempfile
 
 # Verificar si scikit-learn está disponible
 try:
@@ -17,6 +24,20 @@ except ImportError:
     SKLEARN_AVAILABLE = False
     print("⚠ Advertencia: scikit-learn no está disponible. El modelo RandomForest no se usará.")
 
+# Verificar si scipy está disponible (matriz dispersa proyecto × amenidad)
+try:
+    from scipy import sparse
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+# Verificar si pyarrow está disponible (caché en formato Feather)
+try:
+    import pyarrow  # noqa: F401
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
 # ============================================================================
 # FUNCIONES AUXILIARES
 # ============================================================================
@@ -35,22 +56,422 @@ def to_num(x):
             return np.nan
     return np.nan
 
+# Números decimales que float() acepta sin ambigüedad, y textos que float() podría aceptar
+# ('inf', 'nan', '1_000', dígitos no ASCII): solo estos últimos se convierten uno a uno
+# con to_num, el resto de textos es NaN
+_PATRON_DECIMAL = r'[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?'
+_PATRON_CANDIDATO_FLOAT = r'(?i)[+-]?(?:inf|infinity|nan|[\d_]*\.?[\d_]*(?:e[+-]?[\d_]+)?)'
+
+def _textos_a_num(textos):
+    """Aplica to_num a una serie de textos con operaciones de texto vectorizadas.
+    
+    Returns:
+        np.ndarray de float64 alineado con textos
+    """
+    limpios = (textos.str.replace(',', '', regex=False)
+                     .str.replace('$', '', regex=False)
+                     .str.replace(' ', '', regex=False)
+                     .str.strip())
+    resultado = np.full(len(limpios), np.nan)
+    
+    es_decimal = limpios.str.fullmatch(_PATRON_DECIMAL).to_numpy(dtype=bool)
+    if es_decimal.any():
+        resultado[es_decimal] = limpios[es_decimal].astype(float).to_numpy()
+    
+    resto = ~es_decimal
+    if resto.any():
+        resto[resto] = limpios[resto].str.fullmatch(_PATRON_CANDIDATO_FLOAT).to_numpy(dtype=bool)
+        if resto.any():
+            resultado[resto] = limpios[resto].map(to_num).to_numpy(dtype=float)
+    return resultado
+
+def to_num_serie(serie):
+    """Versión vectorizada de to_num para una columna completa.
+    
+    Devuelve exactamente lo mismo que serie.apply(to_num), pero sin llamar a una
+    función de Python por celda: los números se convierten con astype(float) y los
+    textos distintos se limpian y convierten una sola vez con operaciones de texto
+    vectorizadas. Solo los valores poco comunes (otros tipos, textos como 'inf' o
+    '1_000') pasan por to_num uno a uno.
+    
+    Returns:
+        pd.Series de float64 con el mismo índice y nombre que serie
+    """
+    if pd.api.types.is_numeric_dtype(serie.dtype):
+        # int, float y bool: to_num devuelve float(x) para cada valor
+        return serie.astype(float)
+    
+    valores = pd.Series(serie.to_numpy(dtype=object))
+    resultado = np.full(len(valores), np.nan)
+    
+    tipos = valores.map(type)
+    nulos = valores.isna().to_numpy()
+    es_numero = tipos.isin([int, float, bool]).to_numpy() & ~nulos
+    es_texto = (tipos == str).to_numpy()
+    otros = ~(nulos | es_numero | es_texto)
+    
+    if es_numero.any():
+        resultado[es_numero] = valores[es_numero].astype(float).to_numpy()
+    
+    if es_texto.any():
+        # Las columnas del Excel repiten mucho los mismos textos: convertir solo los distintos
+        codigos, unicos = pd.factorize(valores[es_texto].to_numpy())
+        resultado[es_texto] = _textos_a_num(pd.Series(unicos, dtype=object))[codigos]
+    
+    if otros.any():
+        resultado[otros] = valores[otros].map(to_num).to_numpy(dtype=float)
+    
+    return pd.Series(resultado, index=serie.index, name=serie.name)
+
 def winsorize(s, p_low=0.01, p_high=0.99):
     """Aplica winsorización a una serie para limitar valores extremos."""
     lo = s.quantile(p_low)
     hi = s.quantile(p_high)
     return s.clip(lower=lo, upper=hi)
 
+# ============================================================================
+# CACHÉ EN DISCO DEL EXCEL PARSEADO
+# ============================================================================
+
+# Directorio de caché (configurable con la variable de entorno GALERIA_CACHE_DIR)
+CACHE_DIR = Path(os.getenv('GALERIA_CACHE_DIR', str(Path(__file__).parent.absolute() / '.cache')))
+
+HOJAS_EXCEL = ('Inmuebles', 'Proyectos')
+
+def _crear_directorio_cache(directorio):
+    """Crea un directorio de la caché (y sus padres dentro de CACHE_DIR) solo accesible por el usuario.
+
+    La caché guarda archivos pickle que se vuelven a cargar; nadie más debe poder escribir en ella.
+    """
+    directorio = Path(directorio)
+    if directorio.exists():
+        return
+    if directorio != CACHE_DIR and CACHE_DIR in directorio.parents:
+        _crear_directorio_cache(directorio.parent)
+    directorio.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+def _escribir_atomico(destino, contenido):
+    """Escribe bytes en un archivo de forma atómica (archivo temporal + os.replace).
+
+    Evita que otro proceso (p. ej. otro worker de gunicorn) lea un archivo a medio escribir.
+    El temporal tiene un nombre único, así que varios hilos del mismo proceso (regeneración
+    en segundo plano, teselas) pueden escribir el mismo destino sin pisarse.
+    """
+    destino = Path(destino)
+    _crear_directorio_cache(destino.parent)
+    with tempfile.NamedTemporaryFile(dir=destino.parent, prefix=f"{destino.name}.", suffix='.tmp',
+                                     delete=False) as f:
+        temporal = Path(f.name)
+        try:
+            f.write(contenido)
+        except BaseException:
+            f.close()
+            temporal.unlink(missing_ok=True)
+            raise
+    try:
+        os.replace(temporal, destino)
+    except BaseException:
+        temporal.unlink(missing_ok=True)
+        raise
+
+def _pickle_confiable(path):
+    """Indica si un pickle de la caché se puede cargar sin riesgo.
+
+    En POSIX el archivo y CACHE_DIR deben pertenecer al usuario actual y no admitir
+    escritura de grupo ni de otros usuarios; si no, se ignora (se recalcula).
+    """
+    if os.name != 'posix':
+        return True
+    try:
+        for ruta in (CACHE_DIR, Path(path)):
+            info = ruta.stat()
+            if info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                print(f"⚠ Se ignora {path}: {ruta} no es exclusivo del usuario actual")
+                return False
+    except OSError:
+        return False
+    return True
+
+def huella_archivo(path):
+    """Calcula la huella de un archivo: tamaño, mtime y hash SHA-256 del contenido.
+
+    El hash solo se recalcula cuando el tamaño o el mtime difieren de la última
+    huella registrada para esa ruta en CACHE_DIR/huellas.json.
+
+    Returns:
+        dict: {'ruta', 'tamano', 'mtime_ns', 'sha256'}
+    """
+    path = Path(path).absolute()
+    stat = path.stat()
+    huella = {'ruta': str(path), 'tamano': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    registro = CACHE_DIR / 'huellas.json'
+    try:
+        registros = json.loads(registro.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        registros = {}
+
+    previa = registros.get(str(path))
+    if previa and previa.get('tamano') == huella['tamano'] and previa.get('mtime_ns') == huella['mtime_ns']:
+        huella['sha256'] = previa['sha256']
+        return huella
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            sha.update(bloque)
+    huella['sha256'] = sha.hexdigest()
+
+    registros[str(path)] = huella
+    try:
+        _escribir_atomico(registro, json.dumps(registros, indent=2).encode('utf-8'))
+    except OSError as e:
+        print(f"⚠ No se pudo registrar la huella del archivo: {str(e)}")
+
+    return huella
+
+def _directorio_cache_excel(huella):
+    """Directorio de caché de las hojas para una huella dada (clave: hash + tamaño)."""
+    return CACHE_DIR / f"excel_{huella['sha256'][:16]}_{huella['tamano']}"
+
+def _serializar_hoja(df):
+    """Serializa una hoja a Feather si pyarrow está disponible y la conversión es exacta.
+
+    Las columnas con tipos mezclados (p. ej. números y texto en 'Número de garajes')
+    no se pueden representar en Arrow sin perder información; en ese caso se usa pickle,
+    que conserva los bloques de pandas tal cual.
+
+    Returns:
+        tuple: (formato, bytes)
+    """
+    if PYARROW_AVAILABLE:
+        try:
+            buffer = io.BytesIO()
+            df.to_feather(buffer)
+            buffer.seek(0)
+            if pd.read_feather(buffer).equals(df):
+                return 'feather', buffer.getvalue()
+        except Exception:
+            pass
+    buffer = io.BytesIO()
+    df.to_pickle(buffer)
+    return 'pickle', buffer.getvalue()
+
+def guardar_cache_excel(huella, hojas):
+    """Guarda las hojas parseadas del Excel en el directorio de caché.
+
+    Args:
+        huella: Huella del archivo (ver huella_archivo)
+        hojas: dict {nombre_hoja: DataFrame}
+    """
+    try:
+        directorio = _directorio_cache_excel(huella)
+        formatos = {}
+        for nombre, df in hojas.items():
+            formato, contenido = _serializar_hoja(df)
+            extension = '.feather' if formato == 'feather' else '.pkl'
+            _escribir_atomico(directorio / f"{nombre}{extension}", contenido)
+            formatos[nombre] = formato
+
+        # El archivo meta se escribe al final: sin él, la caché se considera incompleta
+        meta = {
+            'sha256': huella['sha256'],
+            'tamano': huella['tamano'],
+            'mtime_ns': huella['mtime_ns'],
+            'pandas': pd.__version__,
+            'formatos': formatos
+        }
+        _escribir_atomico(directorio / 'meta.json', json.dumps(meta, indent=2).encode('utf-8'))
+        print(f"[OK] Caché del Excel guardada en {directorio} ({', '.join(f'{k}: {v}' for k, v in formatos.items())})")
+    except Exception as e:
+        print(f"⚠ No se pudo guardar la caché del Excel: {str(e)}")
+
+def leer_cache_excel(huella):
+    """Lee las hojas del Excel desde la caché.
+
+    Returns:
+        dict {nombre_hoja: DataFrame}, o None si no hay caché válida para la huella
+    """
+    directorio = _directorio_cache_excel(huella)
+    try:
+        meta = json.loads((directorio / 'meta.json').read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+    if meta.get('sha256') != huella['sha256'] or meta.get('pandas') != pd.__version__:
+        return None
+
+    hojas = {}
+    try:
+        for nombre in HOJAS_EXCEL:
+            formato = meta.get('formatos', {}).get(nombre)
+            if formato == 'feather' and PYARROW_AVAILABLE:
+                hojas[nombre] = pd.read_feather(directorio / f"{nombre}.feather")
+            elif formato == 'pickle' and _pickle_confiable(directorio / f"{nombre}.pkl"):
+                hojas[nombre] = pd.read_pickle(directorio / f"{nombre}.pkl")
+            else:
+                return None
+    except Exception as e:
+        print(f"⚠ Caché del Excel ilegible, se volverá a leer el archivo: {str(e)}")
+        return None
+
+    return hojas
+
+# Versión del pipeline de clasificación. Incrementarla cada vez que cambie la lógica
+# de cualquier paso (features, score, clasificación, formato final) para invalidar
+# los resultados memorizados y el estado incremental guardados en disco.
+# v2: agregación incremental sin fecha y pasos de clasificación vectorizados.
+PIPELINE_VERSION = 2
+
+def clave_resultado_pipeline(huella, fecha_referencia=None):
+    """Clave de memorización del resultado completo del pipeline.
+
+    Combina la huella del Excel, la versión del pipeline y la fecha de referencia:
+    'meses_desde_inicio' (y con ella la velocidad de ventas) depende del día actual,
+    por lo que un resultado solo es reutilizable durante el mismo día.
+    """
+    if fecha_referencia is None:
+        fecha_referencia = pd.Timestamp.today().normalize()
+    return f"{huella['sha256'][:16]}_{huella['tamano']}_v{PIPELINE_VERSION}_{pd.Timestamp(fecha_referencia):%Y%m%d}"
+
+def guardar_resultado_pipeline(huella, resultado, df_completo, caracteristicas_exitosos, clave=None):
+    """Guarda en disco el resultado completo del pipeline para la huella dada.
+
+    Se conserva solo el resultado más reciente de cada archivo de entrada. Conviene pasar
+    la misma clave usada en leer_resultado_pipeline (por defecto se calcula con la fecha actual).
+    """
+    try:
+        if clave is None:
+            clave = clave_resultado_pipeline(huella)
+        contenido = pickle.dumps({
+            'clave': clave,
+            'pandas': pd.__version__,
+            'resultado': resultado,
+            'df_completo': df_completo,
+            'caracteristicas_exitosos': caracteristicas_exitosos
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+        destino = CACHE_DIR / f"resultado_{clave}.pkl"
+        _escribir_atomico(destino, contenido)
+
+        # Eliminar resultados anteriores del mismo archivo (otra versión o fecha)
+        prefijo = f"resultado_{huella['sha256'][:16]}_{huella['tamano']}_"
+        for anterior in CACHE_DIR.glob(f"{prefijo}*.pkl"):
+            if anterior != destino:
+                anterior.unlink(missing_ok=True)
+
+        print(f"[OK] Resultado del pipeline memorizado en {destino.name}")
+    except Exception as e:
+        print(f"⚠ No se pudo memorizar el resultado del pipeline: {str(e)}")
+
+def leer_resultado_pipeline(huella, clave=None):
+    """Lee el resultado memorizado del pipeline para la huella dada.
+
+    Args:
+        clave: Clave de clave_resultado_pipeline; por defecto la de la fecha actual
+
+    Returns:
+        tuple (resultado, df_completo, caracteristicas_exitosos), o None si no hay
+        un resultado válido para la huella, la versión del pipeline y la fecha actual
+    """
+    if clave is None:
+        clave = clave_resultado_pipeline(huella)
+    origen = CACHE_DIR / f"resultado_{clave}.pkl"
+    if not origen.exists() or not _pickle_confiable(origen):
+        return None
+    try:
+        datos = pd.read_pickle(origen)
+    except Exception as e:
+        print(f"⚠ Resultado memorizado ilegible, se recalculará: {str(e)}")
+        return None
+
+    if datos.get('clave') != clave or datos.get('pandas') != pd.__version__:
+        return None
+    return datos['resultado'], datos['df_completo'], datos['caracteristicas_exitosos']
+
+# ============================================================================
+# RECÁLCULO INCREMENTAL (SOLO PROYECTOS Y SEGMENTOS QUE CAMBIARON)
+# ============================================================================
+
+def hash_filas(df):
+    """Hash uint64 por fila del contenido de un DataFrame (sin el índice).
+
+    Los valores se convierten a texto antes de calcular el hash: las hojas del Excel
+    tienen columnas con tipos mezclados que hash_pandas_object no acepta directamente.
+    """
+    return pd.util.hash_pandas_object(df.astype(str), index=False)
+
+def _firma_hashes(columnas, hashes):
+    """Firma SHA-1 de un conjunto de filas a partir de sus columnas y hashes por fila."""
+    sha = hashlib.sha1('\x1f'.join(map(str, columnas)).encode('utf-8'))
+    sha.update(np.asarray(hashes, dtype=np.uint64).tobytes())
+    return sha.hexdigest()
+
+def huellas_por_proyecto(inm_join, key_inm):
+    """Huella de las filas de cada proyecto en inm_join (Inmuebles + columnas de Proyectos).
+
+    Returns:
+        pd.Series: código de proyecto -> firma SHA-1 de sus filas (en el orden del archivo)
+    """
+    filas = hash_filas(inm_join)
+    return filas.groupby(inm_join[key_inm], dropna=False, sort=False).agg(
+        lambda h: _firma_hashes(inm_join.columns, h.values)
+    )
+
+def firma_estado_incremental():
+    """Condiciones bajo las que el estado incremental guardado sigue siendo reutilizable.
+
+    No incluye la fecha: el estado solo guarda agregados que no dependen del día y
+    resultados de segmentos validados con el hash de sus columnas (incluida
+    'meses_desde_inicio'), así que se reutiliza entre días distintos.
+    """
+    return {
+        'pipeline': PIPELINE_VERSION,
+        'pandas': pd.__version__
+    }
+
+def leer_estado_incremental():
+    """Lee el estado de la última ejecución completa del pipeline.
+
+    Returns:
+        dict con 'agregado' (huellas y agregados por proyecto) y 'segmentos'
+        (resultados de clasificación por segmento), o un dict vacío si no hay
+        estado reutilizable
+    """
+    origen = CACHE_DIR / 'estado_incremental.pkl'
+    if not origen.exists() or not _pickle_confiable(origen):
+        return {}
+    try:
+        estado = pd.read_pickle(origen)
+    except Exception as e:
+        print(f"⚠ Estado incremental ilegible, se recalculará todo: {str(e)}")
+        return {}
+    if estado.get('firma') != firma_estado_incremental():
+        return {}
+    return estado
+
+def guardar_estado_incremental(estado):
+    """Guarda el estado incremental para la siguiente ejecución del pipeline."""
+    try:
+        estado = dict(estado, firma=firma_estado_incremental())
+        _escribir_atomico(CACHE_DIR / 'estado_incremental.pkl',
+                          pickle.dumps(estado, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception as e:
+        print(f"⚠ No se pudo guardar el estado incremental: {str(e)}")
+
 # ============================================================================
 # CARGAR Y PREPARAR DATOS
 # ============================================================================
 
-def cargar_datos(xlsx_path=None):
+def cargar_datos(xlsx_path=None, usar_cache=True):
     """Carga las hojas Inmuebles y Proyectos del Excel.
-    
+
+    Si existe una caché en disco para el mismo archivo (misma huella de tamaño,
+    mtime y contenido), las hojas se leen desde ahí sin pasar por openpyxl.
+
     Args:
         xlsx_path: Ruta al archivo Excel. Si es None, busca en el directorio del script.
-    
+        usar_cache: Si True, usa y actualiza la caché en disco de las hojas parseadas.
+
     Returns:
         tuple: (inm, pry) DataFrames de Inmuebles y Proyectos
     """
@@ -93,16 +514,33 @@ def cargar_datos(xlsx_path=None):
         raise FileNotFoundError(error_msg)
     
     print(f"[OK] Cargando archivo: {xlsx_path}")
-    
+
+    # Intentar cargar las hojas desde la caché en disco
+    huella = None
+    if usar_cache:
+        try:
+            huella = huella_archivo(xlsx_path)
+            hojas = leer_cache_excel(huella)
+            if hojas is not None:
+                inm, pry = hojas['Inmuebles'], hojas['Proyectos']
+                print(f"[OK] Cargados {len(inm)} inmuebles y {len(pry)} proyectos (desde caché)")
+                return inm, pry
+        except Exception as e:
+            print(f"⚠ No se pudo consultar la caché del Excel: {str(e)}")
+            huella = None
+
     xls = pd.ExcelFile(xlsx_path)
-    
+
     # Intentar cargar las hojas
     try:
         inm = pd.read_excel(xls, 'Inmuebles')
         pry = pd.read_excel(xls, 'Proyectos')
-        
+
         print(f"[OK] Cargados {len(inm)} inmuebles y {len(pry)} proyectos")
-        
+
+        if huella is not None:
+            guardar_cache_excel(huella, {'Inmuebles': inm, 'Proyectos': pry})
+
         return inm, pry
     except Exception as e:
         print(f"[ERROR] Error al cargar hojas del Excel: {str(e)}")
@@ -267,12 +705,36 @@ def agregar_datos_por_proyecto(inm_join, cols_inm, cols_proy, key_inm, key_pry):
     print("  Agregando datos por proyecto...")
     print(f"  Dataset de entrada: {len(inm_join)} inmuebles")
     
+    proj_ds = _agregar_columnas_proyecto(inm_join, cols_inm, key_inm)
+    
+    # Calcular velocidad desde las columnas de Proyectos que ya están en proj_ds
+    # (proj_ds ya tiene todas las columnas de Proyectos)
+    proj_ds = calcular_velocidad(proj_ds, cols_proy)
+    
+    print(f"  ✓ Datos agregados: {len(proj_ds)} proyectos")
+    print(f"  ✓ Columnas en resultado: {len(proj_ds.columns)}")
+    
+    # Verificar que key_pry esté presente (puede estar como key_inm o con otro nombre)
+    if key_pry not in proj_ds.columns and key_inm in proj_ds.columns:
+        # Si key_pry no está pero key_inm sí, usar key_inm
+        pass
+    elif key_pry not in proj_ds.columns:
+        print(f"  ⚠ Advertencia: key_pry '{key_pry}' no está en proj_ds, usando key_inm '{key_inm}'")
+    
+    return proj_ds
+
+def _agregar_columnas_proyecto(inm_join, cols_inm, key_inm):
+    """Parte de agregar_datos_por_proyecto que no depende de la fecha actual.
+    
+    Devuelve una fila por proyecto con las columnas de Proyectos y los agregados de
+    inmuebles, sin las métricas de velocidad (calcular_velocidad), que dependen del día.
+    """
     # Convertir a numéricos las columnas de inmuebles
     for c in [cols_inm.get('precio'), cols_inm.get('area'), cols_inm.get('alcobas'), 
               cols_inm.get('banos'), cols_inm.get('garajes')]:
         if c and c in inm_join.columns:
             if c + "_num" not in inm_join.columns:
-                inm_join[c + "_num"] = pd.to_numeric(inm_join[c].apply(to_num), errors='coerce')
+                inm_join[c + "_num"] = to_num_serie(inm_join[c])
     
     # Agrupar por proyecto
     grp = inm_join.groupby(key_inm, dropna=False)
@@ -335,23 +797,77 @@ def agregar_datos_por_proyecto(inm_join, cols_inm, cols_proy, key_inm, key_pry):
         proj_feat = proj_feat.merge(proj_feat_inm, on=key_inm, how='left')
     
     # Paso 3: Unir features agregados con dataset de proyectos
-    proj_ds = proj_ds.merge(proj_feat, on=key_inm, how='left', suffixes=('', '_feat'))
+    return proj_ds.merge(proj_feat, on=key_inm, how='left', suffixes=('', '_feat'))
+
+def agregar_datos_por_proyecto_incremental(inm_join, cols_inm, cols_proy, key_inm, key_pry, previo=None):
+    """Versión incremental de agregar_datos_por_proyecto.
     
-    # Calcular velocidad desde las columnas de Proyectos que ya están en proj_ds
-    # (proj_ds ya tiene todas las columnas de Proyectos)
-    proj_ds = calcular_velocidad(proj_ds, cols_proy)
+    Calcula una huella por proyecto (hash de sus filas en inm_join) y solo vuelve a
+    agregar los proyectos nuevos o cuyas filas cambiaron; el resto se toma de los
+    agregados de la ejecución anterior. Lo que se guarda no depende de la fecha, así que
+    el estado sirve entre días distintos: las métricas de velocidad (meses_desde_inicio
+    cambia cada día) se recalculan siempre para todos los proyectos, sobre el DataFrame
+    completo. El resultado es el mismo que el de agregar_datos_por_proyecto sobre todo inm_join.
+    
+    Args:
+        previo: dict {'contexto', 'huellas', 'agregados'} devuelto por una ejecución anterior, o None
+    
+    Returns:
+        tuple: (proj_ds, estado) donde estado es el dict a pasar como 'previo' la próxima vez
+    """
+    contexto = {
+        'key_inm': key_inm,
+        'key_pry': key_pry,
+        'columnas': list(inm_join.columns),
+        'cols_inm': dict(cols_inm),
+        'cols_proy': dict(cols_proy)
+    }
+    try:
+        huellas = huellas_por_proyecto(inm_join, key_inm)
+    except Exception as e:
+        print(f"  ⚠ No se pudieron calcular las huellas por proyecto: {str(e)}")
+        return agregar_datos_por_proyecto(inm_join, cols_inm, cols_proy, key_inm, key_pry), None
+    
+    print("  Agregando datos por proyecto...")
+    print(f"  Dataset de entrada: {len(inm_join)} inmuebles")
+    
+    agregados = None
+    if previo and previo.get('contexto') == contexto and previo.get('agregados') is not None:
+        huellas_previas = previo['huellas']
+        iguales = huellas.index.isin(huellas_previas.index)
+        iguales[iguales] = (huellas_previas.reindex(huellas.index[iguales]).values == huellas.values[iguales])
+        codigos_iguales = huellas.index[iguales]
+        codigos_cambiados = huellas.index[~iguales]
+        print(f"  Proyectos sin cambios: {len(codigos_iguales)}, nuevos o modificados: {len(codigos_cambiados)}, "
+              f"eliminados: {(~huellas_previas.index.isin(huellas.index)).sum()}")
+        
+        previos = previo['agregados']
+        partes = [previos[previos[key_inm].isin(codigos_iguales)]]
+        if len(codigos_cambiados) > 0:
+            partes.append(_agregar_columnas_proyecto(
+                inm_join[inm_join[key_inm].isin(codigos_cambiados)].copy(), cols_inm, key_inm
+            ))
+        
+        # Mismo orden de filas que groupby(key_inm, dropna=False): códigos ordenados, nulos al final
+        agregados = pd.concat(partes, ignore_index=True)
+        agregados = agregados.sort_values(key_inm, kind='stable', na_position='last').reset_index(drop=True)
+        if set(agregados.columns) != set(previos.columns):
+            # Los proyectos modificados generaron columnas distintas: agregar todo de nuevo
+            print("  ⚠ Columnas agregadas distintas a las de la ejecución anterior, recalculando todos los proyectos")
+            agregados = None
+        else:
+            agregados = agregados[previos.columns]
+    
+    if agregados is None:
+        agregados = _agregar_columnas_proyecto(inm_join, cols_inm, key_inm)
+    
+    # Métricas de velocidad (dependen de la fecha): siempre sobre todos los proyectos
+    proj_ds = calcular_velocidad(agregados, cols_proy)
     
     print(f"  ✓ Datos agregados: {len(proj_ds)} proyectos")
     print(f"  ✓ Columnas en resultado: {len(proj_ds.columns)}")
     
-    # Verificar que key_pry esté presente (puede estar como key_inm o con otro nombre)
-    if key_pry not in proj_ds.columns and key_inm in proj_ds.columns:
-        # Si key_pry no está pero key_inm sí, usar key_inm
-        pass
-    elif key_pry not in proj_ds.columns:
-        print(f"  ⚠ Advertencia: key_pry '{key_pry}' no está en proj_ds, usando key_inm '{key_inm}'")
-    
-    return proj_ds
+    return proj_ds, {'contexto': contexto, 'huellas': huellas, 'agregados': agregados.copy()}
 
 def agregar_features_unidad(inm_join, cols_inm, key_inm):
     """Agrega features a nivel de proyecto basados en las unidades.
@@ -363,7 +879,7 @@ def agregar_features_unidad(inm_join, cols_inm, key_inm):
               cols_inm.get('banos'), cols_inm.get('garajes')]:
         if c and c in inm_join.columns:
             if c + "_num" not in inm_join.columns:
-                inm_join[c + "_num"] = inm_join[c].apply(to_num)
+                inm_join[c + "_num"] = to_num_serie(inm_join[c])
     
     # Agrupar por proyecto
     grp = inm_join.groupby(key_inm)
@@ -459,7 +975,7 @@ def calcular_velocidad(pry, cols):
     for c in [cols['un_disp'], cols['ventas_un'], cols['tot_un'], 
               cols['precio_m2'], cols['precio_p'], cols['area_p'], cols['estrato']]:
         if c and c in prj.columns:
-            prj[c + "_num"] = pd.to_numeric(prj[c].apply(to_num), errors='coerce')
+            prj[c + "_num"] = to_num_serie(prj[c])
     
     # Meses para agotar
     if cols['un_disp'] and cols['ventas_un']:
@@ -1026,51 +1542,63 @@ def calcular_score_compuesto(ds, cols_proy):
 # CLASIFICACIÓN
 # ============================================================================
 
-def clasificar_por_factores_alternativos(row):
-    """Clasifica un proyecto usando factores alternativos cuando no hay meses_para_agotar.
-    Siempre devuelve una clasificación válida (Exitoso, Moderado, o Mejorable).
+def _clasificar_factores_alternativos(ds):
+    """Versión por columnas de clasificar_por_factores_alternativos.
     
-    Args:
-        row: Serie de pandas con los datos del proyecto
+    Evalúa la cascada velocidad → porcentaje vendido → unidades vendidas con np.select:
+    cada fila toma la primera regla cuya condición se cumple, igual que la versión por fila.
     
     Returns:
-        tuple: (clasificacion, score) donde clasificacion es 'Exitoso', 'Moderado', o 'Mejorable'
+        tuple: (clasificacion, score) como arrays alineados con las filas de ds
     """
-    # Intentar usar velocidad de ventas si está disponible
-    if 'velocidad_ventas' in row.index:
-        velocidad = pd.to_numeric(row.get('velocidad_ventas'), errors='coerce')
-        if pd.notna(velocidad) and velocidad > 0:
-            if velocidad > 15:
-                return ('Exitoso', 0.7)
-            elif velocidad >= 8:
-                return ('Moderado', 0.5)
-            else:
-                return ('Mejorable', 0.3)
+    condiciones, clasificaciones, scores = [], [], []
+    
+    def _agregar(mascara, reglas):
+        for condicion, clasificacion, score in reglas:
+            condiciones.append(mascara & condicion)
+            clasificaciones.append(clasificacion)
+            scores.append(score)
+    
+    # Intentar usar velocidad de ventas si está disponible (NaN nunca cumple las condiciones)
+    if 'velocidad_ventas' in ds.columns:
+        velocidad = _numerica(ds, 'velocidad_ventas')
+        _agregar(velocidad > 0, [(velocidad > 15, 'Exitoso', 0.7),
+                                 (velocidad >= 8, 'Moderado', 0.5),
+                                 (True, 'Mejorable', 0.3)])
     
     # Intentar usar porcentaje vendido si está disponible
-    if '_porcentaje_vendido_feat' in row.index:
-        porcentaje = pd.to_numeric(row.get('_porcentaje_vendido_feat'), errors='coerce')
-        if pd.notna(porcentaje) and porcentaje >= 0:
-            if porcentaje > 50:
-                return ('Exitoso', 0.7)
-            elif porcentaje > 25:
-                return ('Moderado', 0.5)
-            else:
-                return ('Mejorable', 0.3)
+    if '_porcentaje_vendido_feat' in ds.columns:
+        porcentaje = _numerica(ds, '_porcentaje_vendido_feat')
+        _agregar(porcentaje >= 0, [(porcentaje > 50, 'Exitoso', 0.7),
+                                   (porcentaje > 25, 'Moderado', 0.5),
+                                   (True, 'Mejorable', 0.3)])
     
     # Intentar usar unidades vendidas si está disponible
-    if 'unidades_vendidas' in row.index:
-        unidades = pd.to_numeric(row.get('unidades_vendidas'), errors='coerce')
-        if pd.notna(unidades) and unidades >= 0:
-            if unidades > 50:
-                return ('Exitoso', 0.65)
-            elif unidades > 20:
-                return ('Moderado', 0.5)
-            else:
-                return ('Mejorable', 0.35)
+    if 'unidades_vendidas' in ds.columns:
+        unidades = _numerica(ds, 'unidades_vendidas')
+        _agregar(unidades >= 0, [(unidades > 50, 'Exitoso', 0.65),
+                                 (unidades > 20, 'Moderado', 0.5),
+                                 (True, 'Mejorable', 0.35)])
     
     # Si no hay ningún factor disponible, usar clasificación neutra
-    return ('Moderado', 0.5)
+    if not condiciones:
+        return np.full(len(ds), 'Moderado', dtype=object), np.full(len(ds), 0.5)
+    clasificacion = np.select(condiciones, clasificaciones, 'Moderado').astype(object)
+    score = np.select(condiciones, scores, 0.5).astype(float)
+    return clasificacion, score
+
+def clasificar_por_factores_alternativos(row):
+    """Clasifica un proyecto usando factores alternativos cuando no hay meses_para_agotar.
+    Siempre devuelve una clasificación válida (Exitoso, Moderado, o Mejorable).
+    
+    Args:
+        row: Serie de pandas con los datos del proyecto
+    
+    Returns:
+        tuple: (clasificacion, score) donde clasificacion es 'Exitoso', 'Moderado', o 'Mejorable'
+    """
+    clasificacion, score = _clasificar_factores_alternativos(row.to_frame().T)
+    return (str(clasificacion[0]), float(score[0]))
 
 def clasificar_proyectos_global(ds):
     """Clasifica proyectos usando método global (fallback).
@@ -1080,7 +1608,11 @@ def clasificar_proyectos_global(ds):
         ds['meses_para_agotar'] = np.nan
     
     valid = pd.to_numeric(ds['meses_para_agotar'], errors='coerce')
-    valid_positive = valid[(valid > 0) & valid.notna()]
+    mascara_valida = ((valid > 0) & valid.notna()).to_numpy()
+    valid_positive = valid[mascara_valida]
+    
+    # Clasificación por factores alternativos para las filas sin meses_para_agotar válido
+    clasificacion, score = _clasificar_factores_alternativos(ds)
     
     # Si hay datos válidos, usar percentiles
     if len(valid_positive) >= 3:
@@ -1093,40 +1625,23 @@ def clasificar_proyectos_global(ds):
         min_meses = valid_positive.min()
         rango = max_meses - min_meses
         
-        def calcular_score_y_clasificacion(idx):
-            x = pd.to_numeric(ds.loc[idx, 'meses_para_agotar'], errors='coerce')
-            if pd.isna(x) or x <= 0:
-                # Si no hay datos válidos, usar clasificación por defecto basada en otros factores
-                resultado = clasificar_por_factores_alternativos(ds.loc[idx])
-                return resultado
-            
-            # Score normalizado
-            if rango > 0:
-                score = 1.0 - ((x - min_meses) / rango)
-                score = float(max(0.0, min(1.0, score)))
-            else:
-                score = 0.5
-            
-            # Clasificación
-            if x <= q1:
-                clasificacion = 'Exitoso'
-            elif x <= q2:
-                clasificacion = 'Moderado'
-            else:
-                clasificacion = 'Mejorable'
-            
-            return (clasificacion, float(score))
+        x = valid.to_numpy(dtype=float, na_value=np.nan)
+        if rango > 0:
+            with np.errstate(invalid='ignore'):
+                score_meses = np.clip(1.0 - ((x - min_meses) / rango), 0.0, 1.0)
+        else:
+            score_meses = np.full(len(ds), 0.5)
+        with np.errstate(invalid='ignore'):
+            clasificacion_meses = np.select([x <= q1, x <= q2], ['Exitoso', 'Moderado'], 'Mejorable')
         
-        # Aplicar clasificación
-        results = ds.index.to_series().apply(calcular_score_y_clasificacion)
-        ds['Clasificacion'] = results.apply(lambda x: x[0] if isinstance(x, tuple) and len(x) >= 1 else 'Moderado')
-        ds['Score_Exito'] = results.apply(lambda x: float(x[1]) if isinstance(x, tuple) and len(x) >= 2 else 0.5)
+        clasificacion = np.where(mascara_valida, clasificacion_meses, clasificacion).astype(object)
+        score = np.where(mascara_valida, score_meses, score)
     else:
         # Si no hay suficientes datos, clasificar por factores alternativos
         print("  ⚠ Pocos datos válidos, usando clasificación por factores alternativos")
-        resultados = ds.apply(clasificar_por_factores_alternativos, axis=1)
-        ds['Clasificacion'] = resultados.apply(lambda x: x[0] if isinstance(x, tuple) else 'Moderado')
-        ds['Score_Exito'] = resultados.apply(lambda x: x[1] if isinstance(x, tuple) and len(x) > 1 else 0.5)
+    
+    ds['Clasificacion'] = pd.Series(clasificacion, index=ds.index, dtype=object)
+    ds['Score_Exito'] = pd.Series(score, index=ds.index, dtype=float)
     
     # GARANTIZAR que TODOS tengan clasificación válida
     mask_sin_clasificar = ~ds['Clasificacion'].isin(['Exitoso', 'Moderado', 'Mejorable'])
@@ -1137,10 +1652,386 @@ def clasificar_proyectos_global(ds):
     
     return ds
 
-def clasificar_proyectos_por_segmento(ds, cols_proy):
+def amenidades_explotadas(serie):
+    """Amenidades de una columna tipo 'Otros' (separadas por comas), una fila por amenidad.
+    
+    Devuelve una Serie con el texto de cada amenidad sin espacios en los extremos (se
+    descartan las vacías), indexada por la posición del proyecto en la serie original."""
+    valores = pd.Series(serie.to_numpy(dtype=object))
+    valores = valores[valores.notna()].astype(str)
+    amenidades = valores.str.split(',').explode().str.strip()
+    return amenidades[amenidades.str.len() > 0]
+
+def construir_tabla_amenidades(ds, col_otros):
+    """Tabla normalizada de amenidades (proyecto, amenidad) de la columna 'Otros' de ds.
+    
+    Se construye una sola vez por DataFrame y la comparten el clasificador por segmentos y
+    el análisis de amenidades: las frecuencias (totales, de exitosos o por segmento) salen
+    de sumas por columnas de la matriz dispersa proyecto × amenidad.
+    
+    Returns:
+        dict con 'columna', 'indice' (índice de ds), 'posicion' y 'codigo' (una entrada por
+        amenidad mencionada), 'amenidades' (nombres en minúsculas, en orden de aparición),
+        'por_proyecto' (número de amenidades de cada fila) y 'matriz' (scipy.sparse CSR con
+        el número de menciones de cada amenidad por proyecto, o None sin scipy);
+        None si la columna no existe.
+    """
+    if not col_otros or col_otros not in ds.columns:
+        return None
+    
+    amenidades = amenidades_explotadas(ds[col_otros])
+    codigo, nombres = pd.factorize(amenidades.str.lower().str.strip())
+    posicion = amenidades.index.to_numpy(dtype=np.intp)
+    
+    matriz = None
+    if SCIPY_AVAILABLE:
+        # Las menciones repetidas de una amenidad en un proyecto se suman al construir la matriz
+        matriz = sparse.csr_matrix(
+            (np.ones(len(codigo), dtype=np.int64), (posicion, codigo)),
+            shape=(len(ds), len(nombres))
+        )
+    
+    return {
+        'columna': col_otros,
+        'indice': ds.index,
+        'posicion': posicion,
+        'codigo': codigo,
+        'amenidades': np.asarray(nombres, dtype=object),
+        'por_proyecto': np.bincount(posicion, minlength=len(ds)),
+        'matriz': matriz,
+    }
+
+def obtener_tabla_amenidades(ds, col_otros, tabla=None):
+    """Devuelve 'tabla' si corresponde a ds y col_otros; si no, construye una nueva."""
+    if tabla is not None and tabla['columna'] == col_otros and tabla['indice'].equals(ds.index):
+        return tabla
+    return construir_tabla_amenidades(ds, col_otros)
+
+def menciones_amenidades(tabla, filas=None):
+    """Menciones de cada amenidad en las filas indicadas (máscara booleana; None = todas)."""
+    if tabla['matriz'] is not None:
+        if filas is None:
+            return np.asarray(tabla['matriz'].sum(axis=0)).ravel()
+        return tabla['matriz'].T @ np.asarray(filas, dtype=np.int64)
+    codigo = tabla['codigo'] if filas is None else tabla['codigo'][np.asarray(filas, dtype=bool)[tabla['posicion']]]
+    return np.bincount(codigo, minlength=len(tabla['amenidades']))
+
+def _columna_num(ds, clave, cols_proy):
+    """Nombre de la columna numérica (con sufijo _num si existe) de una clave de cols_proy."""
+    col = cols_proy.get(clave) or ''
+    return col + "_num" if (col + "_num") in ds.columns else col
+
+def _numerica(ds, col, defecto=0.0):
+    """Columna de ds convertida a float (o el valor por defecto si no existe)."""
+    if col and col in ds.columns:
+        return pd.to_numeric(ds[col], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    return np.full(len(ds), defecto, dtype=float)
+
+def _estadisticas_agrupadas(valores, grupos, n_grupos, cuantiles):
+    """Mediana y cuantiles de 'valores' por grupo en una sola pasada.
+    
+    Ordena una vez por (grupo, valor) y toma de cada grupo los elementos que necesita.
+    La interpolación es la misma de Series.quantile / np.percentile (método 'linear'),
+    que groupby().quantile no reproduce bit a bit; los grupos sin valores quedan en 0.
+    
+    Args:
+        valores: Array float con los valores a resumir
+        grupos: Array int con el grupo de cada valor (0 .. n_grupos - 1)
+        n_grupos: Número de grupos
+        cuantiles: Cuantiles a calcular (p. ej. (0.25, 0.75))
+    
+    Returns:
+        dict: 'mediana' y cada cuantil -> array de longitud n_grupos
+    """
+    orden = np.lexsort((valores, grupos))
+    ordenados = valores[orden]
+    conteos = np.bincount(grupos, minlength=n_grupos)
+    inicios = np.concatenate(([0], np.cumsum(conteos)[:-1]))
+    hay = conteos > 0
+    ultimo = inicios + np.maximum(conteos - 1, 0)
+    
+    def _tomar(posiciones):
+        return ordenados[np.where(hay, posiciones, 0)] if len(ordenados) else np.zeros(n_grupos)
+    
+    resultado = {}
+    # Mediana: elemento central o promedio de los dos centrales (como np.median)
+    medio_bajo = _tomar(inicios + (conteos - 1) // 2)
+    medio_alto = _tomar(inicios + conteos // 2)
+    resultado['mediana'] = np.where(hay, np.where(conteos % 2 == 1, medio_bajo, (medio_bajo + medio_alto) / 2), 0.0)
+    
+    for q in cuantiles:
+        virtual = (conteos - 1) * (q * 100.0 / 100)
+        previo = np.floor(virtual)
+        gamma = virtual - previo
+        arriba = virtual >= conteos - 1
+        a = _tomar(np.where(arriba, ultimo, inicios + previo.astype(np.intp)))
+        b = _tomar(np.where(arriba, ultimo, inicios + previo.astype(np.intp) + 1))
+        diferencia = b - a
+        valor = np.where(gamma >= 0.5, b - diferencia * (1 - gamma), a + diferencia * gamma)
+        resultado[q] = np.where(hay, valor, 0.0)
+    return resultado
+
+def _clasificar_segmentos(ds, codigos, segmentos, calcular, cols_proy, tabla_amenidades=None):
+    """Clasifica con el score multi-variable los proyectos válidos de varios segmentos a la vez.
+    
+    Las estadísticas de todos los segmentos se calculan en una pasada agrupada y el score de
+    cada proyecto se obtiene con operaciones sobre columnas completas (sin recorrer filas).
+    El resultado de cada segmento solo depende de sus filas, por lo que puede reutilizarse
+    mientras esas filas no cambien (ver clasificar_proyectos_por_segmento).
+    
+    Args:
+        ds: DataFrame de proyectos
+        codigos: Código de segmento de cada fila de ds (posición en 'segmentos')
+        segmentos: Nombres de los segmentos
+        calcular: Array bool por segmento; solo se clasifican los segmentos marcados
+        cols_proy: Columnas detectadas del dataset
+    
+    Returns:
+        tuple: (posiciones en ds, clasificación, score) de los proyectos clasificados.
+        Los segmentos con menos de 3 proyectos válidos no aparecen (se clasifican
+        después con el método global).
+    """
+    n_segmentos = len(segmentos)
+    
+    # Filtrar proyectos válidos (sin anomalías críticas y con meses_para_agotar válido)
+    meses_todos = _numerica(ds, 'meses_para_agotar', np.nan)
+    valido = (meses_todos > 0) & (meses_todos <= 120) & np.asarray(calcular, dtype=bool)[codigos]
+    
+    # Si hay menos de 3 proyectos válidos en el segmento, usar método global
+    n_validos = np.bincount(codigos[valido], minlength=n_segmentos)
+    valido &= n_validos[codigos] >= 3
+    posiciones = np.flatnonzero(valido)
+    grupo = codigos[posiciones]
+    
+    def _columna(col, defecto=0.0):
+        return _numerica(ds, col, defecto)[posiciones]
+    
+    def _estadisticas(valores, mascara, cuantiles=()):
+        return _estadisticas_agrupadas(valores[mascara], grupo[mascara], n_segmentos, cuantiles)
+    
+    # Métricas de cada segmento (una pasada agrupada por métrica)
+    meses = meses_todos[posiciones]
+    min_meses_seg = np.full(n_segmentos, np.inf)
+    np.minimum.at(min_meses_seg, grupo, meses)
+    max_meses_seg = np.full(n_segmentos, -np.inf)
+    np.maximum.at(max_meses_seg, grupo, meses)
+    rango_seg = max_meses_seg - min_meses_seg
+    
+    velocidad = _columna('velocidad_ventas')
+    stats_velocidad = _estadisticas(velocidad, velocidad > 0, (0.25, 0.75))
+    
+    porcentaje = _columna('_porcentaje_vendido_feat')
+    stats_porcentaje = _estadisticas(porcentaje, porcentaje >= 0, (0.25, 0.75))
+    
+    precio_m2_col_num = _columna_num(ds, 'precio_m2', cols_proy)
+    precio_m2 = _columna(precio_m2_col_num, np.nan)
+    mediana_precio_m2_seg = _estadisticas(precio_m2, precio_m2 > 0)['mediana']
+    
+    col_otros = cols_proy.get('otros') or ''
+    if col_otros in ds.columns:
+        tabla = obtener_tabla_amenidades(ds, col_otros, tabla_amenidades)
+        num_amenidades = tabla['por_proyecto'][posiciones].astype(float)
+        mediana_num_amenidades_seg = _estadisticas(num_amenidades, np.ones(len(posiciones), dtype=bool))['mediana']
+    
+    # Valores del segmento de cada proyecto
+    min_meses = min_meses_seg[grupo]
+    rango = rango_seg[grupo]
+    p25_velocidad, p75_velocidad = stats_velocidad[0.25][grupo], stats_velocidad[0.75][grupo]
+    mediana_velocidad = stats_velocidad['mediana'][grupo]
+    p25_porcentaje, p75_porcentaje = stats_porcentaje[0.25][grupo], stats_porcentaje[0.75][grupo]
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 1. Score de velocidad (meses para agotar)
+        score_velocidad = np.where(rango > 0, np.clip(1.0 - ((meses - min_meses) / rango), 0.0, 1.0), 0.5)
+        
+        # 2. Score de velocidad de ventas (unidades/mes), normalizada respecto al segmento
+        vende = velocidad > 0
+        score_vel_ventas = np.select(
+            [vende & (p75_velocidad > p25_velocidad), vende & (mediana_velocidad > 0)],
+            [np.clip((velocidad - p25_velocidad) / (p75_velocidad - p25_velocidad), 0.0, 1.0),
+             np.clip(velocidad / (mediana_velocidad * 2), 0.0, 1.0)],
+            0.3  # Penalizar velocidad baja/inexistente
+        )
+        
+        # 3. Score de porcentaje vendido
+        score_porcentaje = np.select(
+            [(porcentaje >= 0) & (p75_porcentaje > p25_porcentaje), porcentaje >= 0],
+            [np.clip((porcentaje - p25_porcentaje) / (p75_porcentaje - p25_porcentaje), 0.0, 1.0),
+             np.minimum(1.0, porcentaje / 100.0)],
+            0.2  # Penalizar porcentaje bajo/inexistente
+        )
+        
+        # 4. Score de tamaño del proyecto: proyectos medianos (50-150 unidades) tienden a ser más exitosos
+        tamano = _columna(_columna_num(ds, 'tot_un', cols_proy), np.nan)
+        score_tamano = np.select(
+            [~(tamano > 0), (tamano >= 50) & (tamano <= 150),
+             ((tamano >= 25) & (tamano < 50)) | ((tamano > 150) & (tamano <= 200)), tamano < 25],
+            [0.5, 1.0, 0.7, 0.5], 0.6
+        )
+        
+        # 5. Score de precio/m²: precios cerca de la mediana del segmento son más competitivos
+        mediana_precio_m2 = mediana_precio_m2_seg[grupo]
+        ratio_precio = precio_m2 / mediana_precio_m2
+        score_precio_m2 = np.select(
+            [~(precio_m2 > 0) | ~(mediana_precio_m2 > 0), (ratio_precio >= 0.85) & (ratio_precio <= 1.15),
+             ((ratio_precio >= 0.70) & (ratio_precio < 0.85)) | ((ratio_precio > 1.15) & (ratio_precio <= 1.30)),
+             ratio_precio < 0.70],
+            [0.5, 1.0, 0.7, 0.4], 0.3
+        )
+        
+        # 6. Score de área promedio: áreas medias (60-100 m²) tienden a ser más exitosas
+        area = _columna(_columna_num(ds, 'area_p', cols_proy), np.nan)
+        score_area = np.select(
+            [~(area > 0), (area >= 60) & (area <= 100),
+             ((area >= 45) & (area < 60)) | ((area > 100) & (area <= 120)), area < 45],
+            [0.5, 1.0, 0.8, 0.6], 0.7
+        )
+        
+        # 7. Score de características de inmuebles (alcobas, baños, garajes agregados)
+        alcobas_col = banos_col = garajes_col = None
+        for col in ds.columns:
+            if 'alcoba' in col.lower() and ('median' in col.lower() or 'mean' in col.lower()):
+                alcobas_col = col
+            if ('bano' in col.lower() or 'baño' in col.lower()) and ('median' in col.lower() or 'mean' in col.lower()):
+                banos_col = col
+            if 'garaje' in col.lower() and ('median' in col.lower() or 'mean' in col.lower()):
+                garajes_col = col
+        
+        suma_scores = np.zeros(len(posiciones))
+        num_caracteristicas = np.zeros(len(posiciones))
+        if alcobas_col:
+            # Alcobas: 2-3 alcobas son óptimas
+            alcobas = _columna(alcobas_col, np.nan)
+            presente = alcobas > 0
+            suma_scores += np.where(presente, np.select([(alcobas >= 2) & (alcobas <= 3),
+                                                         ((alcobas >= 1) & (alcobas < 2)) | ((alcobas > 3) & (alcobas <= 4))],
+                                                        [1.0, 0.7], 0.5), 0.0)
+            num_caracteristicas += presente
+        if banos_col:
+            # Baños: 2-3 baños son óptimos
+            banos = _columna(banos_col, np.nan)
+            presente = banos > 0
+            suma_scores += np.where(presente, np.select([(banos >= 2) & (banos <= 3),
+                                                         ((banos >= 1) & (banos < 2)) | ((banos > 3) & (banos <= 4))],
+                                                        [1.0, 0.7], 0.5), 0.0)
+            num_caracteristicas += presente
+        if garajes_col:
+            # Garajes: 1-2 garajes son óptimos
+            garajes = _columna(garajes_col, np.nan)
+            presente = garajes >= 0
+            suma_scores += np.where(presente, np.select([(garajes >= 1) & (garajes <= 2), (garajes == 0) | (garajes == 3)],
+                                                        [1.0, 0.6], 0.4), 0.0)
+            num_caracteristicas += presente
+        score_caracteristicas = np.where(num_caracteristicas > 0, suma_scores / num_caracteristicas, 0.5)
+        
+        # 8. Score de número de amenidades, normalizado respecto a la mediana del segmento
+        if col_otros in ds.columns:
+            mediana_amenidades = mediana_num_amenidades_seg[grupo]
+            score_amenidades = np.where(
+                mediana_amenidades > 0,
+                np.select([num_amenidades >= mediana_amenidades * 1.5, num_amenidades >= mediana_amenidades,
+                           num_amenidades >= mediana_amenidades * 0.5], [1.0, 0.8, 0.6], 0.3),
+                # Si no hay mediana, usar valores absolutos
+                np.select([num_amenidades >= 10, num_amenidades >= 5, num_amenidades >= 2], [1.0, 0.7, 0.5], 0.3)
+            )
+        else:
+            score_amenidades = np.full(len(posiciones), 0.5)
+        
+        # 9. Score de patrón de ventas
+        if 'Patron_Ventas' in ds.columns:
+            patron = ds['Patron_Ventas'].astype(str).iloc[posiciones]
+            score_patron = np.select(
+                [patron.str.contains('Acelerado', regex=False).to_numpy(),
+                 patron.str.contains('Constante', regex=False).to_numpy(),
+                 patron.str.contains('Desacelerado', regex=False).to_numpy()],
+                [1.0, 0.7, 0.3], 0.5
+            )
+        else:
+            score_patron = np.full(len(posiciones), 0.5)
+        
+        # 10. Score de antigüedad y eficiencia temporal (objetivo: cerrar el proyecto en 24 meses)
+        # Inactivo (Unidades_Disponibles = 0): tiempo total = meses_desde_inicio
+        # Activo: tiempo total = meses_desde_inicio + meses_para_agotar
+        TIEMPO_OBJETIVO_MESES = 24
+        meses_desde_inicio = _columna('meses_desde_inicio')
+        porcentaje_vendido = porcentaje
+        un_disp_col_num = _columna_num(ds, 'un_disp', cols_proy)
+        unidades_disponibles = _columna(un_disp_col_num, np.nan)
+        # Si no se puede determinar, asumir activo
+        proyecto_activo = np.where(np.isnan(unidades_disponibles), True, unidades_disponibles > 0)
+        
+        tiempo_total_cierre = np.where(proyecto_activo, meses_desde_inicio + meses, meses_desde_inicio)
+        exceso_tiempo = tiempo_total_cierre - TIEMPO_OBJETIVO_MESES
+        score_antiguedad = np.select(
+            [tiempo_total_cierre <= TIEMPO_OBJETIVO_MESES, tiempo_total_cierre <= 36, tiempo_total_cierre <= 48],
+            [1.0 - ((tiempo_total_cierre / TIEMPO_OBJETIVO_MESES) * 0.3),  # Entre 0.7 y 1.0
+             0.7 - ((exceso_tiempo / 12.0) * 0.2),                          # Entre 0.5 y 0.7
+             0.5 - (np.minimum(1.0, exceso_tiempo / 24.0) * 0.2)],          # Entre 0.3 y 0.5
+            np.maximum(0.1, 0.3 - (np.minimum(1.0, exceso_tiempo / 48.0) * 0.2))  # Entre 0.1 y 0.3
+        )
+        
+        # Penalización adicional para proyectos activos antiguos con bajo porcentaje vendido
+        penalizar = proyecto_activo & ~np.isnan(porcentaje_vendido)
+        score_antiguedad = np.select(
+            [penalizar & (meses_desde_inicio > TIEMPO_OBJETIVO_MESES) & (porcentaje_vendido < 50),
+             penalizar & (meses_desde_inicio > 36) & (porcentaje_vendido < 70)],
+            [score_antiguedad * (1.0 - ((TIEMPO_OBJETIVO_MESES - porcentaje_vendido) / TIEMPO_OBJETIVO_MESES) * 0.3),
+             score_antiguedad * (1.0 - ((70 - porcentaje_vendido) / 70.0) * 0.2)],
+            score_antiguedad
+        )
+        
+        # Sin fecha de inicio válida no hay penalización; con tiempo total 0 tampoco
+        evaluado = (meses_desde_inicio >= 0) & (tiempo_total_cierre > 0)
+        score_antiguedad = np.where(evaluado, np.clip(score_antiguedad, 0.0, 1.0), 1.0)
+    
+    # Score compuesto ponderado con penalización por antigüedad
+    score_compuesto = (
+        score_velocidad * 0.30 +      # Meses para agotar (invertido)
+        score_vel_ventas * 0.18 +     # Velocidad de ventas
+        score_porcentaje * 0.12 +     # Porcentaje vendido
+        score_antiguedad * 0.10 +     # Antigüedad y eficiencia temporal
+        score_tamano * 0.07 +         # Tamaño del proyecto
+        score_precio_m2 * 0.07 +      # Precio/m²
+        score_area * 0.05 +           # Área promedio
+        score_caracteristicas * 0.04 + # Características inmuebles
+        score_amenidades * 0.03 +     # Número de amenidades
+        score_patron * 0.02           # Patrón de ventas
+    )
+    
+    # Clasificación basada en score compuesto y score ajustado a los rangos esperados
+    exitoso = score_compuesto >= 0.67
+    moderado = ~exitoso & (score_compuesto >= 0.33)
+    clasificacion = np.select([exitoso, moderado], ['Exitoso', 'Moderado'], 'Mejorable').astype(object)
+    score_final = np.select(
+        [exitoso, moderado],
+        [0.62 + (score_compuesto * 0.17),   # Rango: 0.62 - 0.79
+         0.50 + (score_compuesto * 0.12)],  # Rango: 0.50 - 0.62
+        0.21 + (score_compuesto * 0.29)     # Rango: 0.21 - 0.50
+    )
+    
+    return posiciones, clasificacion, np.clip(score_final, 0.0, 1.0)
+
+def _columnas_clasificacion_segmento(ds, cols_proy):
+    """Columnas de ds que lee _clasificar_segmentos (las que determinan su resultado)."""
+    columnas = ['meses_para_agotar', 'velocidad_ventas', '_porcentaje_vendido_feat',
+                'meses_desde_inicio', 'Patron_Ventas']
+    for clave in ('tot_un', 'precio_m2', 'area_p', 'un_disp', 'otros'):
+        col = cols_proy.get(clave)
+        if col:
+            columnas.extend([col, col + "_num"])
+    # Columnas agregadas de alcobas/baños/garajes (se detectan por nombre)
+    columnas.extend(c for c in ds.columns
+                    if any(p in c.lower() for p in ('alcoba', 'bano', 'baño', 'garaje')))
+    return [c for c in dict.fromkeys(columnas) if c in ds.columns]
+
+def clasificar_proyectos_por_segmento(ds, cols_proy, cache_segmentos=None, tabla_amenidades=None):
     """Clasifica proyectos en Exitoso, Moderado o Mejorable basado en velocidad, 
     comparando dentro de cada segmento (Zona/Estrato/Tipo_VIS).
-    GARANTIZA que TODOS los proyectos tengan una clasificación válida."""
+    GARANTIZA que TODOS los proyectos tengan una clasificación válida.
+    
+    Si se pasa cache_segmentos (dict), los segmentos cuyas filas no cambiaron desde la
+    ejecución anterior reutilizan su resultado, y el dict se actualiza con los actuales.
+    tabla_amenidades (de construir_tabla_amenidades) evita volver a separar la columna 'Otros'."""
     
     print("=" * 70)
     print("  CLASIFICACIÓN DE PROYECTOS POR SEGMENTOS")
@@ -1164,14 +2055,13 @@ def clasificar_proyectos_por_segmento(ds, cols_proy):
     if tipo_vis_col:
         segmento_cols.append(tipo_vis_col)
     
-    # Crear segmento combinado
+    # Crear segmento combinado (Zona|Estrato|Tipo VIS) solo para filas sin valores nulos
     if segmento_cols:
-        # Filtrar valores nulos para crear segmento
-        segmento_mask = ds[segmento_cols].notna().all(axis=1)
-        ds.loc[segmento_mask, '_segmento'] = ds.loc[segmento_mask, segmento_cols].apply(
-            lambda x: '|'.join([str(v) if pd.notna(v) else 'N/A' for v in x]), axis=1
-        )
-        ds.loc[~segmento_mask, '_segmento'] = 'Sin_Segmento'
+        segmento_mask = ds[segmento_cols].notna().all(axis=1).to_numpy()
+        segmento = ds[segmento_cols[0]].astype(str)
+        for col in segmento_cols[1:]:
+            segmento = segmento + '|' + ds[col].astype(str)
+        ds['_segmento'] = np.where(segmento_mask, segmento.to_numpy(dtype=object), 'Sin_Segmento')
     else:
         ds['_segmento'] = 'Sin_Segmento'
     
@@ -1181,432 +2071,77 @@ def clasificar_proyectos_por_segmento(ds, cols_proy):
     ds['Score_Exito'] = 0.5  # Score neutro por defecto
     ds['_metodo_clasificacion'] = 'Pendiente'
     
-    # Clasificar por segmento
-    segmentos = ds['_segmento'].unique()
+    # Código de segmento por fila (en orden de aparición) y posiciones de cada segmento
+    codigos, segmentos = pd.factorize(ds['_segmento'])
+    segmentos = list(segmentos)
+    orden = np.argsort(codigos, kind='stable')
+    miembros = np.split(orden, np.cumsum(np.bincount(codigos, minlength=len(segmentos)))[:-1])
     print(f"  Segmentos encontrados: {len(segmentos)}")
     print()
     
-    for segmento in segmentos:
-        ds_segmento = ds[ds['_segmento'] == segmento]
-        
-        # Filtrar proyectos válidos (sin anomalías críticas y con meses_para_agotar válido)
-        meses_col = pd.to_numeric(ds_segmento['meses_para_agotar'], errors='coerce')
-        valid_mask = (meses_col > 0) & meses_col.notna() & (meses_col <= 120)
-        valid_segmento = ds_segmento[valid_mask]
-        
-        # Si hay menos de 3 proyectos válidos en el segmento, usar método global
-        if len(valid_segmento) < 3:
-            continue  # Se clasificarán después con método global
-        
-        # Calcular métricas del segmento para múltiples variables
-        meses_seg = pd.to_numeric(valid_segmento['meses_para_agotar'], errors='coerce')
-        q1_seg = meses_seg.quantile(0.33)
-        q2_seg = meses_seg.quantile(0.67)
-        min_meses_seg = meses_seg.min()
-        max_meses_seg = meses_seg.max()
-        rango_seg = max_meses_seg - min_meses_seg
-        
-        # Calcular métricas de velocidad
-        velocidad_seg = pd.to_numeric(valid_segmento.get('velocidad_ventas', pd.Series([0] * len(valid_segmento))), errors='coerce')
-        velocidad_seg_valida = velocidad_seg[velocidad_seg > 0]
-        if len(velocidad_seg_valida) > 0:
-            mediana_velocidad_seg = velocidad_seg_valida.median()
-            p75_velocidad_seg = velocidad_seg_valida.quantile(0.75)
-            p25_velocidad_seg = velocidad_seg_valida.quantile(0.25)
-        else:
-            mediana_velocidad_seg = 0
-            p75_velocidad_seg = 0
-            p25_velocidad_seg = 0
-        
-        # Calcular métricas de porcentaje vendido
-        porcentaje_vendido_seg = pd.to_numeric(valid_segmento.get('_porcentaje_vendido_feat', pd.Series([0] * len(valid_segmento))), errors='coerce')
-        porcentaje_seg_valido = porcentaje_vendido_seg[porcentaje_vendido_seg >= 0]
-        if len(porcentaje_seg_valido) > 0:
-            mediana_porcentaje_seg = porcentaje_seg_valido.median()
-            p75_porcentaje_seg = porcentaje_seg_valido.quantile(0.75)
-            p25_porcentaje_seg = porcentaje_seg_valido.quantile(0.25)
-        else:
-            mediana_porcentaje_seg = 0
-            p75_porcentaje_seg = 0
-            p25_porcentaje_seg = 0
-        
-        # Calcular métricas de tamaño (unidades totales)
-        tot_un_col = cols_proy.get('tot_un', '')
-        tot_un_col_num = tot_un_col + "_num" if (tot_un_col + "_num") in valid_segmento.columns else tot_un_col
-        if tot_un_col_num in valid_segmento.columns:
-            tamano_seg = pd.to_numeric(valid_segmento[tot_un_col_num], errors='coerce')
-            tamano_seg_valido = tamano_seg[tamano_seg > 0]
-            if len(tamano_seg_valido) > 0:
-                mediana_tamano_seg = tamano_seg_valido.median()
-            else:
-                mediana_tamano_seg = 0
-        else:
-            mediana_tamano_seg = 0
-        
-        # Calcular métricas de precio/m²
-        precio_m2_col = cols_proy.get('precio_m2', '')
-        precio_m2_col_num = precio_m2_col + "_num" if (precio_m2_col + "_num") in valid_segmento.columns else precio_m2_col
-        if precio_m2_col_num in valid_segmento.columns:
-            precio_m2_seg = pd.to_numeric(valid_segmento[precio_m2_col_num], errors='coerce')
-            precio_m2_seg_valido = precio_m2_seg[precio_m2_seg > 0]
-            if len(precio_m2_seg_valido) > 0:
-                mediana_precio_m2_seg = precio_m2_seg_valido.median()
-                p75_precio_m2_seg = precio_m2_seg_valido.quantile(0.75)
-                p25_precio_m2_seg = precio_m2_seg_valido.quantile(0.25)
-            else:
-                mediana_precio_m2_seg = 0
-                p75_precio_m2_seg = 0
-                p25_precio_m2_seg = 0
-        else:
-            mediana_precio_m2_seg = 0
-            p75_precio_m2_seg = 0
-            p25_precio_m2_seg = 0
-        
-        # Calcular métricas de área promedio
-        area_p_col = cols_proy.get('area_p', '')
-        area_p_col_num = area_p_col + "_num" if (area_p_col + "_num") in valid_segmento.columns else area_p_col
-        if area_p_col_num in valid_segmento.columns:
-            area_seg = pd.to_numeric(valid_segmento[area_p_col_num], errors='coerce')
-            area_seg_valido = area_seg[area_seg > 0]
-            if len(area_seg_valido) > 0:
-                mediana_area_seg = area_seg_valido.median()
-            else:
-                mediana_area_seg = 0
-        else:
-            mediana_area_seg = 0
-        
-        # Calcular métricas de características de inmuebles (alcobas, baños, garajes)
-        # Buscar columnas agregadas de inmuebles
-        alcobas_col = None
-        banos_col = None
-        garajes_col = None
-        for col in valid_segmento.columns:
-            if 'alcoba' in col.lower() and ('median' in col.lower() or 'mean' in col.lower()):
-                alcobas_col = col
-            if ('bano' in col.lower() or 'baño' in col.lower()) and ('median' in col.lower() or 'mean' in col.lower()):
-                banos_col = col
-            if 'garaje' in col.lower() and ('median' in col.lower() or 'mean' in col.lower()):
-                garajes_col = col
-        
-        # Calcular métricas de amenidades (número de amenidades por proyecto)
-        col_otros = cols_proy.get('otros', '')
-        num_amenidades_seg = []
-        if col_otros and col_otros in valid_segmento.columns:
-            for idx in valid_segmento.index:
-                otros_val = valid_segmento.loc[idx, col_otros]
-                if pd.notna(otros_val) and str(otros_val).strip():
-                    otros_str = str(otros_val).strip()
-                    amenidades = [a.strip() for a in otros_str.split(',') if a.strip()]
-                    num_amenidades_seg.append(len(amenidades))
-                else:
-                    num_amenidades_seg.append(0)
+    # Con cache_segmentos, los segmentos cuyas filas no cambiaron reutilizan el resultado anterior
+    hashes_ds = None
+    if cache_segmentos is not None:
+        try:
+            hashes_ds = hash_filas(ds[_columnas_clasificacion_segmento(ds, cols_proy)]).to_numpy()
+        except Exception as e:
+            print(f"  ⚠ No se pudieron calcular las huellas de los segmentos: {str(e)}")
+    
+    firmas = [None] * len(segmentos)
+    resultados = [None] * len(segmentos)
+    calcular = np.ones(len(segmentos), dtype=bool)
+    reutilizados = 0
+    if hashes_ds is not None:
+        for i, segmento in enumerate(segmentos):
+            firmas[i] = _firma_hashes(ds.columns, hashes_ds[miembros[i]])
+            previo = cache_segmentos.get(segmento)
+            if previo is not None and previo['firma'] == firmas[i]:
+                # Los resultados se guardan con posiciones dentro del segmento, no con el índice de ds
+                resultados[i] = previo['resultado']
+                calcular[i] = False
+                reutilizados += 1
+    
+    # Clasificar todos los segmentos pendientes de una vez
+    posiciones, clasificacion, score = _clasificar_segmentos(ds, codigos, segmentos, calcular, cols_proy,
+                                                             tabla_amenidades)
+    codigo_clasificado = codigos[posiciones]
+    for i in np.unique(codigo_clasificado):
+        del_segmento = codigo_clasificado == i
+        resultados[i] = pd.DataFrame({
+            'Clasificacion': clasificacion[del_segmento],
+            'Score_Exito': score[del_segmento],
+            '_metodo_clasificacion': f'Segmento: {segmentos[i]} (Multi-variable)'
+        }, index=np.searchsorted(miembros[i], posiciones[del_segmento]))
+    
+    # Escribir los resultados (calculados y reutilizados) en ds
+    columnas = {col: ds[col].to_numpy(dtype=object if col != 'Score_Exito' else float).copy()
+                for col in ('Clasificacion', 'Score_Exito', '_metodo_clasificacion')}
+    segmentos_calculados = {}
+    for i, segmento in enumerate(segmentos):
+        resultado = resultados[i]
+        if firmas[i] is not None:
+            segmentos_calculados[segmento] = {'firma': firmas[i], 'resultado': resultado}
+        
+        if resultado is None:
+            continue
         
-        if num_amenidades_seg:
-            mediana_num_amenidades_seg = pd.Series(num_amenidades_seg).median()
-            p75_num_amenidades_seg = pd.Series(num_amenidades_seg).quantile(0.75)
-            p25_num_amenidades_seg = pd.Series(num_amenidades_seg).quantile(0.25)
-        else:
-            mediana_num_amenidades_seg = 0
-            p75_num_amenidades_seg = 0
-            p25_num_amenidades_seg = 0
+        filas = miembros[i][resultado.index.to_numpy()]
+        for col, valores in columnas.items():
+            valores[filas] = resultado[col].to_numpy()
         
-        # Clasificar proyectos del segmento considerando múltiples variables
-        for idx in ds_segmento[valid_mask].index:
-            meses = pd.to_numeric(ds_segmento.loc[idx, 'meses_para_agotar'], errors='coerce')
-            
-            if pd.isna(meses) or meses <= 0:
-                continue
-            
-            # 1. Score de velocidad (meses para agotar) - PESO 40%
-            if rango_seg > 0:
-                score_velocidad = 1.0 - ((meses - min_meses_seg) / rango_seg)
-                score_velocidad = float(max(0.0, min(1.0, score_velocidad)))
-            else:
-                score_velocidad = 0.5
-            
-            # 2. Score de velocidad de ventas (unidades/mes) - PESO 25%
-            velocidad = pd.to_numeric(ds_segmento.loc[idx, 'velocidad_ventas'] if 'velocidad_ventas' in ds_segmento.columns else 0, errors='coerce')
-            if pd.notna(velocidad) and velocidad > 0 and p75_velocidad_seg > p25_velocidad_seg:
-                # Normalizar velocidad respecto al segmento
-                score_vel_ventas = min(1.0, max(0.0, (velocidad - p25_velocidad_seg) / (p75_velocidad_seg - p25_velocidad_seg)))
-            elif pd.notna(velocidad) and velocidad > 0 and mediana_velocidad_seg > 0:
-                # Comparar con mediana
-                score_vel_ventas = min(1.0, max(0.0, velocidad / (mediana_velocidad_seg * 2)))
-            else:
-                score_vel_ventas = 0.3  # Penalizar velocidad baja/inexistente
-            
-            # 3. Score de porcentaje vendido - PESO 20%
-            porcentaje = pd.to_numeric(ds_segmento.loc[idx, '_porcentaje_vendido_feat'] if '_porcentaje_vendido_feat' in ds_segmento.columns else 0, errors='coerce')
-            if pd.notna(porcentaje) and porcentaje >= 0:
-                if p75_porcentaje_seg > p25_porcentaje_seg:
-                    score_porcentaje = min(1.0, max(0.0, (porcentaje - p25_porcentaje_seg) / (p75_porcentaje_seg - p25_porcentaje_seg)))
-                else:
-                    score_porcentaje = min(1.0, porcentaje / 100.0)  # Normalizar a 0-100%
-            else:
-                score_porcentaje = 0.2  # Penalizar porcentaje bajo/inexistente
-            
-            # 4. Score de tamaño del proyecto - PESO 10%
-            # Proyectos medianos (50-150 unidades) tienden a ser más exitosos
-            if tot_un_col_num in ds_segmento.columns:
-                tamano = pd.to_numeric(ds_segmento.loc[idx, tot_un_col_num], errors='coerce')
-                if pd.notna(tamano) and tamano > 0:
-                    if 50 <= tamano <= 150:
-                        score_tamano = 1.0  # Tamaño óptimo
-                    elif 25 <= tamano < 50 or 150 < tamano <= 200:
-                        score_tamano = 0.7  # Tamaño aceptable
-                    elif tamano < 25:
-                        score_tamano = 0.5  # Muy pequeño
-                    else:
-                        score_tamano = 0.6  # Muy grande
-                else:
-                    score_tamano = 0.5
-            else:
-                score_tamano = 0.5
-            
-            # 5. Score de precio/m² (posición competitiva) - PESO 8%
-            # Precios competitivos (no demasiado altos ni demasiado bajos) son mejores
-            if precio_m2_col_num in ds_segmento.columns:
-                precio_m2 = pd.to_numeric(ds_segmento.loc[idx, precio_m2_col_num], errors='coerce')
-                if pd.notna(precio_m2) and precio_m2 > 0:
-                    if mediana_precio_m2_seg > 0:
-                        # Proyectos con precio cerca de la mediana del segmento son mejores
-                        ratio_precio = precio_m2 / mediana_precio_m2_seg
-                        if 0.85 <= ratio_precio <= 1.15:  # Entre 85% y 115% de la mediana
-                            score_precio_m2 = 1.0  # Precio competitivo
-                        elif 0.70 <= ratio_precio < 0.85 or 1.15 < ratio_precio <= 1.30:
-                            score_precio_m2 = 0.7  # Precio aceptable
-                        elif ratio_precio < 0.70:
-                            score_precio_m2 = 0.4  # Muy barato (puede indicar baja calidad)
-                        else:
-                            score_precio_m2 = 0.3  # Muy caro (puede limitar ventas)
-                    else:
-                        score_precio_m2 = 0.5
-                else:
-                    score_precio_m2 = 0.5
-            else:
-                score_precio_m2 = 0.5
-            
-            # 6. Score de área promedio - PESO 5%
-            # Áreas medias (60-100 m²) tienden a ser más exitosas
-            if area_p_col_num in ds_segmento.columns:
-                area = pd.to_numeric(ds_segmento.loc[idx, area_p_col_num], errors='coerce')
-                if pd.notna(area) and area > 0:
-                    if 60 <= area <= 100:
-                        score_area = 1.0  # Área óptima
-                    elif 45 <= area < 60 or 100 < area <= 120:
-                        score_area = 0.8  # Área aceptable
-                    elif area < 45:
-                        score_area = 0.6  # Muy pequeña
-                    else:
-                        score_area = 0.7  # Muy grande
-                else:
-                    score_area = 0.5
-            else:
-                score_area = 0.5
-            
-            # 7. Score de características de inmuebles (alcobas, baños, garajes) - PESO 4%
-            score_caracteristicas = 0.5
-            num_caracteristicas = 0
-            suma_scores = 0
-            
-            # Alcobas: 2-3 alcobas son óptimas
-            if alcobas_col and alcobas_col in ds_segmento.columns:
-                alcobas = pd.to_numeric(ds_segmento.loc[idx, alcobas_col], errors='coerce')
-                if pd.notna(alcobas) and alcobas > 0:
-                    num_caracteristicas += 1
-                    if 2 <= alcobas <= 3:
-                        suma_scores += 1.0
-                    elif 1 <= alcobas < 2 or 3 < alcobas <= 4:
-                        suma_scores += 0.7
-                    else:
-                        suma_scores += 0.5
-            
-            # Baños: 2-3 baños son óptimos
-            if banos_col and banos_col in ds_segmento.columns:
-                banos = pd.to_numeric(ds_segmento.loc[idx, banos_col], errors='coerce')
-                if pd.notna(banos) and banos > 0:
-                    num_caracteristicas += 1
-                    if 2 <= banos <= 3:
-                        suma_scores += 1.0
-                    elif 1 <= banos < 2 or 3 < banos <= 4:
-                        suma_scores += 0.7
-                    else:
-                        suma_scores += 0.5
-            
-            # Garajes: 1-2 garajes son óptimos
-            if garajes_col and garajes_col in ds_segmento.columns:
-                garajes = pd.to_numeric(ds_segmento.loc[idx, garajes_col], errors='coerce')
-                if pd.notna(garajes) and garajes >= 0:
-                    num_caracteristicas += 1
-                    if 1 <= garajes <= 2:
-                        suma_scores += 1.0
-                    elif garajes == 0 or garajes == 3:
-                        suma_scores += 0.6
-                    else:
-                        suma_scores += 0.4
-            
-            if num_caracteristicas > 0:
-                score_caracteristicas = suma_scores / num_caracteristicas
-            else:
-                score_caracteristicas = 0.5
-            
-            # 8. Score de número de amenidades - PESO 3%
-            # Proyectos con más amenidades tienden a ser más exitosos
-            if col_otros and col_otros in ds_segmento.columns:
-                otros_val = ds_segmento.loc[idx, col_otros]
-                if pd.notna(otros_val) and str(otros_val).strip():
-                    otros_str = str(otros_val).strip()
-                    amenidades = [a.strip() for a in otros_str.split(',') if a.strip()]
-                    num_amenidades = len(amenidades)
-                else:
-                    num_amenidades = 0
-                
-                if mediana_num_amenidades_seg > 0:
-                    # Normalizar respecto a la mediana del segmento
-                    if num_amenidades >= mediana_num_amenidades_seg * 1.5:
-                        score_amenidades = 1.0  # Muchas amenidades
-                    elif num_amenidades >= mediana_num_amenidades_seg:
-                        score_amenidades = 0.8  # Amenidades promedio-alto
-                    elif num_amenidades >= mediana_num_amenidades_seg * 0.5:
-                        score_amenidades = 0.6  # Amenidades promedio-bajo
-                    else:
-                        score_amenidades = 0.3  # Pocas amenidades
-                else:
-                    # Si no hay mediana, usar valores absolutos
-                    if num_amenidades >= 10:
-                        score_amenidades = 1.0
-                    elif num_amenidades >= 5:
-                        score_amenidades = 0.7
-                    elif num_amenidades >= 2:
-                        score_amenidades = 0.5
-                    else:
-                        score_amenidades = 0.3
-            else:
-                score_amenidades = 0.5
-            
-            # 9. Score de patrón de ventas - PESO 2%
-            patron = str(ds_segmento.loc[idx, 'Patron_Ventas'] if 'Patron_Ventas' in ds_segmento.columns else 'Sin datos')
-            if 'Acelerado' in patron:
-                score_patron = 1.0
-            elif 'Constante' in patron:
-                score_patron = 0.7
-            elif 'Desacelerado' in patron:
-                score_patron = 0.3
-            else:
-                score_patron = 0.5
-            
-            # 10. Score de antigüedad del proyecto y eficiencia temporal - PESO 10%
-            # TIEMPO OBJETIVO: 24 meses (2 años) para cerrar un proyecto exitoso
-            # Si el proyecto está inactivo (Unidades_Disponibles = 0), el tiempo total es solo meses_desde_inicio
-            # Si el proyecto está activo, el tiempo total es meses_desde_inicio + meses_para_agotar
-            score_antiguedad = 1.0  # Por defecto, no hay penalización
-            meses_desde_inicio = pd.to_numeric(ds_segmento.loc[idx, 'meses_desde_inicio'] if 'meses_desde_inicio' in ds_segmento.columns else 0, errors='coerce')
-            meses_para_agotar = pd.to_numeric(ds_segmento.loc[idx, 'meses_para_agotar'] if 'meses_para_agotar' in ds_segmento.columns else 0, errors='coerce')
-            porcentaje_vendido = pd.to_numeric(ds_segmento.loc[idx, '_porcentaje_vendido_feat'] if '_porcentaje_vendido_feat' in ds_segmento.columns else 0, errors='coerce')
-            
-            # Verificar si el proyecto está activo o inactivo
-            un_disp_col = cols_proy.get('un_disp', '')
-            un_disp_col_num = un_disp_col + "_num" if (un_disp_col + "_num") in ds_segmento.columns else un_disp_col
-            unidades_disponibles = 0
-            proyecto_activo = True  # Por defecto, asumir activo
-            
-            if un_disp_col_num and un_disp_col_num in ds_segmento.columns:
-                unidades_disponibles = pd.to_numeric(ds_segmento.loc[idx, un_disp_col_num], errors='coerce')
-                if pd.notna(unidades_disponibles):
-                    proyecto_activo = unidades_disponibles > 0
-                else:
-                    proyecto_activo = True  # Si no se puede determinar, asumir activo
-            
-            TIEMPO_OBJETIVO_MESES = 24  # 2 años es el tiempo objetivo para cerrar un proyecto exitoso
-            
-            if pd.notna(meses_desde_inicio) and meses_desde_inicio >= 0:
-                # Calcular tiempo total para cerrar el proyecto
-                if not proyecto_activo:
-                    # Proyecto inactivo: ya se vendió todo, el tiempo total es solo meses_desde_inicio
-                    tiempo_total_cierre = meses_desde_inicio
-                else:
-                    # Proyecto activo: tiempo total = meses desde inicio + meses para agotar
-                    tiempo_total_cierre = meses_desde_inicio + (meses_para_agotar if pd.notna(meses_para_agotar) and meses_para_agotar > 0 else 0)
-                
-                # Evaluar eficiencia temporal basada en tiempo objetivo de 24 meses
-                if pd.notna(tiempo_total_cierre) and tiempo_total_cierre > 0:
-                    # Proyectos que cerraron/completaron en menos de 24 meses: excelente (score alto)
-                    if tiempo_total_cierre <= TIEMPO_OBJETIVO_MESES:
-                        # Recompensar proyectos que cerraron rápido
-                        ratio_tiempo = tiempo_total_cierre / TIEMPO_OBJETIVO_MESES  # 0 a 1
-                        score_antiguedad = 1.0 - (ratio_tiempo * 0.3)  # Entre 0.7 y 1.0 (mejor si cerró más rápido)
-                    # Proyectos que tomarán/ tomaron entre 24 y 36 meses: aceptable (score medio-alto)
-                    elif tiempo_total_cierre <= 36:  # Hasta 3 años
-                        # Penalización leve por exceder el tiempo objetivo
-                        exceso_tiempo = tiempo_total_cierre - TIEMPO_OBJETIVO_MESES  # 0 a 12 meses
-                        factor_penalizacion = exceso_tiempo / 12.0  # 0 a 1
-                        score_antiguedad = 0.7 - (factor_penalizacion * 0.2)  # Entre 0.5 y 0.7
-                    # Proyectos que tomarán/ tomaron entre 36 y 48 meses: problemático (score medio)
-                    elif tiempo_total_cierre <= 48:  # Hasta 4 años
-                        exceso_tiempo = tiempo_total_cierre - TIEMPO_OBJETIVO_MESES  # 12 a 24 meses
-                        factor_penalizacion = min(1.0, exceso_tiempo / 24.0)  # 0.5 a 1.0
-                        score_antiguedad = 0.5 - (factor_penalizacion * 0.2)  # Entre 0.3 y 0.5
-                    # Proyectos que tomarán/ tomaron más de 48 meses: muy problemático (score bajo)
-                    else:  # Más de 4 años
-                        exceso_tiempo = tiempo_total_cierre - TIEMPO_OBJETIVO_MESES  # Más de 24 meses
-                        factor_penalizacion = min(1.0, exceso_tiempo / 48.0)  # Puede exceder 1.0
-                        score_antiguedad = max(0.1, 0.3 - (factor_penalizacion * 0.2))  # Entre 0.1 y 0.3
-                    
-                    # Penalización adicional para proyectos activos antiguos con bajo porcentaje vendido
-                    if proyecto_activo and pd.notna(porcentaje_vendido):
-                        # Si el proyecto está activo y ha pasado mucho tiempo desde inicio con bajo % vendido
-                        if meses_desde_inicio > TIEMPO_OBJETIVO_MESES and porcentaje_vendido < 50:
-                            # Penalización adicional: proyectos activos que llevan más de 2 años con menos del 50% vendido
-                            factor_penalizacion_adicional = (TIEMPO_OBJETIVO_MESES - porcentaje_vendido) / TIEMPO_OBJETIVO_MESES
-                            score_antiguedad = score_antiguedad * (1.0 - factor_penalizacion_adicional * 0.3)  # Reducir hasta 30%
-                        elif meses_desde_inicio > 36 and porcentaje_vendido < 70:
-                            # Proyectos activos con más de 3 años y menos del 70% vendido
-                            factor_penalizacion_adicional = (70 - porcentaje_vendido) / 70.0
-                            score_antiguedad = score_antiguedad * (1.0 - factor_penalizacion_adicional * 0.2)  # Reducir hasta 20%
-                
-                # Asegurar que score_antiguedad esté en rango válido
-                score_antiguedad = max(0.0, min(1.0, score_antiguedad))
-            
-            # Score compuesto ponderado MEJORADO con penalización por antigüedad
-            score_compuesto = (
-                score_velocidad * 0.30 +      # Meses para agotar (invertido) - Reducido de 35% a 30%
-                score_vel_ventas * 0.18 +     # Velocidad de ventas - Reducido de 20% a 18%
-                score_porcentaje * 0.12 +     # Porcentaje vendido - Reducido de 15% a 12%
-                score_antiguedad * 0.10 +     # Antigüedad y eficiencia temporal (NUEVO) - 10%
-                score_tamano * 0.07 +         # Tamaño del proyecto - Reducido de 8% a 7%
-                score_precio_m2 * 0.07 +      # Precio/m² - Reducido de 8% a 7%
-                score_area * 0.05 +           # Área promedio - 5%
-                score_caracteristicas * 0.04 + # Características inmuebles - 4%
-                score_amenidades * 0.03 +     # Número de amenidades - 3%
-                score_patron * 0.02           # Patrón de ventas - 2%
-            )
-            
-            # Clasificación basada en score compuesto
-            if score_compuesto >= 0.67:
-                clasificacion = 'Exitoso'
-            elif score_compuesto >= 0.33:
-                clasificacion = 'Moderado'
-            else:
-                clasificacion = 'Mejorable'
-            
-            # Ajustar score para que coincida con los rangos esperados
-            if clasificacion == 'Exitoso':
-                score_final = 0.62 + (score_compuesto * 0.17)  # Rango: 0.62 - 0.79
-            elif clasificacion == 'Moderado':
-                score_final = 0.50 + (score_compuesto * 0.12)  # Rango: 0.50 - 0.62
-            else:
-                score_final = 0.21 + (score_compuesto * 0.29)  # Rango: 0.21 - 0.50
-            
-            ds.loc[idx, 'Clasificacion'] = clasificacion
-            ds.loc[idx, 'Score_Exito'] = float(max(0.0, min(1.0, score_final)))
-            ds.loc[idx, '_metodo_clasificacion'] = f'Segmento: {segmento} (Multi-variable)'
-        
-        print(f"  Segmento '{segmento}': {len(valid_segmento)} proyectos clasificados")
-        if len(valid_segmento) > 0:
-            exitosos = (ds.loc[ds_segmento[valid_mask].index, 'Clasificacion'] == 'Exitoso').sum()
-            moderados = (ds.loc[ds_segmento[valid_mask].index, 'Clasificacion'] == 'Moderado').sum()
-            mejorables = (ds.loc[ds_segmento[valid_mask].index, 'Clasificacion'] == 'Mejorable').sum()
+        print(f"  Segmento '{segmento}': {len(resultado)} proyectos clasificados")
+        if len(resultado) > 0:
+            exitosos = (resultado['Clasificacion'] == 'Exitoso').sum()
+            moderados = (resultado['Clasificacion'] == 'Moderado').sum()
+            mejorables = (resultado['Clasificacion'] == 'Mejorable').sum()
             print(f"    - Exitosos: {exitosos}, Moderados: {moderados}, Mejorables: {mejorables}")
+    for col, valores in columnas.items():
+        ds[col] = valores
+    
+    if hashes_ds is not None:
+        cache_segmentos.clear()
+        cache_segmentos.update(segmentos_calculados)
+        print(f"  ✓ Segmentos reutilizados sin recalcular: {reutilizados} de {len(segmentos)}")
     
     # Clasificar proyectos que aún tienen clasificación por defecto usando método global
     # Solo clasificar los que realmente no fueron clasificados por segmento
@@ -1629,23 +2164,15 @@ def clasificar_proyectos_por_segmento(ds, cols_proy):
             ds.loc[mask_pendiente, '_metodo_clasificacion'] = 'Por defecto (error)'
     
     # Ajustar score para que coincida con los rangos esperados
-    def ajustar_score(row):
-        score = pd.to_numeric(row.get('Score_Exito', 0.5), errors='coerce')
-        if pd.isna(score):
-            score = 0.5
-        
-        clasif = str(row.get('Clasificacion', 'Moderado')).strip()
-        
-        if clasif == 'Exitoso':
-            return float(0.62 + (score * 0.17))  # Rango: 0.62 - 0.79
-        elif clasif == 'Moderado':
-            return float(0.50 + (score * 0.12))  # Rango: 0.50 - 0.62
-        elif clasif == 'Mejorable':
-            return float(0.21 + (score * 0.29))  # Rango: 0.21 - 0.50
-        else:
-            return 0.5
-    
-    ds['Score_Exito'] = ds.apply(ajustar_score, axis=1).astype(float)
+    score = pd.to_numeric(ds['Score_Exito'], errors='coerce').fillna(0.5).to_numpy(dtype=float)
+    clasif = ds['Clasificacion'].astype(str).str.strip()
+    ds['Score_Exito'] = np.select(
+        [clasif == 'Exitoso', clasif == 'Moderado', clasif == 'Mejorable'],
+        [0.62 + (score * 0.17),   # Rango: 0.62 - 0.79
+         0.50 + (score * 0.12),   # Rango: 0.50 - 0.62
+         0.21 + (score * 0.29)],  # Rango: 0.21 - 0.50
+        0.5
+    ).astype(float)
     
     # GARANTIZAR que TODOS los proyectos tengan clasificación válida
     mask_invalida = ~ds['Clasificacion'].isin(['Exitoso', 'Moderado', 'Mejorable'])
@@ -1671,14 +2198,15 @@ def clasificar_proyectos_por_segmento(ds, cols_proy):
     
     return ds
 
-def clasificar_proyectos(ds, cols_proy):
+def clasificar_proyectos(ds, cols_proy, cache_segmentos=None, tabla_amenidades=None):
     """Función principal de clasificación que incluye validación y clasificación por segmentos.
     GARANTIZA que todos los proyectos tengan clasificación válida."""
     # 1. Validar datos y detectar anomalías
     ds = validar_datos(ds, cols_proy)
     
     # 2. Clasificar por segmentos
-    ds = clasificar_proyectos_por_segmento(ds, cols_proy)
+    ds = clasificar_proyectos_por_segmento(ds, cols_proy, cache_segmentos=cache_segmentos,
+                                           tabla_amenidades=tabla_amenidades)
     
     return ds
 
@@ -1698,147 +2226,109 @@ def determinar_patron_ventas(ds, cols):
         print("=" * 70)
         print()
         
-        ds_patron = ds.copy()
-        
         # Calcular porcentaje de ventas
-        ds_patron['_porcentaje_vendido'] = 0.0
+        porcentaje_calculado = np.zeros(len(ds))
         
-        if 'unidades_vendidas' in ds_patron.columns:
+        if 'unidades_vendidas' in ds.columns:
+            vendidas = pd.to_numeric(ds['unidades_vendidas'], errors='coerce')
+            
             # Intentar obtener unidades disponibles
             un_disp_col = None
             if cols['un_disp']:
-                un_disp_col = cols['un_disp'] + "_num" if (cols['un_disp'] + "_num") in ds_patron.columns else cols['un_disp']
-                if un_disp_col not in ds_patron.columns:
+                un_disp_col = cols['un_disp'] + "_num" if (cols['un_disp'] + "_num") in ds.columns else cols['un_disp']
+                if un_disp_col not in ds.columns:
                     un_disp_col = None
             
-            # Calcular total de unidades
+            # Calcular total de unidades (columna de total o, si no existe, vendidas + disponibles)
+            tot_un_col = None
             if cols['tot_un']:
-                tot_un_col = cols['tot_un'] + "_num" if (cols['tot_un'] + "_num") in ds_patron.columns else cols['tot_un']
-                if tot_un_col in ds_patron.columns:
-                    ds_patron['_total_unidades'] = pd.to_numeric(ds_patron[tot_un_col], errors='coerce').fillna(0)
-                else:
-                    # Fallback: sumar vendidas + disponibles
-                    if un_disp_col and un_disp_col in ds_patron.columns:
-                        ds_patron['_total_unidades'] = (
-                            pd.to_numeric(ds_patron['unidades_vendidas'], errors='coerce').fillna(0) +
-                            pd.to_numeric(ds_patron[un_disp_col], errors='coerce').fillna(0)
-                        )
-                    else:
-                        ds_patron['_total_unidades'] = pd.to_numeric(ds_patron['unidades_vendidas'], errors='coerce').fillna(0)
+                tot_un_col = cols['tot_un'] + "_num" if (cols['tot_un'] + "_num") in ds.columns else cols['tot_un']
+            if tot_un_col and tot_un_col in ds.columns:
+                total_unidades = pd.to_numeric(ds[tot_un_col], errors='coerce').fillna(0)
+            elif un_disp_col:
+                total_unidades = vendidas.fillna(0) + pd.to_numeric(ds[un_disp_col], errors='coerce').fillna(0)
             else:
-                # Si no hay total, sumar vendidas + disponibles
-                if un_disp_col and un_disp_col in ds_patron.columns:
-                    ds_patron['_total_unidades'] = (
-                        pd.to_numeric(ds_patron['unidades_vendidas'], errors='coerce').fillna(0) +
-                        pd.to_numeric(ds_patron[un_disp_col], errors='coerce').fillna(0)
-                    )
-                else:
-                    ds_patron['_total_unidades'] = pd.to_numeric(ds_patron['unidades_vendidas'], errors='coerce').fillna(0)
+                total_unidades = vendidas.fillna(0)
             
             # Calcular porcentaje vendido
             mask_total_valido = (
-                (ds_patron['_total_unidades'] > 0) & 
-                ds_patron['_total_unidades'].notna() &
-                ds_patron['unidades_vendidas'].notna()
-            )
+                (total_unidades > 0) & 
+                total_unidades.notna() &
+                ds['unidades_vendidas'].notna()
+            ).to_numpy()
             if mask_total_valido.any():
-                ds_patron.loc[mask_total_valido, '_porcentaje_vendido'] = (
-                    pd.to_numeric(ds_patron.loc[mask_total_valido, 'unidades_vendidas'], errors='coerce') / 
-                    ds_patron.loc[mask_total_valido, '_total_unidades'] * 100
-                ).clip(upper=100)
-        else:
-            ds_patron['_total_unidades'] = 0
+                porcentaje_calculado[mask_total_valido] = (
+                    vendidas[mask_total_valido] / total_unidades[mask_total_valido] * 100
+                ).clip(upper=100).to_numpy(dtype=float, na_value=np.nan)
         
         # Calcular velocidad promedio por segmento (si existe)
-        if '_segmento' in ds_patron.columns and 'velocidad_ventas' in ds_patron.columns:
-            # Calcular promedio por segmento, excluyendo valores inválidos
-            velocidad_valida = pd.to_numeric(ds_patron['velocidad_ventas'], errors='coerce').replace([np.inf, -np.inf], np.nan)
-            velocidad_prom_segmento = ds_patron.groupby('_segmento')['velocidad_ventas'].transform('mean')
+        if '_segmento' in ds.columns and 'velocidad_ventas' in ds.columns:
+            velocidad_prom_segmento = ds.groupby('_segmento')['velocidad_ventas'].transform('mean')
             # Reemplazar valores inválidos en el resultado
             velocidad_prom_segmento = pd.to_numeric(velocidad_prom_segmento, errors='coerce').replace([np.inf, -np.inf], np.nan)
-            ds_patron['_velocidad_prom_segmento'] = velocidad_prom_segmento.fillna(0)
+            velocidad_prom_seg = velocidad_prom_segmento.fillna(0).to_numpy(dtype=float, na_value=np.nan)
+        elif 'velocidad_ventas' in ds.columns:
+            velocidad_valida = pd.to_numeric(ds['velocidad_ventas'], errors='coerce').replace([np.inf, -np.inf], np.nan)
+            velocidad_prom_global = velocidad_valida.mean()
+            velocidad_prom_seg = np.full(len(ds), velocidad_prom_global if not pd.isna(velocidad_prom_global) else 0.0)
         else:
-            if 'velocidad_ventas' in ds_patron.columns:
-                velocidad_valida = pd.to_numeric(ds_patron['velocidad_ventas'], errors='coerce').replace([np.inf, -np.inf], np.nan)
-                velocidad_prom_global = velocidad_valida.mean()
-                ds_patron['_velocidad_prom_segmento'] = velocidad_prom_global if not pd.isna(velocidad_prom_global) else 0
-            else:
-                ds_patron['_velocidad_prom_segmento'] = 0
-        
-        def patron_mejorado(row):
-            """Determina el patrón de ventas considerando múltiples factores."""
-            # Asegurar tipos numéricos correctos
-            velocidad = pd.to_numeric(row.get('velocidad_ventas', 0), errors='coerce')
-            meses_desde_inicio = pd.to_numeric(row.get('meses_desde_inicio', 0), errors='coerce')
-            porcentaje_vendido = pd.to_numeric(row.get('_porcentaje_vendido_feat', row.get('_porcentaje_vendido', 0)), errors='coerce')
-            velocidad_prom_seg = pd.to_numeric(row.get('_velocidad_prom_segmento', 0), errors='coerce')
-            
-            # Rellenar NaN con valores por defecto
-            if pd.isna(velocidad):
-                velocidad = 0.0
-            if pd.isna(meses_desde_inicio):
-                meses_desde_inicio = 0.0
-            if pd.isna(porcentaje_vendido):
-                porcentaje_vendido = 0.0
-            if pd.isna(velocidad_prom_seg):
-                velocidad_prom_seg = velocidad if velocidad > 0 else 1.0
-            
-            # Validar datos
-            if velocidad <= 0:
-                return 'Sin datos'
-            
-            # Asegurar que velocidad_prom_seg sea positiva
-            if velocidad_prom_seg <= 0:
-                velocidad_prom_seg = velocidad  # Usar velocidad propia como referencia
-            
-            # Calcular ratio de velocidad vs promedio del segmento
-            ratio_velocidad = velocidad / velocidad_prom_seg if velocidad_prom_seg > 0 else 1.0
-            
-            # Factor de tiempo: proyectos más antiguos deberían tener más vendido
-            factor_tiempo = 1.0
-            if meses_desde_inicio > 0 and porcentaje_vendido >= 0:
-                # Esperado: ~2-3% por mes en proyectos exitosos
-                porcentaje_esperado = min(meses_desde_inicio * 2.5, 100)
-                if porcentaje_vendido < porcentaje_esperado * 0.5:
-                    factor_tiempo = 0.7  # Desacelerado
-                elif porcentaje_vendido > porcentaje_esperado * 1.5:
-                    factor_tiempo = 1.3  # Acelerado
-            
-            # Clasificación mejorada
+            velocidad_prom_seg = np.zeros(len(ds))
+        
+        # Entradas numéricas, con NaN rellenado por los valores por defecto
+        def _sin_nan(valores):
+            return np.where(np.isnan(valores), 0.0, valores)
+        
+        velocidad = _sin_nan(_numerica(ds, 'velocidad_ventas'))
+        meses_desde_inicio = _sin_nan(_numerica(ds, 'meses_desde_inicio'))
+        if '_porcentaje_vendido_feat' in ds.columns:
+            porcentaje_vendido = _sin_nan(_numerica(ds, '_porcentaje_vendido_feat'))
+        else:
+            porcentaje_vendido = _sin_nan(porcentaje_calculado)
+        velocidad_prom_seg = np.where(np.isnan(velocidad_prom_seg), np.where(velocidad > 0, velocidad, 1.0), velocidad_prom_seg)
+        
+        # Si el promedio del segmento no es positivo, usar la velocidad propia como referencia
+        velocidad_prom_seg = np.where(velocidad_prom_seg <= 0, velocidad, velocidad_prom_seg)
+        
+        # Ratio de velocidad vs promedio del segmento
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio_velocidad = np.where(velocidad_prom_seg > 0, velocidad / velocidad_prom_seg, 1.0)
+        
+        # Factor de tiempo: proyectos más antiguos deberían tener más vendido
+        # (esperado: ~2-3% por mes en proyectos exitosos)
+        porcentaje_esperado = np.minimum(meses_desde_inicio * 2.5, 100)
+        con_tiempo = (meses_desde_inicio > 0) & (porcentaje_vendido >= 0)
+        factor_tiempo = np.select(
+            [con_tiempo & (porcentaje_vendido < porcentaje_esperado * 0.5),
+             con_tiempo & (porcentaje_vendido > porcentaje_esperado * 1.5)],
+            [0.7, 1.3], 1.0
+        )
+        
+        # Clasificación mejorada (el orden de las condiciones define la prioridad)
+        condiciones = [
+            # Sin datos: velocidad no positiva
+            velocidad <= 0,
             # Acelerado: Alta velocidad Y alta penetración Y ratio > 1.2
-            if (velocidad > 15 and 
-                ratio_velocidad > 1.2 and 
-                (porcentaje_vendido > 30 or factor_tiempo >= 1.2)):
-                return 'Acelerado'
-            
+            (velocidad > 15) & (ratio_velocidad > 1.2) & ((porcentaje_vendido > 30) | (factor_tiempo >= 1.2)),
             # Desacelerado: Baja velocidad O baja penetración O ratio < 0.8
-            if (velocidad < 8 or 
-                ratio_velocidad < 0.8 or 
-                (meses_desde_inicio > 12 and porcentaje_vendido < 20)):
-                return 'Desacelerado'
-            
+            (velocidad < 8) | (ratio_velocidad < 0.8) | ((meses_desde_inicio > 12) & (porcentaje_vendido < 20)),
             # Constante: Velocidad media, ratio cercano a 1, penetración normal
-            if (8 <= velocidad <= 15 and 
-                0.8 <= ratio_velocidad <= 1.2):
-                return 'Constante'
-            
+            (velocidad >= 8) & (velocidad <= 15) & (ratio_velocidad >= 0.8) & (ratio_velocidad <= 1.2),
             # Clasificación por velocidad si no hay otros datos
-            if velocidad > 15:
-                return 'Acelerado'
-            elif velocidad >= 8:
-                return 'Constante'
-            else:
-                return 'Desacelerado'
+            velocidad > 15,
+            velocidad >= 8,
+        ]
+        patrones = ['Sin datos', 'Acelerado', 'Desacelerado', 'Constante', 'Acelerado', 'Constante']
+        patron_ventas = np.select(condiciones, patrones, 'Desacelerado').astype(object)
         
-        ds_patron['Patron_Ventas'] = ds_patron.apply(patron_mejorado, axis=1)
+        # Quitar columnas temporales que pudiera traer el DataFrame de entrada
+        columnas_temp = ['_porcentaje_vendido', '_total_unidades', '_velocidad_prom_segmento']
+        ds_patron = ds.drop(columns=[col for col in columnas_temp if col in ds.columns])
+        ds_patron['Patron_Ventas'] = pd.Series(patron_ventas, index=ds.index, dtype=object)
         
         # GARANTIZAR que todos tengan un patrón válido
-        if 'Patron_Ventas' not in ds_patron.columns:
-            ds_patron['Patron_Ventas'] = 'Sin datos'
-        else:
-            mask_sin_patron = ds_patron['Patron_Ventas'].isna() | (ds_patron['Patron_Ventas'] == '')
-            if mask_sin_patron.any():
-                ds_patron.loc[mask_sin_patron, 'Patron_Ventas'] = 'Sin datos'
+        mask_sin_patron = ds_patron['Patron_Ventas'].isna() | (ds_patron['Patron_Ventas'] == '')
+        if mask_sin_patron.any():
+            ds_patron.loc[mask_sin_patron, 'Patron_Ventas'] = 'Sin datos'
         
         # Resumen de patrones
         patrones = ds_patron['Patron_Ventas'].value_counts()
@@ -1847,12 +2337,6 @@ def determinar_patron_ventas(ds, cols):
             print(f"    - {patron}: {count} proyectos")
         print()
         
-        # Limpiar columnas temporales
-        columnas_temp = ['_porcentaje_vendido', '_total_unidades', '_velocidad_prom_segmento']
-        for col in columnas_temp:
-            if col in ds_patron.columns:
-                ds_patron = ds_patron.drop(columns=[col], errors='ignore')
-        
         return ds_patron
     except Exception as e:
         print(f"⚠ Error en determinación de patrón de ventas: {str(e)}")
@@ -2319,13 +2803,54 @@ def generar_archivo_final(proj_ds, cols_proy, key_pry):
 # ANÁLISIS DE AMENIDADES
 # ============================================================================
 
-def analizar_amenidades(ds, col_otros, mostrar_resultados=True):
+def _resumen_amenidades(tabla, filas, n_proyectos, mostrar_resultados):
+    """Frecuencias de amenidades de las filas indicadas (None = todas) a partir de la tabla de amenidades."""
+    por_proyecto = tabla['por_proyecto'] if filas is None else tabla['por_proyecto'][filas]
+    total_amenidades = int(por_proyecto.sum())
+    proyectos_con_amenidades = int((por_proyecto > 0).sum())
+    
+    if total_amenidades == 0:
+        if mostrar_resultados:
+            print("  ⚠ No se encontraron amenidades en la columna 'Otros'")
+        return {}
+    
+    # Contar frecuencia de cada amenidad (suma por columnas de la matriz proyecto × amenidad),
+    # en el orden en que aparecen por primera vez en las filas analizadas
+    from collections import Counter
+    conteo = menciones_amenidades(tabla, filas)
+    codigos = tabla['codigo'] if filas is None else tabla['codigo'][filas[tabla['posicion']]]
+    frecuencia_amenidades = Counter({tabla['amenidades'][c]: int(conteo[c]) for c in pd.unique(codigos)})
+    
+    # Obtener las top amenidades
+    top_amenidades = frecuencia_amenidades.most_common(20)
+    
+    if mostrar_resultados:
+        print(f"  Total de amenidades encontradas: {total_amenidades}")
+        print(f"  Proyectos con amenidades: {proyectos_con_amenidades} de {n_proyectos}")
+        print(f"  Amenidades únicas: {len(frecuencia_amenidades)}")
+        print()
+        print("  Top-20 amenidades más comunes:")
+        for amenidad, count in top_amenidades:
+            porcentaje = (count / proyectos_con_amenidades * 100) if proyectos_con_amenidades > 0 else 0
+            print(f"    - {amenidad}: {count} proyectos ({porcentaje:.1f}%)")
+        print()
+    
+    return {
+        'total_amenidades': total_amenidades,
+        'proyectos_con_amenidades': proyectos_con_amenidades,
+        'amenidades_unicas': len(frecuencia_amenidades),
+        'frecuencia_amenidades': {k: int(v) for k, v in frecuencia_amenidades.items()},
+        'top_amenidades': {k: int(v) for k, v in top_amenidades}
+    }
+
+def analizar_amenidades(ds, col_otros, mostrar_resultados=True, tabla_amenidades=None):
     """Analiza las amenidades de los proyectos desde la columna 'Otros'.
     
     Args:
         ds: DataFrame con proyectos
         col_otros: Nombre de la columna 'Otros' que contiene amenidades separadas por ','
         mostrar_resultados: Si True, imprime los resultados (default: True)
+        tabla_amenidades: Tabla de construir_tabla_amenidades(ds, col_otros) ya calculada (opcional)
     
     Returns:
         dict: Diccionario con análisis de amenidades
@@ -2340,53 +2865,8 @@ def analizar_amenidades(ds, col_otros, mostrar_resultados=True):
             print("=" * 70)
             print()
         
-        # Extraer todas las amenidades
-        todas_amenidades = []
-        proyectos_con_amenidades = 0
-        
-        for idx, row in ds.iterrows():
-            otros_val = row.get(col_otros)
-            if pd.notna(otros_val) and str(otros_val).strip():
-                otros_str = str(otros_val).strip()
-                # Separar por coma
-                amenidades = [a.strip() for a in otros_str.split(',') if a.strip()]
-                todas_amenidades.extend(amenidades)
-                if amenidades:
-                    proyectos_con_amenidades += 1
-        
-        if not todas_amenidades:
-            if mostrar_resultados:
-                print("  ⚠ No se encontraron amenidades en la columna 'Otros'")
-            return {}
-        
-        # Normalizar nombres de amenidades (minúsculas, sin espacios extra)
-        amenidades_normalizadas = [a.lower().strip() for a in todas_amenidades]
-        
-        # Contar frecuencia de cada amenidad
-        from collections import Counter
-        frecuencia_amenidades = Counter(amenidades_normalizadas)
-        
-        # Obtener las top amenidades
-        top_amenidades = frecuencia_amenidades.most_common(20)
-        
-        if mostrar_resultados:
-            print(f"  Total de amenidades encontradas: {len(todas_amenidades)}")
-            print(f"  Proyectos con amenidades: {proyectos_con_amenidades} de {len(ds)}")
-            print(f"  Amenidades únicas: {len(frecuencia_amenidades)}")
-            print()
-            print("  Top-20 amenidades más comunes:")
-            for amenidad, count in top_amenidades:
-                porcentaje = (count / proyectos_con_amenidades * 100) if proyectos_con_amenidades > 0 else 0
-                print(f"    - {amenidad}: {count} proyectos ({porcentaje:.1f}%)")
-            print()
-        
-        return {
-            'total_amenidades': len(todas_amenidades),
-            'proyectos_con_amenidades': proyectos_con_amenidades,
-            'amenidades_unicas': len(frecuencia_amenidades),
-            'frecuencia_amenidades': {k: int(v) for k, v in frecuencia_amenidades.items()},
-            'top_amenidades': {k: int(v) for k, v in top_amenidades}
-        }
+        tabla = obtener_tabla_amenidades(ds, col_otros, tabla_amenidades)
+        return _resumen_amenidades(tabla, None, len(ds), mostrar_resultados)
         
     except Exception as e:
         if mostrar_resultados:
@@ -2395,12 +2875,13 @@ def analizar_amenidades(ds, col_otros, mostrar_resultados=True):
             traceback.print_exc()
         return {}
 
-def analizar_amenidades_exitosos(ds, cols_proy):
+def analizar_amenidades_exitosos(ds, cols_proy, tabla_amenidades=None):
     """Analiza las amenidades más comunes en proyectos exitosos.
     
     Args:
         ds: DataFrame con proyectos clasificados
         cols_proy: Diccionario con columnas de proyectos
+        tabla_amenidades: Tabla de construir_tabla_amenidades(ds, ...) ya calculada (opcional)
     
     Returns:
         dict: Diccionario con amenidades de proyectos exitosos
@@ -2411,16 +2892,16 @@ def analizar_amenidades_exitosos(ds, cols_proy):
             return {}
         
         # Filtrar proyectos exitosos
-        exitosos = ds[ds['Clasificacion'] == 'Exitoso'].copy()
+        mascara_exitosos = (ds['Clasificacion'] == 'Exitoso').to_numpy()
+        n_exitosos = int(mascara_exitosos.sum())
         
-        if len(exitosos) == 0:
+        if n_exitosos == 0:
             return {}
         
-        # Analizar amenidades de proyectos exitosos (sin imprimir)
-        analisis_exitosos = analizar_amenidades(exitosos, col_otros, mostrar_resultados=False)
-        
-        # Comparar con todos los proyectos (sin imprimir)
-        analisis_total = analizar_amenidades(ds, col_otros, mostrar_resultados=False)
+        # Analizar amenidades de proyectos exitosos y de todos los proyectos sobre la misma tabla
+        tabla = obtener_tabla_amenidades(ds, col_otros, tabla_amenidades)
+        analisis_exitosos = _resumen_amenidades(tabla, mascara_exitosos, n_exitosos, mostrar_resultados=False)
+        analisis_total = _resumen_amenidades(tabla, None, len(ds), mostrar_resultados=False)
         
         # Calcular amenidades más frecuentes en exitosos vs. total
         if analisis_exitosos and analisis_total:
@@ -2433,12 +2914,12 @@ def analizar_amenidades_exitosos(ds, cols_proy):
                 count_total = frecuencia_total.get(amenidad, 0)
                 if count_total > 0:
                     # Ratio: qué tan más común es en exitosos
-                    ratio = (count_exitosos / len(exitosos)) / (count_total / len(ds))
+                    ratio = (count_exitosos / n_exitosos) / (count_total / len(ds))
                     ratios[amenidad] = {
                         'frecuencia_exitosos': count_exitosos,
                         'frecuencia_total': count_total,
                         'ratio': float(ratio),
-                        'porcentaje_exitosos': float(count_exitosos / len(exitosos) * 100),
+                        'porcentaje_exitosos': float(count_exitosos / n_exitosos * 100),
                         'porcentaje_total': float(count_total / len(ds) * 100)
                     }
             
@@ -2472,7 +2953,7 @@ def analizar_amenidades_exitosos(ds, cols_proy):
 # ANÁLISIS DE CARACTERÍSTICAS DE PROYECTOS EXITOSOS
 # ============================================================================
 
-def analizar_caracteristicas_exitosos(ds, cols_proy):
+def analizar_caracteristicas_exitosos(ds, cols_proy, tabla_amenidades=None):
     """Analiza las características comunes de los proyectos exitosos.
     
     Args:
@@ -2808,7 +3289,7 @@ def analizar_caracteristicas_exitosos(ds, cols_proy):
             # Verificar si la columna existe en el dataset completo (ds), no solo en exitosos
             if col_otros in ds.columns:
                 print(f"  Analizando amenidades de proyectos exitosos (columna: {col_otros})...")
-                amenidades_exitosos = analizar_amenidades_exitosos(ds, cols_proy)
+                amenidades_exitosos = analizar_amenidades_exitosos(ds, cols_proy, tabla_amenidades)
                 if amenidades_exitosos:
                     caracteristicas['amenidades'] = amenidades_exitosos
                     print(f"  ✓ Amenidades analizadas y agregadas a características")
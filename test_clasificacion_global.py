@@ -0,0 +1,143 @@
+"""Pruebas de regresión de clasificar_proyectos_global y de los factores alternativos
+(vectorizados con np.select) contra la implementación anterior fila a fila.
+"""
+
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+
+from generar_clasificacion import clasificar_por_factores_alternativos, clasificar_proyectos_global
+
+VELOCIDADES_BORDE = [np.nan, -5, -0.1, 0, 0.5, 7.99, 8, 8.01, 14.99, 15, 15.01, 40, np.inf]
+PORCENTAJES_BORDE = [np.nan, -1, 0, 25, 25.01, 50, 50.01, 100]
+UNIDADES_BORDE = [np.nan, -3, 0, 20, 21, 50, 51, 300]
+COLUMNAS_FACTORES = ['velocidad_ventas', '_porcentaje_vendido_feat', 'unidades_vendidas']
+
+def _factores_referencia(row):
+    """Cascada de factores alternativos evaluada fila a fila (implementación anterior)."""
+    if 'velocidad_ventas' in row.index:
+        velocidad = pd.to_numeric(row.get('velocidad_ventas'), errors='coerce')
+        if pd.notna(velocidad) and velocidad > 0:
+            if velocidad > 15:
+                return ('Exitoso', 0.7)
+            elif velocidad >= 8:
+                return ('Moderado', 0.5)
+            else:
+                return ('Mejorable', 0.3)
+    if '_porcentaje_vendido_feat' in row.index:
+        porcentaje = pd.to_numeric(row.get('_porcentaje_vendido_feat'), errors='coerce')
+        if pd.notna(porcentaje) and porcentaje >= 0:
+            if porcentaje > 50:
+                return ('Exitoso', 0.7)
+            elif porcentaje > 25:
+                return ('Moderado', 0.5)
+            else:
+                return ('Mejorable', 0.3)
+    if 'unidades_vendidas' in row.index:
+        unidades = pd.to_numeric(row.get('unidades_vendidas'), errors='coerce')
+        if pd.notna(unidades) and unidades >= 0:
+            if unidades > 50:
+                return ('Exitoso', 0.65)
+            elif unidades > 20:
+                return ('Moderado', 0.5)
+            else:
+                return ('Mejorable', 0.35)
+    return ('Moderado', 0.5)
+
+def _global_referencia(ds):
+    """Clasificación global por cuantiles de meses_para_agotar (implementación anterior)."""
+    ds = ds.copy()
+    if 'meses_para_agotar' not in ds.columns:
+        ds['meses_para_agotar'] = np.nan
+    valid = pd.to_numeric(ds['meses_para_agotar'], errors='coerce')
+    valid_positive = valid[(valid > 0) & valid.notna()]
+    if len(valid_positive) >= 3:
+        q1 = valid_positive.quantile(0.33)
+        q2 = valid_positive.quantile(0.67)
+        max_meses = valid_positive.max()
+        min_meses = valid_positive.min()
+        rango = max_meses - min_meses
+
+        def calcular_score_y_clasificacion(idx):
+            x = pd.to_numeric(ds.loc[idx, 'meses_para_agotar'], errors='coerce')
+            if pd.isna(x) or x <= 0:
+                return _factores_referencia(ds.loc[idx])
+            if rango > 0:
+                score = float(max(0.0, min(1.0, 1.0 - ((x - min_meses) / rango))))
+            else:
+                score = 0.5
+            if x <= q1:
+                clasificacion = 'Exitoso'
+            elif x <= q2:
+                clasificacion = 'Moderado'
+            else:
+                clasificacion = 'Mejorable'
+            return (clasificacion, float(score))
+
+        resultados = ds.index.to_series().apply(calcular_score_y_clasificacion)
+    else:
+        resultados = ds.apply(_factores_referencia, axis=1)
+    return [r[0] for r in resultados], [float(r[1]) for r in resultados]
+
+def _dataset(n, semilla, meses=None):
+    rng = np.random.default_rng(semilla)
+    ds = pd.DataFrame({
+        'velocidad_ventas': rng.choice(VELOCIDADES_BORDE, n),
+        '_porcentaje_vendido_feat': rng.choice(PORCENTAJES_BORDE, n),
+        'unidades_vendidas': rng.choice(UNIDADES_BORDE, n),
+        'meses_para_agotar': rng.choice(meses, n) if meses is not None else
+                             np.where(rng.random(n) < 0.3, np.nan, rng.uniform(-5, 60, n)),
+    }, index=rng.permutation(n) * 7)
+    return ds
+
+def _clasificar(ds):
+    with contextlib.redirect_stdout(io.StringIO()):
+        resultado = clasificar_proyectos_global(ds.copy())
+    return resultado['Clasificacion'].tolist(), resultado['Score_Exito'].tolist()
+
+def _comparar(ds):
+    assert _clasificar(ds) == _global_referencia(ds)
+
+def test_factores_alternativos_borde():
+    ds = _dataset(400, 0)
+    for columnas in ([], ['velocidad_ventas'], ['velocidad_ventas', '_porcentaje_vendido_feat'], COLUMNAS_FACTORES):
+        parcial = ds.drop(columns=columnas + ['meses_para_agotar'])
+        for _, row in parcial.iterrows():
+            assert clasificar_por_factores_alternativos(row) == _factores_referencia(row)
+
+def test_factores_texto_y_nulos():
+    ds = pd.DataFrame({'velocidad_ventas': ['20', 'abc', None, '8', '-1'],
+                       '_porcentaje_vendido_feat': [None, '60', 'x', '10', None],
+                       'unidades_vendidas': ['1', '2', '70', None, '21']})
+    for _, row in ds.iterrows():
+        assert clasificar_por_factores_alternativos(row) == _factores_referencia(row)
+    _comparar(ds)
+
+def test_global_datos_aleatorios():
+    for semilla in range(10):
+        _comparar(_dataset(300, semilla))
+
+def test_global_valores_en_umbrales_de_cuantiles():
+    # Con pocos valores distintos los cuantiles 0.33 / 0.67 caen sobre valores presentes
+    meses = [np.nan, -2, 0, 3, 3, 6, 6, 6, 9, 12, 12]
+    for semilla in range(10):
+        ds = _dataset(120, semilla, meses)
+        positivos = ds['meses_para_agotar'][ds['meses_para_agotar'] > 0]
+        q1, q2 = positivos.quantile(0.33), positivos.quantile(0.67)
+        if semilla == 0:
+            assert positivos.isin([q1, q2]).any()
+        _comparar(ds)
+
+def test_global_rango_cero():
+    _comparar(_dataset(50, 3, [np.nan, 0, 10.0]))
+
+def test_global_menos_de_tres_positivos():
+    for positivos in (0, 1, 2):
+        ds = _dataset(60, positivos, [np.nan, 0, -1])
+        ds.iloc[:positivos, ds.columns.get_loc('meses_para_agotar')] = 5.0
+        _comparar(ds)
+
+def test_global_sin_columna_meses():
+    _comparar(_dataset(80, 5).drop(columns=['meses_para_agotar']))
@@ -0,0 +1,143 @@
+"""Pruebas de regresión de determinar_patron_ventas (vectorizada) contra las reglas fila a fila.
+
+Ejecutar como script para el micro-benchmark:  python test_patron_ventas.py
+"""
+
+import contextlib
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+from generar_clasificacion import determinar_patron_ventas
+
+COLS = {'un_disp': 'Un. Disponible Proyecto', 'tot_un': 'Tot. Un. Proyecto'}
+VALORES_BORDE = [np.nan, 0, -1, 0.5, 7.99, 8, 12, 15, 15.01, 20, 25, 29.9, 30, 31, 60, 100, 150, np.inf]
+
+def _patron_referencia(row):
+    """Reglas de patrón de ventas evaluadas fila a fila (implementación anterior)."""
+    velocidad = pd.to_numeric(row.get('velocidad_ventas', 0), errors='coerce')
+    meses_desde_inicio = pd.to_numeric(row.get('meses_desde_inicio', 0), errors='coerce')
+    porcentaje_vendido = pd.to_numeric(row.get('_porcentaje_vendido_feat', row.get('_porcentaje_vendido', 0)), errors='coerce')
+    velocidad_prom_seg = pd.to_numeric(row.get('_velocidad_prom_segmento', 0), errors='coerce')
+    velocidad = 0.0 if pd.isna(velocidad) else velocidad
+    meses_desde_inicio = 0.0 if pd.isna(meses_desde_inicio) else meses_desde_inicio
+    porcentaje_vendido = 0.0 if pd.isna(porcentaje_vendido) else porcentaje_vendido
+    if pd.isna(velocidad_prom_seg):
+        velocidad_prom_seg = velocidad if velocidad > 0 else 1.0
+    if velocidad <= 0:
+        return 'Sin datos'
+    if velocidad_prom_seg <= 0:
+        velocidad_prom_seg = velocidad
+    ratio_velocidad = velocidad / velocidad_prom_seg if velocidad_prom_seg > 0 else 1.0
+    factor_tiempo = 1.0
+    if meses_desde_inicio > 0 and porcentaje_vendido >= 0:
+        porcentaje_esperado = min(meses_desde_inicio * 2.5, 100)
+        if porcentaje_vendido < porcentaje_esperado * 0.5:
+            factor_tiempo = 0.7
+        elif porcentaje_vendido > porcentaje_esperado * 1.5:
+            factor_tiempo = 1.3
+    if velocidad > 15 and ratio_velocidad > 1.2 and (porcentaje_vendido > 30 or factor_tiempo >= 1.2):
+        return 'Acelerado'
+    if velocidad < 8 or ratio_velocidad < 0.8 or (meses_desde_inicio > 12 and porcentaje_vendido < 20):
+        return 'Desacelerado'
+    if 8 <= velocidad <= 15 and 0.8 <= ratio_velocidad <= 1.2:
+        return 'Constante'
+    if velocidad > 15:
+        return 'Acelerado'
+    return 'Constante' if velocidad >= 8 else 'Desacelerado'
+
+def _esperado(ds):
+    """Patrones de referencia: mismas columnas auxiliares que calculaba la versión anterior."""
+    ds = ds.copy()
+    ds['_porcentaje_vendido'] = 0.0
+    if 'unidades_vendidas' in ds.columns:
+        vendidas = pd.to_numeric(ds['unidades_vendidas'], errors='coerce')
+        if COLS['tot_un'] in ds.columns:
+            total = pd.to_numeric(ds[COLS['tot_un']], errors='coerce').fillna(0)
+        elif COLS['un_disp'] in ds.columns:
+            total = vendidas.fillna(0) + pd.to_numeric(ds[COLS['un_disp']], errors='coerce').fillna(0)
+        else:
+            total = vendidas.fillna(0)
+        mascara = (total > 0) & ds['unidades_vendidas'].notna()
+        ds.loc[mascara, '_porcentaje_vendido'] = (vendidas[mascara] / total[mascara] * 100).clip(upper=100)
+    if '_segmento' in ds.columns and 'velocidad_ventas' in ds.columns:
+        promedio = ds.groupby('_segmento')['velocidad_ventas'].transform('mean')
+        ds['_velocidad_prom_segmento'] = promedio.replace([np.inf, -np.inf], np.nan).fillna(0)
+    elif 'velocidad_ventas' in ds.columns:
+        promedio = pd.to_numeric(ds['velocidad_ventas'], errors='coerce').replace([np.inf, -np.inf], np.nan).mean()
+        ds['_velocidad_prom_segmento'] = 0 if pd.isna(promedio) else promedio
+    else:
+        ds['_velocidad_prom_segmento'] = 0
+    return ds.apply(_patron_referencia, axis=1)
+
+def _dataset(n, semilla, borde=False):
+    rng = np.random.default_rng(semilla)
+    if borde:
+        columnas = {c: rng.choice(VALORES_BORDE, n) for c in
+                    ['velocidad_ventas', 'meses_desde_inicio', '_porcentaje_vendido_feat',
+                     'unidades_vendidas', COLS['tot_un'], COLS['un_disp']]}
+    else:
+        columnas = {
+            'velocidad_ventas': np.where(rng.random(n) < 0.3, np.nan, rng.gamma(2.0, 6.0, n)),
+            'meses_desde_inicio': rng.uniform(0, 48, n),
+            '_porcentaje_vendido_feat': rng.uniform(0, 100, n),
+            'unidades_vendidas': rng.integers(0, 200, n).astype(float),
+            COLS['tot_un']: rng.integers(0, 300, n).astype(float),
+            COLS['un_disp']: rng.integers(0, 100, n).astype(float),
+        }
+    columnas['_segmento'] = rng.choice(['Norte|VIS', 'Sur|No VIS', 'Centro|VIS', None], n)
+    return pd.DataFrame(columnas, index=rng.permutation(n) * 3)
+
+def _patrones(ds):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return determinar_patron_ventas(ds.copy(), COLS)['Patron_Ventas']
+
+def _comparar(ds):
+    obtenido = _patrones(ds)
+    esperado = _esperado(ds)
+    assert obtenido.index.equals(ds.index)
+    assert obtenido.dtype == object
+    assert obtenido.tolist() == esperado.tolist()
+
+def test_datos_aleatorios():
+    for semilla in range(5):
+        _comparar(_dataset(500, semilla))
+
+def test_valores_borde():
+    for semilla in range(20):
+        _comparar(_dataset(80, semilla, borde=True))
+
+def test_columnas_faltantes():
+    ds = _dataset(300, 7, borde=True)
+    for columnas in (['_porcentaje_vendido_feat'], ['_porcentaje_vendido_feat', COLS['tot_un']],
+                     ['_porcentaje_vendido_feat', COLS['tot_un'], COLS['un_disp']],
+                     ['_segmento'], ['meses_desde_inicio'], ['unidades_vendidas', '_porcentaje_vendido_feat']):
+        _comparar(ds.drop(columns=columnas))
+
+def test_sin_velocidad():
+    ds = _dataset(50, 3).drop(columns=['velocidad_ventas'])
+    assert (_patrones(ds) == 'Sin datos').all()
+
+def test_no_modifica_entrada_ni_deja_temporales():
+    ds = _dataset(100, 11)
+    ds['_total_unidades'] = 1.0
+    original = ds.copy()
+    resultado = determinar_patron_ventas(ds, COLS)
+    pd.testing.assert_frame_equal(ds, original)
+    assert '_total_unidades' not in resultado.columns
+    assert '_velocidad_prom_segmento' not in resultado.columns
+    assert list(resultado.columns) == [c for c in original.columns if c != '_total_unidades'] + ['Patron_Ventas']
+
+if __name__ == '__main__':
+    # Micro-benchmark: reglas fila a fila vs. expresiones por columnas
+    for n in (1_000, 10_000, 50_000):
+        ds = _dataset(n, 0)
+        inicio = time.perf_counter()
+        _esperado(ds)
+        t_filas = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        _patrones(ds)
+        t_vector = time.perf_counter() - inicio
+        print(f"{n:>7} proyectos: fila a fila {t_filas * 1000:8.1f} ms | vectorizado {t_vector * 1000:7.1f} ms | x{t_filas / t_vector:.0f}")
@@ -0,0 +1,72 @@
+"""Pruebas de equivalencia entre to_num (celda a celda) y to_num_serie (vectorizada)"""
+
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from generar_clasificacion import to_num, to_num_serie
+
+VALORES_MIXTOS = [
+    None, np.nan, pd.NaT, pd.NA, float('inf'), float('-inf'),
+    0, -3, 12345678901234567890, True, False, 1.5, -0.0,
+    np.int64(5), np.float64(2.5), np.bool_(True), np.str_('7'), Decimal('1.5'),
+    pd.Timestamp('2024-01-31'), datetime(2023, 5, 1),
+    '1,234.5', '$ 1 000', '$1,000,000', ' 12 ', '\t42\n', '\xa08\xa0', '', '   ', ',', '$',
+    'abc', 'N/A', '-', 'nan', 'NaN', 'inf', '-Infinity', '1_000', '1e3', '2E-2', '.5', '5.',
+    '+7', '--5', '1.2.3', '0x10', '١٢', '12abc', '3,5', '1 234,56',
+    '0.1', '0.30000000000000004', '123456789012345678901234567890', '1e400', '-1e-400',
+]
+
+def _iguales(esperado, obtenido):
+    """Compara dos series de float bit a bit (NaN == NaN, -0.0 != 0.0)."""
+    assert len(esperado) == len(obtenido)
+    assert obtenido.dtype == np.float64
+    assert esperado.index.equals(obtenido.index)
+    a = esperado.to_numpy(dtype=float)
+    b = obtenido.to_numpy(dtype=float)
+    diferencias = [(i, x, y) for i, x, y in zip(esperado.index, a, b) if not (x == y or (np.isnan(x) and np.isnan(y)))]
+    assert not diferencias, diferencias[:10]
+    assert np.array_equal(np.signbit(a), np.signbit(b))
+
+def _comparar(serie):
+    esperado = serie.apply(to_num).astype(float)
+    _iguales(esperado, to_num_serie(serie))
+
+def test_valores_mixtos():
+    _comparar(pd.Series(VALORES_MIXTOS, dtype=object))
+
+def test_indice_no_consecutivo():
+    serie = pd.Series(VALORES_MIXTOS, index=range(100, 100 + 2 * len(VALORES_MIXTOS), 2), dtype=object)
+    _comparar(serie)
+
+def test_columnas_numericas():
+    _comparar(pd.Series([1, 2, 3], dtype='int64'))
+    _comparar(pd.Series([1.5, np.nan, -2.0]))
+    _comparar(pd.Series([True, False]))
+    _comparar(pd.Series([1, None], dtype='Int64'))
+
+def test_columnas_vacias_y_solo_nulos():
+    _comparar(pd.Series([], dtype=object))
+    _comparar(pd.Series([None, np.nan], dtype=object))
+    _comparar(pd.Series(['', ' '], dtype=object))
+
+def test_textos_aleatorios():
+    rng = np.random.default_rng(0)
+    alfabeto = list('0123456789.,$ -+eE') + ['', 'x']
+    textos = [''.join(rng.choice(alfabeto, size=rng.integers(0, 12))) for _ in range(5000)]
+    numeros = [f"${v:,.{rng.integers(0, 6)}f}" for v in rng.normal(0, 1e9, 2000)]
+    _comparar(pd.Series(textos + numeros, dtype=object))
+
+def test_hojas_del_excel():
+    """Todas las columnas de las hojas reales, si el Excel está disponible."""
+    archivo = Path(__file__).parent / 'Base Proyectos.xlsx'
+    if not archivo.exists():
+        return
+    from generar_clasificacion import cargar_datos
+    inm, pry = cargar_datos(str(archivo))
+    for df in (inm, pry):
+        for col in df.columns:
+            _comparar(df[col])